@@ -0,0 +1,221 @@
+"""Implements a benchmark of the solver pipeline: every stage of the Clarke and Wright algorithm is timed on seeded
+random problems (with and without wind), its peak memory is measured and the costs of the solutions are recorded. The
+results are stored in JSON files and compared with a baseline to catch speed, memory or quality regressions.
+Problems of more than DENSE_LIMIT clients are solved with granular savings (see processing.granular_savings): their
+n*n matrices don't fit in memory. Up to DENSE_LIMIT clients, the cost matrix is also timed under a wind field.
+benchmark_baseline.json holds the results of the default run (DEFAULT_SIZES, DEFAULT_WINDS, seed 0, repeat 3).
+Command line usage (see main): python -m pyDroneDeliv.benchmark --output new.json --baseline benchmark_baseline.json
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+
+DEFAULT_SIZES = (50, 200, 1000, 5000, 10000)  # numbers of clients of the benchmarked problems
+DEFAULT_WINDS = ((0., 0.), (3., -1.5))  # (x, y) speeds of the wind (m.s-1)
+DENSE_LIMIT = 2000  # above this number of clients, no n*n matrix is built and the savings are granular
+GRANULAR_NEIGHBOURS = 10  # number of neighbours of the granular savings
+WIND_FIELD_NODES = (15, 9)  # nodes of the wind field of the "wind_field_cost_matrix" stage on the x and y axes
+WIND_FIELD_SAMPLES = 32  # samples per segment of that wind field (see pre_processing.WindField)
+STAGES = ("cost_matrix", "wind_field_cost_matrix", "savings_matrix", "clarke_and_wright_init",
+          "sequential_build_deliveries", "parallel_build_deliveries", "cost_and_savings")  # the first three stages
+# are only benchmarked up to DENSE_LIMIT clients
+
+
+def measure(function, repeat=3, setup=None):
+    """Calls function repeat times and returns the tuple (time, peak_memory, result) where time is the best wall time
+    of the calls (s), peak_memory is the peak of the memory allocated during one more call traced by tracemalloc
+    (bytes, numpy arrays included) and result is the result of the last timed call. The tracing slows python code
+    down, so the traced call is not timed.
+    :param setup: function returning the tuple of the arguments of function. It is called before every call and is
+    neither timed nor traced."""
+    best_time, result = float("inf"), None
+    for _ in range(max(1, repeat)):
+        arguments = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = function(*arguments)
+        best_time = min(best_time, time.perf_counter() - start)
+    arguments = setup() if setup is not None else ()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best_time, peak_memory, result
+
+
+def benchmark_problem(clients, wind=(0., 0.), seed=0, repeat=3, drone=None, neighbours=None):
+    """Benchmarks every stage of STAGES on a random problem of the given number of clients (drawn with the seed) and
+    returns a dictionary with the keys "clients", "wind", "seed", "neighbours", "stages" (stage -> {"time": s,
+    "peak_memory": bytes}) and "cost" (version -> total cost of the solution built by that version of the algorithm).
+    :param neighbours: int or None. If given, both versions use the granular savings of that many neighbours and the
+    cost_matrix, wind_field_cost_matrix and savings_matrix stages are skipped. GRANULAR_NEIGHBOURS is used if None and
+    clients > DENSE_LIMIT.
+    The wind_field_cost_matrix stage times the cost matrix under a wind field (WIND_FIELD_NODES, WIND_FIELD_SAMPLES)
+    that varies around the given wind over the area of the clients."""
+    problem = pre.Problem(pre.Depot("benchmark depot", 0, 0))
+    problem.generate_random_clients(clients, (-6000, 6000), (-3500, 3500), (5, 60),
+                                    rng=np.random.default_rng([seed, clients]))
+    if drone is None:
+        drone = pre.Drone(450, 13.2, 0.018)
+    parameters = pre.DeliveryParameters(drone, pre.Wind(*wind), pro.cost_b)
+    if neighbours is None and clients > DENSE_LIMIT:
+        neighbours = GRANULAR_NEIGHBOURS
+    stages, cost = dict(), dict()
+
+    def record(stage, function, setup=None):
+        stage_time, peak_memory, result = measure(function, repeat, setup)
+        stages[stage] = {"time": stage_time, "peak_memory": peak_memory}
+        return result
+
+    c_matrix = table = None
+    if neighbours is None:
+        c_matrix = record("cost_matrix", lambda: pro.cost_matrix(problem, parameters))
+        field = pre.WindField.from_function(
+            lambda x, y: (wind[0] + np.sin(x / 3000.), wind[1] + 0.5 * np.cos(y / 2000.)),
+            np.linspace(-6000, 6000, WIND_FIELD_NODES[0]), np.linspace(-3500, 3500, WIND_FIELD_NODES[1]),
+            WIND_FIELD_SAMPLES)
+        field_parameters = pre.DeliveryParameters(drone, field, pro.cost_b)
+        record("wind_field_cost_matrix", lambda: pro.cost_matrix(problem, field_parameters))
+        record("savings_matrix", lambda: pro.savings_matrix(problem, parameters, c_matrix))
+        table = pro.cost_table(problem, parameters, c_matrix)
+    # the sequential version looks at every pair, the parallel one only at the positive savings (see clarke_and_wright)
+    init = {version: pro.clarke_and_wright_init(problem, parameters, "indices", version == "parallel", c_matrix,
+                                                neighbours=neighbours)
+            for version in ("sequential", "parallel")}
+    record("clarke_and_wright_init",
+           lambda: pro.clarke_and_wright_init(problem, parameters, "indices", True, c_matrix, neighbours=neighbours))
+    solutions = dict()
+    for version, build_deliveries in (("sequential", pro.sequential_build_deliveries),
+                                      ("parallel", pro.parallel_build_deliveries)):
+        deliveries_list = record(version + "_build_deliveries",
+                                 lambda: build_deliveries(problem, parameters, *init[version], cost_table=table))
+        solutions[version] = pre.Solution(version, deliveries_list, parameters)
+
+    def fresh_solution():  # new deliveries, so that their costs are not cached yet
+        return pre.Solution("parallel", [pre.Delivery(delivery.route, parameters, table)
+                                         for delivery in solutions["parallel"].deliveries_list], parameters),
+
+    record("cost_and_savings", lambda solution: solution.cost_and_savings(), fresh_solution)
+    for version, solution in solutions.items():
+        cost[version] = float(solution.cost_and_savings()[0])
+    return {"clients": clients, "wind": list(wind), "seed": seed, "neighbours": neighbours, "stages": stages,
+            "cost": cost}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, winds=DEFAULT_WINDS, seed=0, repeat=3, verbose=True):
+    """Benchmarks problems of every size of sizes under every wind of winds (see benchmark_problem) and returns a
+    dictionary with the keys "metadata" (versions of python and numpy, machine, seed, repeat) and "results" (list of
+    the results of benchmark_problem)."""
+    results = []
+    for clients in sizes:
+        for wind in winds:
+            if verbose:
+                print("Benchmarking {} clients, wind = {}...".format(clients, tuple(wind)), end=' ', flush=True)
+            results.append(benchmark_problem(clients, wind, seed, repeat))
+            if verbose:
+                print("done !")
+    metadata = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.platform(),
+                "processor": platform.processor(), "seed": seed, "repeat": repeat,
+                "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return {"metadata": metadata, "results": results}
+
+
+def save_results(results, file_name):
+    """Writes the results of run_benchmarks in a JSON file."""
+    with open(file_name, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(file_name):
+    """Reads results written by save_results."""
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.25, cost_tolerance=1e-6, min_time=0.005):
+    """Compares results with a baseline (both returned by run_benchmarks or load_results) and returns the list of the
+    regressions found, as strings. A stage regresses when it is slower than the baseline by more than time_tolerance
+    (relative) and min_time (s, below which timings are noise), or when its peak memory grows by more than
+    memory_tolerance (relative). A solution regresses when its cost grows by more than cost_tolerance (relative).
+    Problems that are not in both results (or not solved with the same neighbours) are ignored."""
+    def problem_key(entry):
+        return entry["clients"], tuple(entry["wind"]), entry["seed"], entry.get("neighbours")
+
+    reference = {problem_key(entry): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results["results"]:
+        old = reference.get(problem_key(entry))
+        if old is None:
+            continue
+        problem = "{} clients, wind = {}".format(entry["clients"], tuple(entry["wind"]))
+        for stage, new_stage in entry["stages"].items():
+            old_stage = old["stages"].get(stage)
+            if old_stage is None:
+                continue
+            if new_stage["time"] > old_stage["time"] * (1 + time_tolerance) and \
+                    new_stage["time"] - old_stage["time"] > min_time:
+                regressions.append("{}: {} time {:.4f} s -> {:.4f} s".format(problem, stage, old_stage["time"],
+                                                                            new_stage["time"]))
+            if new_stage["peak_memory"] > old_stage["peak_memory"] * (1 + memory_tolerance):
+                regressions.append("{}: {} peak memory {} -> {} bytes".format(problem, stage, old_stage["peak_memory"],
+                                                                             new_stage["peak_memory"]))
+        for version, new_cost in entry["cost"].items():
+            old_cost = old["cost"].get(version)
+            if old_cost is not None and new_cost > old_cost * (1 + cost_tolerance):
+                regressions.append("{}: {} cost {:.6e} -> {:.6e} J".format(problem, version, old_cost, new_cost))
+    return regressions
+
+
+def print_results(results):
+    """Prints a table of the timings (ms) and peak memories (MiB) of results."""
+    for entry in results["results"]:
+        granular = ", {} neighbours".format(entry["neighbours"]) if entry.get("neighbours") is not None else ""
+        print("{} clients, wind = {}{}. Cost: {}".format(entry["clients"], tuple(entry["wind"]), granular, ", ".join(
+            "{} = {:.5e}".format(version, cost) for version, cost in entry["cost"].items())))
+        for stage, values in entry["stages"].items():
+            print("    {:<30}{:>12.3f} ms{:>12.2f} MiB".format(stage, values["time"] * 1000,
+                                                             values["peak_memory"] / 1024 ** 2))
+
+
+def main(argv=None):
+    """Command line entry point. Runs the benchmarks, prints them, writes them in --output and compares them with
+    --baseline. Returns 1 if a regression is found, 0 otherwise."""
+    parser = argparse.ArgumentParser(description="Benchmarks the Clarke and Wright pipeline of pyDroneDeliv.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numbers of clients")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls per stage (the best is kept)")
+    parser.add_argument("--no-wind", action="store_true", help="only benchmark the problems without wind")
+    parser.add_argument("--output", help="JSON file where the results are written")
+    parser.add_argument("--baseline", help="JSON file of previous results to compare with")
+    parser.add_argument("--time-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--cost-tolerance", type=float, default=1e-6)
+    arguments = parser.parse_args(argv)
+
+    winds = DEFAULT_WINDS[:1] if arguments.no_wind else DEFAULT_WINDS
+    results = run_benchmarks(arguments.sizes, winds, arguments.seed, arguments.repeat)
+    print_results(results)
+    if arguments.output:
+        save_results(results, arguments.output)
+    if arguments.baseline:
+        regressions = compare(results, load_results(arguments.baseline), arguments.time_tolerance,
+                              arguments.memory_tolerance, arguments.cost_tolerance)
+        for regression in regressions:
+            print("Regression -", regression)
+        if regressions:
+            return 1
+        print("No regression against {}".format(arguments.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
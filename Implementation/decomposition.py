@@ -0,0 +1,162 @@
+"""Implements the geographic decomposition of large problems: the clients are split into regions that are solved
+separately (in a pool of processes) and the deliveries of all the regions are stitched into a single solution."""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+import pyDroneDeliv.local_search as ls
+
+
+def polar_sweep_regions(problem, regions):
+    """Returns the int numpy array of the region (from 0 to regions - 1) of every client. The clients are sorted by
+    their angle around the depot, starting after the largest empty angular sector, and the sorted list is cut into
+    regions holding the same total demand (as far as possible)."""
+    n = problem.number_of_clients
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    angles = np.arctan2(problem.y - problem.depot.y, problem.x - problem.depot.x)
+    order = np.argsort(angles, kind="stable")
+    sorted_angles = angles[order]
+    gaps = np.diff(np.concatenate((sorted_angles, [sorted_angles[0] + 2 * np.pi])))
+    order = np.roll(order, -(int(np.argmax(gaps)) + 1))  # the sweep starts after the largest gap
+    demand = problem.demand[order].astype(float)
+    total = demand.sum()
+    if total > 0:
+        before = np.cumsum(demand) - demand / 2  # demand swept up to the middle of each client
+        sorted_labels = np.minimum((before / total * regions).astype(int), regions - 1)
+    else:
+        sorted_labels = np.arange(n) * regions // n
+    labels = np.zeros(n, dtype=int)
+    labels[order] = sorted_labels
+    return labels
+
+
+def kmeans_regions(problem, regions, rng=0, iterations=100):
+    """Returns the int numpy array of the region (from 0 to regions - 1) of every client computed with the k-means
+    algorithm on the coordinates of the clients (k-means++ initialisation with the random generator or seed rng). An
+    empty region gets the client the farthest from its center among the regions that have more than one client."""
+    rng = np.random.default_rng(rng)
+    points = np.column_stack((problem.x, problem.y))
+    n = len(points)
+    regions = min(regions, n)
+    if regions <= 1:
+        return np.zeros(n, dtype=int)
+    centers = [points[rng.integers(n)]]
+    distances = np.square(points - centers[0]).sum(axis=1)
+    for _ in range(1, regions):
+        weights = distances / distances.sum() if distances.sum() > 0 else None
+        centers.append(points[rng.choice(n, p=weights)])
+        distances = np.minimum(distances, np.square(points - centers[-1]).sum(axis=1))
+    centers = np.array(centers)
+    labels = None
+    for _ in range(iterations):
+        squared_distances = (np.square(points[:, np.newaxis, :] - centers[np.newaxis, :, :])).sum(axis=2)
+        new_labels = np.argmin(squared_distances, axis=1)
+        counts = np.bincount(new_labels, minlength=regions)
+        for empty in np.flatnonzero(counts == 0).tolist():
+            # only a region keeping at least one client can give one (there is one since regions <= n)
+            candidates = np.where(counts[new_labels] > 1, squared_distances[np.arange(n), new_labels], -1.)
+            farthest = int(np.argmax(candidates))
+            counts[new_labels[farthest]] -= 1
+            counts[empty] += 1
+            new_labels[farthest] = empty
+            squared_distances[farthest] = 0.
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=regions)
+        centers = np.column_stack((np.bincount(labels, points[:, 0], regions),
+                                   np.bincount(labels, points[:, 1], regions))) / counts[:, np.newaxis]
+    return labels
+
+
+def repair_borders(problem, parameters, routes, labels, k=10):
+    """Improves the routes (lists of client indices) that cross or touch the border between two regions. A client is
+    on a border if one of its k nearest neighbours (see processing.grid_nearest_neighbours) is in an other region. The
+    routes holding border clients are improved together with the inter-route moves of local_search.improve_routes,
+    then each of them with the intra-route moves, on the cost matrix of their clients only.
+    :return: tuple (border_routes, repaired_routes, c_matrix, subproblem) where border_routes is the list of the
+    positions of the routes that went through the repair, repaired_routes is the list of the routes replacing them
+    and c_matrix is the cost matrix of subproblem, the problem made of their clients (it shares the clients of
+    problem)."""
+    neighbours = pro.grid_nearest_neighbours(problem.x, problem.y, k)
+    on_border = (labels[neighbours] != labels[:, np.newaxis]).any(axis=1)
+    border_routes = [j for j, route in enumerate(routes) if on_border[route].any()]
+    if not border_routes:
+        return [], [], None, None
+    indices = np.concatenate([routes[j] for j in border_routes])
+    position = {client: p for p, client in enumerate(indices.tolist())}
+    subproblem = problem.subproblem(indices)
+    c_matrix = pro.cost_matrix(subproblem, parameters)
+    local_routes = [[position[client] for client in routes[j]] for j in border_routes]
+    local_routes = ls.improve_routes(c_matrix, local_routes, subproblem.demand, parameters.drone.capacity,
+                                     ls.nearest_neighbours(c_matrix, k))
+    local_routes = [ls.improve_route(c_matrix, route) for route in local_routes]
+    return border_routes, [indices[route].tolist() for route in local_routes], c_matrix, subproblem
+
+
+def decomposed_clarke_and_wright(problem, parameters, regions, method="sweep", version="parallel", repair=False,
+                                 name=None, verbose=True, workers=None, neighbours=None, rng=0):
+    """Solves a large problem by splitting its clients into regions (method="sweep": see polar_sweep_regions,
+    method="kmeans": see kmeans_regions) and solving every region with the Clarke and Wright algorithm (see
+    processing.solve_routes) in a pool of processes (workers processes, os.cpu_count() if None). workers=0 solves them
+    in the current process. The deliveries of all the regions are stitched into a single solution that delivers every
+    client (except the ones whose demand exceeds the capacity of the drone, like clarke_and_wright). It is appended to
+    the end of the solutions list of the problem.
+    If repair is True, the routes along the borders between regions are improved afterwards (see repair_borders).
+    Scripts using a pool of processes must protect their entry point with 'if __name__ == "__main__":'.
+    :return: the array of the regions of the clients"""
+    if method == "sweep":
+        labels = polar_sweep_regions(problem, regions)
+    elif method == "kmeans":
+        labels = kmeans_regions(problem, regions, rng)
+    else:
+        raise ValueError("Unexpected method : {}. Please use 'sweep' or 'kmeans'".format(method))
+    if name is None:
+        name = "{} Clarke and Wright. {} regions ({}). Drone capacity = {}".format(version, regions, method,
+                                                                                  parameters.drone.capacity)
+    groups = [np.flatnonzero(labels == j) for j in range(int(labels.max()) + 1 if len(labels) else 0)]
+    subproblems = [problem.subproblem(indices) for indices in groups]
+
+    if verbose:
+        print("Solving {} regions...".format(len(groups)), end=' ', flush=True)
+    arguments = (subproblems, [parameters] * len(subproblems), [version] * len(subproblems),
+                 [None] * len(subproblems), [neighbours] * len(subproblems))
+    if workers == 0:
+        results = list(map(pro.solve_routes, *arguments))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(pro.solve_routes, *arguments))
+    routes, costs_and_savings = [], []
+    for indices, (region_routes, region_costs_and_savings) in zip(groups, results):
+        routes += [indices[route].tolist() for route in region_routes]
+        costs_and_savings += region_costs_and_savings
+    if verbose:
+        print("done !")
+
+    clients = problem.clients_list  # created before the repair so that its subproblem shares the clients
+    border_routes, repaired_routes, table = [], [], None
+    if repair and parameters.cost_fct:
+        if verbose:
+            print("Repairing the borders...", end=' ', flush=True)
+        border_routes, repaired_routes, c_matrix, subproblem = repair_borders(problem, parameters, routes, labels)
+        if c_matrix is not None:
+            table = pro.cost_table(subproblem, parameters, c_matrix)
+        if verbose:
+            print("done !")
+
+    deliveries_list = []
+    border_set = set(border_routes)
+    for j, route in enumerate(routes):
+        if j in border_set:
+            continue
+        delivery = pre.Delivery(pre.Route([clients[i] for i in route], problem.depot), parameters)
+        if parameters.cost_fct:
+            delivery.set_cost_and_savings(*costs_and_savings[j])
+        deliveries_list.append(delivery)
+    for route in repaired_routes:
+        deliveries_list.append(pre.Delivery(pre.Route([clients[i] for i in route], problem.depot), parameters, table))
+    problem.solutions_list.append(pre.Solution(name, deliveries_list, parameters))
+    if verbose:
+        problem.solutions_list[-1].print(False)
+    return labels
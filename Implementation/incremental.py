@@ -0,0 +1,223 @@
+"""Implements the incremental update of a solution when clients are added to or removed from a problem during the day:
+the cost matrix grows or shrinks by one row and one column, new clients are delivered by cheapest feasible insertion,
+removed ones are spliced out of their route, and only the routes around the change are improved again."""
+import numpy as np
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+import pyDroneDeliv.local_search as ls
+
+
+class IncrementalSolver:
+    """This class keeps the cost matrix and the routes of a solution of a problem up to date while clients are added
+    (see add_client) or removed (see remove_client), so that each update costs O(n) cost evaluations instead of a full
+    solve. The solution is patched in place: only the deliveries of the routes that change are replaced.
+    The matrix is stored in a larger buffer so that adding clients doesn't copy it every time. All the deliveries
+    share a cost table of the current matrix.
+    Every delivery of the solution must leave from the depot of the problem."""
+
+    def __init__(self, problem, solution=None, c_matrix=None, neighbours=10):
+        """:param problem: instance of class Problem
+        :param solution: instance of class Solution of the problem (the last one of its solutions list by default)
+        :param c_matrix: cost matrix of the problem for the parameters of the solution. Computed if None.
+        :param neighbours: number of nearest clients whose routes are improved with the changed route (see
+        reoptimize)"""
+        if solution is None:
+            solution = problem.solutions_list[-1]
+        if not solution.parameters.cost_fct:
+            raise ValueError("Unexpected cost function : None. Please use parameters with a cost function")
+        for delivery in solution.deliveries_list:
+            if delivery.depot is not problem.depot:
+                raise ValueError("Unexpected depot : {}. Please use a solution whose deliveries leave from the depot "
+                                 "of the problem".format(delivery.depot))
+        self.problem = problem
+        self.solution = solution
+        self.parameters = solution.parameters
+        self.neighbours = neighbours
+        if c_matrix is None:
+            c_matrix = pro.cost_matrix(problem, self.parameters)
+        self._size = len(c_matrix)  # number of rows/columns of the buffer in use
+        self._buffer = np.zeros((self._size + self._size // 4 + 16,) * 2)
+        self._buffer[:self._size, :self._size] = c_matrix
+        self.routes = ls.solution_routes(problem, solution)  # route j is the route of solution.deliveries_list[j]
+        self.table = None
+        self._update_table()
+
+    def __repr__(self):
+        return "<IncrementalSolver at {}. {} clients, {} routes>".format(hex(id(self)), self._size - 1,
+                                                                          len(self.routes))
+
+    @property
+    def c_matrix(self):
+        """Current cost matrix of the problem (view on the buffer, row/column i+1 is the i-th client)."""
+        return self._buffer[:self._size, :self._size]
+
+    @property
+    def cost(self):
+        """Total cost of the routes (J)."""
+        return sum(ls.route_cost(self.c_matrix, route) for route in self.routes)
+
+    def _update_table(self):
+        """Gives a cost table of the current matrix to every delivery (their cached costs are still valid)."""
+        self.table = pro.cost_table(self.problem, self.parameters, self.c_matrix)
+        for delivery in self.solution.deliveries_list:
+            delivery.cost_table = self.table
+
+    def _set_route(self, j, route):
+        """Replaces route j (and its delivery) or appends it if j is the number of routes."""
+        clients = self.problem.clients_list
+        delivery = pre.Delivery(pre.Route([clients[i] for i in route], self.problem.depot), self.parameters,
+                                self.table)
+        if j == len(self.routes):
+            self.routes.append(list(route))
+            self.solution.deliveries_list.append(delivery)
+        else:
+            self.routes[j] = list(route)
+            self.solution.deliveries_list[j] = delivery
+
+    def _delete_routes(self, positions):
+        for j in sorted(set(positions), reverse=True):
+            del self.routes[j]
+            del self.solution.deliveries_list[j]
+
+    def _route_of(self):
+        """Returns the int array of the route of every client (-1 if not delivered)."""
+        route_of = np.full(self._size - 1, -1, dtype=int)
+        for j, route in enumerate(self.routes):
+            route_of[route] = j
+        return route_of
+
+    def _nearby_routes(self, client, route_of):
+        """Returns the set of the routes of the nearest clients of client (round trip cost, like
+        local_search.nearest_neighbours)."""
+        n = self._size - 1
+        k = min(self.neighbours, n - 1)
+        if k <= 0:
+            return set()
+        matrix = self.c_matrix
+        round_trip = matrix[client + 1, 1:] + matrix[1:, client + 1]
+        round_trip[client] = np.inf
+        nearest = np.argpartition(round_trip, k - 1)[:k]
+        return set(route_of[nearest][route_of[nearest] >= 0].tolist())
+
+    def cheapest_insertion(self, client):
+        """Returns the tuple (delta, j, p) of the cheapest feasible insertion of client (index of a client that is not
+        delivered) at position p of route j. j is None if a new route is the cheapest. delta is the cost increase (J).
+        """
+        matrix = self.c_matrix
+        node = client + 1
+        demands = self.problem.demand
+        capacity = self.parameters.drone.capacity
+        best = (float(matrix[0, node] + matrix[node, 0]), None, 0)  # new route [client]
+        candidates = [j for j, route in enumerate(self.routes)
+                      if demands[route].sum() + demands[client] <= capacity]
+        if not candidates:
+            return best
+        nodes = [np.concatenate(([0], np.asarray(self.routes[j], dtype=int) + 1, [0])) for j in candidates]
+        origins = np.concatenate([route_nodes[:-1] for route_nodes in nodes])
+        destinations = np.concatenate([route_nodes[1:] for route_nodes in nodes])
+        deltas = matrix[origins, node] + matrix[node, destinations] - matrix[origins, destinations]
+        best_arc = int(np.argmin(deltas))
+        if deltas[best_arc] < best[0]:
+            starts = np.cumsum([0] + [len(route_nodes) - 1 for route_nodes in nodes])
+            r = int(np.searchsorted(starts, best_arc, side="right")) - 1
+            best = (float(deltas[best_arc]), candidates[r], best_arc - int(starts[r]))
+        return best
+
+    def reoptimize(self, positions):
+        """Improves the routes of the given positions together (inter-route moves, see local_search.improve_routes) and
+        then one by one (intra-route moves, see local_search.improve_route), on the rows of the matrix of their
+        clients only. Routes that become empty are removed.
+        :return: the energy saved (J)"""
+        positions = sorted(set(positions))
+        routes = [self.routes[j] for j in positions]
+        indices = [i for route in routes for i in route]
+        if not indices:
+            return 0.
+        rows = [0] + [i + 1 for i in indices]
+        matrix = self.c_matrix[np.ix_(rows, rows)]
+        local = {client: p for p, client in enumerate(indices)}
+        local_routes = [[local[i] for i in route] for route in routes]
+        before = sum(ls.route_cost(matrix, route) for route in local_routes)
+        if len(local_routes) > 1:
+            local_routes = ls.improve_routes(matrix, local_routes, self.problem.demand[indices],
+                                             self.parameters.drone.capacity,
+                                             ls.nearest_neighbours(matrix, self.neighbours))
+        local_routes = [ls.improve_route(matrix, route) for route in local_routes]
+        saved = before - sum(ls.route_cost(matrix, route) for route in local_routes)
+        if saved <= 0:
+            return 0.
+        for j, route in zip(positions, local_routes):
+            self._set_route(j, [indices[p] for p in route])
+        self._delete_routes(positions[len(local_routes):])
+        return saved
+
+    def add_client(self, client, reoptimize=True):
+        """Adds a client (instance of class Client) to the problem and delivers it: its row and column are added to the
+        cost matrix (2n+1 cost evaluations) and it is inserted where it increases the cost the least without
+        exceeding the capacity of the drone (possibly in a new route). A client whose demand exceeds the capacity is
+        added to the problem but not delivered (like in processing.clarke_and_wright).
+        If reoptimize is True, the route of the client and the routes of its nearest clients are improved (see
+        reoptimize).
+        :return: the position of the route delivering the client (None if it is not delivered)"""
+        problem = self.problem
+        problem.add_client(client)
+        m = self._size  # row/column of the new client
+        if m + 1 > len(self._buffer):
+            buffer = np.zeros((m + m // 4 + 16,) * 2)
+            buffer[:m, :m] = self._buffer[:m, :m]
+            self._buffer = buffer
+        points = np.arange(m + 1)
+        new = np.full(m + 1, m)
+        costs = pro.arc_costs(problem, self.parameters, np.concatenate((new, points)), np.concatenate((points, new)))
+        self._buffer[m, :m + 1] = costs[:m + 1]
+        self._buffer[:m + 1, m] = costs[m + 1:]
+        self._buffer[m, m] = 0.
+        self._size = m + 1
+        self._update_table()
+
+        index = m - 1
+        if client.demand > self.parameters.drone.capacity:
+            return None
+        _, j, p = self.cheapest_insertion(index)
+        if j is None:
+            j = len(self.routes)
+            self._set_route(j, [index])
+        else:
+            route = list(self.routes[j])
+            route.insert(p, index)
+            self._set_route(j, route)
+        if reoptimize:
+            route_of = self._route_of()
+            self.reoptimize(self._nearby_routes(index, route_of) | {j})
+        return int(self._route_of()[index])
+
+    def remove_client(self, client, reoptimize=True):
+        """Removes a client (instance of class Client of the problem) from the problem and from its route (the route is
+        removed if it becomes empty). The row and column of the client are removed from the cost matrix and the
+        clients after it move down by one index.
+        If reoptimize is True, the route of the client and the routes of its nearest clients are improved (see
+        reoptimize).
+        :return: the instance of class Client removed"""
+        index = self.problem.clients_list.index(client)
+        route_of = self._route_of()
+        nearby = self._nearby_routes(index, route_of) if reoptimize else set()
+        j = int(route_of[index])
+        if j >= 0:
+            route = [i for i in self.routes[j] if i != index]
+            if route:
+                self._set_route(j, route)
+                nearby.add(j)
+            else:
+                self._delete_routes([j])
+                nearby = {r - (r > j) for r in nearby if r != j}
+
+        self.problem.remove_client(index)
+        m, row = self._size, index + 1
+        self._buffer[row:m - 1, :m] = self._buffer[row + 1:m, :m]
+        self._buffer[:m - 1, row:m - 1] = self._buffer[:m - 1, row + 1:m]
+        self._size = m - 1
+        self.routes = [[i - (i > index) for i in route] for route in self.routes]
+        self._update_table()
+        if reoptimize and nearby:
+            self.reoptimize(nearby)
+        return client
@@ -0,0 +1,320 @@
+"""Implements local search moves that improve the solutions built by the Clarke and Wright algorithm (see
+processing.py). Routes are handled as lists of client indices (indices in problem.clients_list) and costs are read from
+the cost matrix of the problem (see processing.cost_matrix), so the cost function is never called. The routes start and
+end at problem.depot (row/column 0 of the cost matrix)."""
+import numpy as np
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+
+INTRA_ROUTE_MOVES = ("2-opt", "or-opt")
+INTER_ROUTE_MOVES = ("relocate", "swap", "2-opt*")
+
+
+def route_cost(c_matrix, route):
+    """Returns the cost of a route given as a list of client indices (the route starts and ends at the depot)."""
+    rows = [0] + [i + 1 for i in route] + [0]
+    return float(c_matrix[rows[:-1], rows[1:]].sum())
+
+
+def prefix_costs(matrix, sequence):
+    """Returns the lists (forward, backward) where forward[p] is the cost of sequence[0:p + 1] travelled forward and
+    backward[p] is the cost of the same arcs travelled backward. The cost of the arcs between positions i and j
+    (i <= j) is forward[j] - forward[i] forward and backward[j] - backward[i] backward, which gives the cost of a
+    reversed segment in constant time even if the costs are asymmetric (wind)."""
+    forward, backward = [0.] * len(sequence), [0.] * len(sequence)
+    for p in range(1, len(sequence)):
+        forward[p] = forward[p - 1] + matrix[sequence[p - 1]][sequence[p]]
+        backward[p] = backward[p - 1] + matrix[sequence[p]][sequence[p - 1]]
+    return forward, backward
+
+
+def best_two_opt_move(matrix, sequence, forward, backward):
+    """Returns the best 2-opt move (delta, i, j) of a sequence (depot, clients..., depot): the segment
+    sequence[i:j + 1] is reversed. The delta of every move is computed in constant time from the prefix costs.
+    Returns None if no move decreases the cost."""
+    best = None
+    last = len(sequence) - 2
+    for i in range(1, last):
+        before = sequence[i - 1]
+        row_before = matrix[before]
+        first = sequence[i]
+        for j in range(i + 1, last + 1):
+            after = sequence[j + 1]
+            delta = (row_before[sequence[j]] + matrix[first][after] + backward[j] - backward[i]
+                     - forward[j + 1] + forward[i - 1])
+            if best is None or delta < best[0]:
+                best = (delta, i, j)
+    return best if best is not None and best[0] < 0 else None
+
+
+def best_or_opt_move(matrix, sequence, forward, backward, max_segment_length=3):
+    """Returns the best Or-opt move (delta, i, length, p, reverse) of a sequence (depot, clients..., depot): the segment
+    sequence[i:i + length] is removed and inserted (reversed if reverse is True) between sequence[p] and
+    sequence[p + 1]. The delta of every move is computed in constant time from the prefix costs.
+    Returns None if no move decreases the cost."""
+    best = None
+    last = len(sequence) - 2
+    for length in range(1, max_segment_length + 1):
+        for i in range(1, last - length + 2):
+            end = i + length - 1
+            before, first, final, after = sequence[i - 1], sequence[i], sequence[end], sequence[end + 1]
+            internal_forward = forward[end] - forward[i]
+            internal_backward = backward[end] - backward[i]
+            removal = (matrix[before][after] - matrix[before][first] - matrix[final][after] - internal_forward)
+            for p in range(0, last + 1):
+                if i - 1 <= p <= end:  # the arcs next to the segment
+                    continue
+                u, v = sequence[p], sequence[p + 1]
+                cut = removal - matrix[u][v]
+                delta = cut + matrix[u][first] + internal_forward + matrix[final][v]
+                if best is None or delta < best[0]:
+                    best = (delta, i, length, p, False)
+                delta = cut + matrix[u][final] + internal_backward + matrix[first][v]
+                if delta < best[0]:
+                    best = (delta, i, length, p, True)
+    return best if best is not None and best[0] < 0 else None
+
+
+def apply_two_opt_move(sequence, i, j):
+    return sequence[:i] + sequence[i:j + 1][::-1] + sequence[j + 1:]
+
+
+def apply_or_opt_move(sequence, i, length, p, reverse):
+    segment = sequence[i:i + length]
+    if reverse:
+        segment = segment[::-1]
+    if p < i:
+        return sequence[:p + 1] + segment + sequence[p + 1:i] + sequence[i + length:]
+    return sequence[:i] + sequence[i + length:p + 1] + segment + sequence[p + 1:]
+
+
+def improve_route(c_matrix, route, moves=INTRA_ROUTE_MOVES, max_segment_length=3, tolerance=1e-9):
+    """Improves a route (list of client indices) with 2-opt and Or-opt moves until none of them decreases its cost by
+    more than tolerance. The best move of each kind is applied at every iteration.
+    :param moves: iterable of the moves to use ("2-opt" and/or "or-opt")
+    :return: the improved route (list of client indices)"""
+    for move in moves:
+        if move not in INTRA_ROUTE_MOVES:
+            raise ValueError("Unexpected move : {}. Please use '2-opt' or 'or-opt'".format(move))
+    if len(route) < 2:
+        return list(route)
+    nodes = [0] + [i + 1 for i in route]
+    matrix = c_matrix[np.ix_(nodes, nodes)].tolist()  # local copy: node k of the route is row/column k
+    sequence = list(range(len(nodes))) + [0]
+    improved = True
+    while improved:
+        improved = False
+        for move in moves:
+            forward, backward = prefix_costs(matrix, sequence)
+            if move == "2-opt":
+                best = best_two_opt_move(matrix, sequence, forward, backward)
+                if best is not None and best[0] < -tolerance:
+                    sequence = apply_two_opt_move(sequence, *best[1:])
+                    improved = True
+            else:
+                best = best_or_opt_move(matrix, sequence, forward, backward, max_segment_length)
+                if best is not None and best[0] < -tolerance:
+                    sequence = apply_or_opt_move(sequence, *best[1:])
+                    improved = True
+    return [route[k - 1] for k in sequence[1:-1]]
+
+
+def solution_routes(problem, solution):
+    """Returns the routes of a solution as lists of client indices (indices in problem.clients_list).
+    Row/column 0 of the cost matrix is problem.depot, so every delivery must start from it: a ValueError is raised
+    otherwise (eg: for a solution of multi_depot_clarke_and_wright, whose depots must be improved one at a time on
+    their subproblems, see Problem.subproblem)."""
+    for delivery in solution.deliveries_list:
+        if delivery.depot is not problem.depot:
+            raise ValueError("Unexpected depot : {}. Please use a solution whose deliveries all start from the depot "
+                             "of the problem ({})".format(repr(delivery.depot), repr(problem.depot)))
+    return [problem.client_indices(delivery.clients_list).tolist() for delivery in solution.deliveries_list]
+
+
+def intra_route_search(problem, solution=None, moves=INTRA_ROUTE_MOVES, c_matrix=None, name=None, verbose=True):
+    """Improves every delivery of a solution of the problem (the last one by default) with 2-opt and Or-opt moves (see
+    improve_route). The moves keep the clients of every delivery, so the improved solution is legal if the solution is.
+    The improved solution is appended to the end of the solutions list of the problem.
+    :param c_matrix: cost matrix of the problem for the parameters of the solution. Computed if None.
+    :return: the energy saved (cost of the solution - cost of the improved solution)"""
+    if solution is None:
+        solution = problem.solutions_list[-1]
+    parameters = solution.parameters
+    if name is None:
+        name = "{} + intra-route search".format(solution.name)
+    if c_matrix is None:
+        c_matrix = pro.cost_matrix(problem, parameters)
+    routes = solution_routes(problem, solution)
+    initial_cost = sum(route_cost(c_matrix, route) for route in routes)
+    if verbose:
+        print("Improving routes ({})...".format(", ".join(moves)), end=' ', flush=True)
+    routes = [improve_route(c_matrix, route, moves) for route in routes]
+    return append_improved_solution(problem, parameters, routes, c_matrix, name, initial_cost, verbose)
+
+
+def append_improved_solution(problem, parameters, routes, c_matrix, name, initial_cost, verbose=True):
+    """Appends the solution made of the routes (lists of client indices) to the solutions list of the problem and
+    returns the energy saved (initial_cost - cost of the routes)."""
+    table = pro.cost_table(problem, parameters, c_matrix)
+    clients = problem.clients_list
+    deliveries_list = [pre.Delivery(pre.Route([clients[i] for i in route], problem.depot), parameters, table)
+                       for route in routes]
+    problem.solutions_list.append(pre.Solution(name, deliveries_list, parameters))
+    saved = initial_cost - sum(route_cost(c_matrix, route) for route in routes)
+    if verbose:
+        print("done !")
+        print("Energy saved : {} ({:.2%})".format(saved, saved / initial_cost if initial_cost else 0.))
+    return saved
+
+
+def nearest_neighbours(c_matrix, k=10, rows_per_block=1024):
+    """Returns the int array of shape (n, min(k, n - 1)) whose row i holds the indices of the k clients the closest to
+    client i, the closest first. Clients are compared with the cost of the round trip c[i][j] + c[j][i] so that the
+    neighbourhood doesn't depend on the direction of the wind. The rows are computed rows_per_block at a time."""
+    n = c_matrix.shape[0] - 1
+    k = min(k, n - 1)
+    neighbours = np.zeros((n, max(k, 0)), dtype=int)
+    if k <= 0:
+        return neighbours
+    for start in range(0, n, rows_per_block):
+        stop = min(start + rows_per_block, n)
+        block = c_matrix[start + 1:stop + 1, 1:] + c_matrix[1:, start + 1:stop + 1].T
+        block[np.arange(stop - start), np.arange(start, stop)] = np.inf  # a client is not its own neighbour
+        candidates = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(block, candidates, axis=1), axis=1, kind="stable")
+        neighbours[start:stop] = np.take_along_axis(candidates, order, axis=1)
+    return neighbours
+
+
+def improve_routes(c_matrix, routes, demands, capacity, neighbours, moves=INTER_ROUTE_MOVES, tolerance=1e-9,
+                   max_passes=100):
+    """Improves a set of routes (lists of client indices) with moves between two routes:
+    - "relocate": a client is moved next to one of its neighbours, in the route of the neighbour
+    - "swap": a client and one of its neighbours exchange their places
+    - "2-opt*": the ends of the routes of a client and of one of its neighbours are exchanged, so that the neighbour
+    follows the client
+    Only the pairs (client, neighbour) given by neighbours (see nearest_neighbours) are tried, so a pass costs
+    O(n * k). Every route keeps its load and the prefix sums of its demands, so the capacity is checked in constant
+    time, and the deltas are read from the cost matrix. Moves are applied as soon as they decrease the cost by more than
+    tolerance and passes are repeated until no move is found (or max_passes passes).
+    :return: the list of the improved routes (empty routes are removed)"""
+    for move in moves:
+        if move not in INTER_ROUTE_MOVES:
+            raise ValueError("Unexpected move : {}. Please use 'relocate', 'swap' or '2-opt*'".format(move))
+    routes = [list(route) for route in routes]
+    demands = np.asarray(demands).tolist()
+    cost = c_matrix.item  # cost(i, j) with i and j rows/columns of the matrix (client index + 1, 0 for the depot)
+    route_of = [-1] * len(demands)  # -1 for the clients that are not delivered
+    position_of = [0] * len(demands)
+    prefix_loads = [None] * len(routes)  # prefix_loads[r][p] = total demand of the p first clients of route r
+
+    def update(r):
+        route = routes[r]
+        loads = [0] * (len(route) + 1)
+        for p, client in enumerate(route):
+            route_of[client] = r
+            position_of[client] = p
+            loads[p + 1] = loads[p] + demands[client]
+        prefix_loads[r] = loads
+
+    def around(client):
+        """Returns the rows (predecessor, client, successor) of a client in the cost matrix."""
+        route, p = routes[route_of[client]], position_of[client]
+        return (route[p - 1] + 1 if p > 0 else 0), client + 1, (route[p + 1] + 1 if p + 1 < len(route) else 0)
+
+    def try_relocate(a, b):
+        ra, rb = route_of[a], route_of[b]
+        if prefix_loads[rb][-1] + demands[a] > capacity:
+            return False
+        pa, xa, sa = around(a)
+        pb, xb, sb = around(b)
+        removal = cost(pa, sa) - cost(pa, xa) - cost(xa, sa)
+        after_b = removal + cost(xb, xa) + cost(xa, sb) - cost(xb, sb)
+        before_b = removal + cost(pb, xa) + cost(xa, xb) - cost(pb, xb)
+        if min(after_b, before_b) >= -tolerance:
+            return False
+        routes[ra].pop(position_of[a])
+        routes[rb].insert(position_of[b] + (1 if after_b <= before_b else 0), a)
+        update(ra)
+        update(rb)
+        return True
+
+    def try_swap(a, b):
+        ra, rb = route_of[a], route_of[b]
+        if (prefix_loads[ra][-1] - demands[a] + demands[b] > capacity or
+                prefix_loads[rb][-1] - demands[b] + demands[a] > capacity):
+            return False
+        pa, xa, sa = around(a)
+        pb, xb, sb = around(b)
+        delta = (cost(pa, xb) + cost(xb, sa) - cost(pa, xa) - cost(xa, sa) +
+                 cost(pb, xa) + cost(xa, sb) - cost(pb, xb) - cost(xb, sb))
+        if delta >= -tolerance:
+            return False
+        routes[ra][position_of[a]], routes[rb][position_of[b]] = b, a
+        route_of[a], route_of[b] = rb, ra
+        position_of[a], position_of[b] = position_of[b], position_of[a]
+        update(ra)
+        update(rb)
+        return True
+
+    def try_two_opt_star(a, b):
+        # route of a = A1 a | A2, route of b = B1 | b B2 -> A1 a b B2 and B1 A2
+        ra, rb = route_of[a], route_of[b]
+        loads_a, loads_b = prefix_loads[ra], prefix_loads[rb]
+        cut_a, cut_b = position_of[a] + 1, position_of[b]
+        if (loads_a[cut_a] + loads_b[-1] - loads_b[cut_b] > capacity or
+                loads_b[cut_b] + loads_a[-1] - loads_a[cut_a] > capacity):
+            return False
+        _, xa, sa = around(a)
+        pb, xb, _ = around(b)
+        delta = cost(xa, xb) + cost(pb, sa) - cost(xa, sa) - cost(pb, xb)
+        if delta >= -tolerance:
+            return False
+        route_a, route_b = routes[ra], routes[rb]
+        routes[ra], routes[rb] = route_a[:cut_a] + route_b[cut_b:], route_b[:cut_b] + route_a[cut_a:]
+        update(ra)
+        update(rb)
+        return True
+
+    tries = {"relocate": try_relocate, "swap": try_swap, "2-opt*": try_two_opt_star}
+    tries = [tries[move] for move in moves]
+    for r in range(len(routes)):
+        update(r)
+    for _ in range(max_passes):
+        improved = False
+        for a in range(len(demands)):
+            if route_of[a] < 0:
+                continue
+            for b in neighbours[a].tolist():
+                if route_of[b] < 0 or route_of[b] == route_of[a]:
+                    continue
+                for try_move in tries:
+                    if try_move(a, b):
+                        improved = True
+                        break
+        if not improved:
+            break
+    return [route for route in routes if route]
+
+
+def inter_route_search(problem, solution=None, moves=INTER_ROUTE_MOVES, k=10, c_matrix=None, name=None,
+                       verbose=True):
+    """Improves a solution of the problem (the last one by default) with relocate, swap and 2-opt* moves between its
+    deliveries (see improve_routes), restricted to the k nearest neighbours of every client. The capacity of the drone
+    is respected. The improved solution is appended to the end of the solutions list of the problem.
+    :param c_matrix: cost matrix of the problem for the parameters of the solution. Computed if None.
+    :return: the energy saved (cost of the solution - cost of the improved solution)"""
+    if solution is None:
+        solution = problem.solutions_list[-1]
+    parameters = solution.parameters
+    if name is None:
+        name = "{} + inter-route search".format(solution.name)
+    if c_matrix is None:
+        c_matrix = pro.cost_matrix(problem, parameters)
+    routes = solution_routes(problem, solution)
+    initial_cost = sum(route_cost(c_matrix, route) for route in routes)
+    if verbose:
+        print("Improving routes ({})...".format(", ".join(moves)), end=' ', flush=True)
+    routes = improve_routes(c_matrix, routes, problem.demand, parameters.drone.capacity,
+                            nearest_neighbours(c_matrix, k), moves)
+    return append_improved_solution(problem, parameters, routes, c_matrix, name, initial_cost, verbose)
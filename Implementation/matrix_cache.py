@@ -0,0 +1,135 @@
+"""Implements an on-disk cache for the matrices computed by processing.py (cost matrices, savings, sorted savings)."""
+import functools
+import hashlib
+import os
+import types
+import numpy as np
+
+
+def code_identity(code):
+    """Returns a string identifying compiled code: its bytecode, its constants (nested code included) and the names it
+    uses."""
+    constants = [code_identity(constant) if isinstance(constant, types.CodeType) else repr(constant)
+                 for constant in code.co_consts]
+    return "{} {} {}".format(code.co_code.hex(), constants, code.co_names)
+
+
+def cost_function_identity(cost_fct):
+    """Returns a string identifying a cost function: its module and name. The arguments of a functools.partial are
+    part of the identity. For python functions, the code, the default values of the arguments and the values of the
+    closure are too, so that two lambdas (or two closures made by the same function) don't share their entries."""
+    if isinstance(cost_fct, functools.partial):
+        return "partial({}, {}, {})".format(cost_function_identity(cost_fct.func), repr(cost_fct.args),
+                                            repr(sorted(cost_fct.keywords.items())))
+    identity = "{}.{}".format(getattr(cost_fct, "__module__", ""), getattr(cost_fct, "__qualname__", repr(cost_fct)))
+    if isinstance(cost_fct, types.FunctionType):
+        closure = [cell.cell_contents for cell in cost_fct.__closure__ or ()]
+        identity += " {} {} {}".format(code_identity(cost_fct.__code__), repr(cost_fct.__defaults__), repr(closure))
+    return identity
+
+
+class MatrixCache:
+    """This class stores numpy arrays in a directory, as .npy files that are memory-mapped when they are loaded.
+    Entries are identified by a key computed from everything the arrays depend on (see key). When the total size of the
+    files exceeds max_bytes, the least recently used entries are deleted."""
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, mmap=True):
+        self.directory = directory  # string. The directory is created if needed.
+        self.max_bytes = max_bytes  # int. Maximum total size of the files (bytes).
+        self.mmap = mmap  # boolean. If True, the arrays are memory-mapped (copy-on-write) instead of being read.
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return "<MatrixCache at {}. directory = {}, size = {} bytes, max_bytes = {}>".format(
+            hex(id(self)), self.directory, self.size, self.max_bytes)
+
+    @staticmethod
+    def key(kind, problem, parameters, c_matrix=None):
+        """Returns the key of an entry: a hash of the kind of entry (string), of the coordinates of the depot and of the
+        clients, of the speed and acd of the drone, of the wind (grid included for wind fields) and of the identity of
+        the cost function. The content of c_matrix is hashed too if it is given (entries computed from a cost matrix
+        given by the caller rather than from the cost function)."""
+        x, y = problem.coordinates()
+        content = hashlib.sha256(kind.encode())
+        content.update(np.ascontiguousarray(x, dtype=float).tobytes())
+        content.update(np.ascontiguousarray(y, dtype=float).tobytes())
+        content.update(repr((float(parameters.drone.speed), float(parameters.drone.acd),
+                             float(parameters.wind.x), float(parameters.wind.y))).encode())
+        content.update(cost_function_identity(parameters.cost_fct).encode())
+        for attribute in ("x_grid", "y_grid", "u", "v", "samples"):  # wind fields (see pre_processing.WindField)
+            if hasattr(parameters.wind, attribute):
+                content.update(np.ascontiguousarray(getattr(parameters.wind, attribute), dtype=float).tobytes())
+        if c_matrix is not None:
+            content.update(np.ascontiguousarray(c_matrix, dtype=float).tobytes())
+        return content.hexdigest()
+
+    def _file_name(self, key, name):
+        return os.path.join(self.directory, "{}_{}.npy".format(key, name))
+
+    def _entries(self):
+        """Returns a dictionary key -> (list of file names, total size, last use)."""
+        entries = dict()
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # deleted in the meantime by an other process
+                continue
+            files, size, last_use = entries.get(file_name.split("_")[0], ([], 0, 0.))
+            entries[file_name.split("_")[0]] = (files + [path], size + stat.st_size, max(last_use, stat.st_mtime))
+        return entries
+
+    @property
+    def size(self):
+        """Total size of the files of the cache (bytes)."""
+        return sum(size for _, size, _ in self._entries().values())
+
+    def load(self, key, names):
+        """Returns the tuple of the arrays named 'names' of the entry 'key'. Returns None if one of them is missing."""
+        arrays = []
+        for name in names:
+            file_name = self._file_name(key, name)
+            try:
+                arrays.append(np.load(file_name, mmap_mode="c" if self.mmap else None))
+                os.utime(file_name)  # the modification time is used as the last use time
+            except (FileNotFoundError, ValueError, OSError):
+                return None
+        return tuple(arrays)
+
+    def save(self, key, arrays):
+        """Stores the arrays of the dictionary 'arrays' (name -> numpy array) as the entry 'key' and evicts the least
+        recently used entries if the cache is too big."""
+        for name, array in arrays.items():
+            file_name = self._file_name(key, name)
+            temporary_file_name = "{}.{}.tmp".format(file_name, os.getpid())
+            with open(temporary_file_name, "wb") as f:
+                np.save(f, np.asarray(array))
+            os.replace(temporary_file_name, file_name)  # readers never see half-written files
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Deletes the least recently used entries (except the entry 'keep') until the size is below max_bytes."""
+        entries = self._entries()
+        total_size = sum(size for _, size, _ in entries.values())
+        for key, (files, size, _) in sorted(entries.items(), key=lambda item: item[1][2]):
+            if total_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
+
+    def clear(self):
+        """Deletes every entry of the cache."""
+        for files, _, _ in self._entries().values():
+            for path in files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
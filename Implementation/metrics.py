@@ -0,0 +1,73 @@
+"""Implements the instrumentation of the solver: the functions of processing.py that accept a 'metrics' argument report
+the time spent in their phases, count what they do (cost function evaluations, merges, delivery lookups) and the
+memory held by their matrices to an instance of class SolverMetrics. When metrics is None (the default), nothing is
+measured."""
+import contextlib
+import time
+
+
+class SolverMetrics:
+    """This class collects the telemetry of a solve. Phases can be nested, the time of a phase includes the time of the
+    phases it contains. A phase or a counter reported several times is accumulated.
+    observer is an optional function called as observer(event, name, value) on every event, to export the telemetry as
+    it is produced:
+    - ("phase start", name, time.perf_counter() value)
+    - ("phase end", name, duration of the phase in s)
+    - ("counter", name, amount added to the counter)
+    - ("matrices", name, bytes held by the matrices)"""
+
+    def __init__(self, observer=None):
+        self.observer = observer  # function or None
+        self.phases = dict()  # name -> total time spent in the phase (s)
+        self.counters = dict()  # name -> int
+        self.peak_matrix_bytes = 0  # int. Largest amount of memory held at once by the matrices that were reported.
+
+    def __repr__(self):
+        return "<SolverMetrics at {}. {} phases, {} counters, peak matrix memory = {} bytes>".format(
+            hex(id(self)), len(self.phases), len(self.counters), self.peak_matrix_bytes)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager timing the code it wraps as the phase 'name'."""
+        start = time.perf_counter()
+        if self.observer is not None:
+            self.observer("phase start", name, start)
+        try:
+            yield self
+        finally:
+            duration = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.) + duration
+            if self.observer is not None:
+                self.observer("phase end", name, duration)
+
+    def count(self, name, amount=1):
+        """Adds amount to the counter 'name'."""
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+        if self.observer is not None:
+            self.observer("counter", name, int(amount))
+
+    def matrices(self, name, *arrays):
+        """Reports numpy arrays that are held at the same time (None values are ignored) and updates the peak."""
+        nbytes = sum(array.nbytes for array in arrays if array is not None and hasattr(array, "nbytes"))
+        self.peak_matrix_bytes = max(self.peak_matrix_bytes, nbytes)
+        if self.observer is not None:
+            self.observer("matrices", name, nbytes)
+
+    def as_dict(self):
+        """Returns the telemetry as a dictionary that can be written in JSON."""
+        return {"phases": dict(self.phases), "counters": dict(self.counters),
+                "peak_matrix_bytes": self.peak_matrix_bytes}
+
+    def print(self):
+        for name, duration in self.phases.items():
+            print("    {:<30}{:>12.3f} ms".format(name, duration * 1000))
+        for name, value in self.counters.items():
+            print("    {:<30}{:>12}".format(name, value))
+        print("    {:<30}{:>12.2f} MiB".format("peak matrix memory", self.peak_matrix_bytes / 1024 ** 2))
+
+
+def phase(metrics, name):
+    """Returns metrics.phase(name), or a context manager that does nothing if metrics is None."""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.phase(name)
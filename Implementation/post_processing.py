@@ -1,6 +1,14 @@
 """Implements a few functions to help visualise problems and theirs solutions."""
+import os
+import re
 import numpy as np
 import matplotlib.pyplot as plt  # very powerful module when it comes to plotting things
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+import pyDroneDeliv.pre_processing as pre
+
+FAST_THRESHOLD = 500  # number of clients above which problems and solutions are drawn in fast mode by default
 
 
 def place_holder(*args):
@@ -16,7 +24,14 @@ def plot_problem(problem, ax=None, **kwargs):  # Here kwargs must be considered
     Valid keyword argument:
     *plot_demand*: boolean, default True.
     *demand_size*: float, default 8. Size (in pixels) of the figures representing the clients' demands (if drawn)
+    *fast*: boolean, default None. If True, the clients are drawn as a single scatter from the arrays of the problem
+    and the demands are only written when at most label_threshold clients are visible (they appear when zooming in).
+    None means True above FAST_THRESHOLD clients.
+    *label_threshold*: int, default 200. See fast.
     """
+    fast = kwargs.get("fast")
+    if fast is None:
+        fast = problem.number_of_clients > FAST_THRESHOLD
     if ax is None:  # in case no axis is provided
         fig = plt.figure()  # creates a window (without any axis). 1 figure = 1 window. 1 figure = 1 or more axes.
         ax = fig.add_subplot(111)  # creates one set of axes that takes all the space in the previously created window
@@ -26,8 +41,15 @@ def plot_problem(problem, ax=None, **kwargs):  # Here kwargs must be considered
     ax.grid(False)  # turns the grid off
     # You should complete the x_depot, y_depot, x_clients and y_clients variables. Each of these variables should be a
     # python list of floats.
-    x_depot = [problem.depot.x]
-    y_depot = [problem.depot.y]
+    x_depot = [depot.x for depot in problem.depots]
+    y_depot = [depot.y for depot in problem.depots]
+    if fast:
+        ax.plot(x_depot, y_depot, marker="s", color="red", label="Depot", linestyle="None", ms=7, zorder=2)
+        ax.scatter(problem.x, problem.y, s=9, marker="o", color="blue", label="Clients (demand)", linewidths=0,
+                   zorder=1)
+        if kwargs.get("plot_demand", True):
+            draw_visible_demands(ax, problem, kwargs.get("label_threshold", 200), kwargs.get("demand_size", 16))
+        return ax
     x_clients = []
     y_clients = []
     for client in problem.clients_list:
@@ -44,6 +66,38 @@ def plot_problem(problem, ax=None, **kwargs):  # Here kwargs must be considered
     return ax
 
 
+def draw_visible_demands(ax, problem, label_threshold=200, demand_size=16):
+    """Writes the demands of the clients that are visible in ax, if there are at most label_threshold of them. The
+    labels are written again every time the limits of ax change (zoom, pan). Calling it again on the same ax replaces
+    the labels and the callbacks of the previous call."""
+    previous = getattr(ax, "_visible_demands", None)
+    if previous is not None:
+        for cid in previous["callbacks"]:
+            ax.callbacks.disconnect(cid)
+        for text in previous["texts"]:
+            text.remove()
+    texts = []
+
+    def update(ax):
+        for text in texts:
+            text.remove()
+        texts.clear()
+        (x_min, x_max), (y_min, y_max) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+        x, y = problem.x, problem.y
+        visible = np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+        if len(visible) > label_threshold:
+            return
+        for i, x_i, y_i, demand in zip(visible.tolist(), x[visible].tolist(), y[visible].tolist(),
+                                       problem.demand[visible].tolist()):
+            texts.append(ax.text(x_i, y_i, str(demand), style="italic", fontsize=demand_size, color="blue",
+                                 ha="center", va="bottom", zorder=1))
+
+    ax.autoscale_view()
+    update(ax)
+    callbacks = [ax.callbacks.connect("xlim_changed", update), ax.callbacks.connect("ylim_changed", update)]
+    ax._visible_demands = {"callbacks": callbacks, "texts": texts}
+
+
 def plot_solution(solution, ax, color, **kwargs):
     """This function plots a solution. More precisely, it plots all the deliveries of the solution on the axis 'ax' with
     the color 'color'.
@@ -56,37 +110,54 @@ def plot_solution(solution, ax, color, **kwargs):
     *nx*: integer, default 10
     *ny*: integer, default 10. A grid of (nx-1)*(ny-1) evenly spaced arrows of wind are drawn on ax
     *rs*: float, default 0.1. The higher the number, the smaller the wind arrows get.
+    *fast*: boolean, default None. If True, all the deliveries are drawn as a single LineCollection. None means True
+    above FAST_THRESHOLD clients delivered.
     """
     # setting up a dashed pattern. It represents a sequence of on/off ink (in points).
     dashes = [np.random.randint(12, 20+1), 2, np.random.randint(4, 6+1), 5]  # partially randomised
+    fast = kwargs.get("fast")
+    if fast is None:
+        fast = sum(len(delivery.clients_list) for delivery in solution.deliveries_list) > FAST_THRESHOLD
     # plotting the deliveries of the solution
-    for i, delivery in enumerate(solution.deliveries_list):
-        label = None
-        if i == 0:
-            label = solution.name
-        # Here, you should generate the x_list and y_list variables
-        x_list = [delivery.depot.x]
-        y_list = [delivery.depot.y]
-        for client in delivery.clients_list:
-            x_list.append(client.x)
-            y_list.append(client.y)
-        x_list.append(delivery.depot.x)
-        y_list.append(delivery.depot.y)
-        line, = ax.plot(x_list, y_list, color=color, marker="", linestyle="-", label=label, zorder=0)
-        if kwargs.get('dashed', True):
-            line.set_dashes(dashes)
+    if fast:
+        segments = [np.array([(delivery.depot.x, delivery.depot.y)] +
+                             [(client.x, client.y) for client in delivery.clients_list] +
+                             [(delivery.depot.x, delivery.depot.y)]) for delivery in solution.deliveries_list]
+        lines = LineCollection(segments, colors=[color], label=solution.name, zorder=0,
+                               linestyles=[(0, dashes)] if kwargs.get('dashed', True) else "solid")
+        ax.add_collection(lines)
+        ax.autoscale_view()
+    else:
+        for i, delivery in enumerate(solution.deliveries_list):
+            label = None
+            if i == 0:
+                label = solution.name
+            # Here, you should generate the x_list and y_list variables
+            x_list = [delivery.depot.x]
+            y_list = [delivery.depot.y]
+            for client in delivery.clients_list:
+                x_list.append(client.x)
+                y_list.append(client.y)
+            x_list.append(delivery.depot.x)
+            y_list.append(delivery.depot.y)
+            line, = ax.plot(x_list, y_list, color=color, marker="", linestyle="-", label=label, zorder=0)
+            if kwargs.get('dashed', True):
+                line.set_dashes(dashes)
     ax.legend(loc=0, fontsize='x-small', numpoints=1)
     # Drawing arrows representing the wind
     if kwargs.get('draw_wind', True) and solution.parameters.wind.speed > 0:
         nx = kwargs.get('nx', 10)  # nx-1 is the number of arrows on the x axis
         ny = kwargs.get('ny', 10)  # ny-1 is the number of arrows on the y axis
         rs = kwargs.get('rs', 0.1)  # scaling value for the arrows (m.s-1)
-        u = np.ones((nx, ny)) * solution.parameters.wind.x
-        v = np.ones((nx, ny)) * solution.parameters.wind.y
         x = np.linspace(*ax.get_xbound(), nx + 2)[1:-1]
         y = np.linspace(*ax.get_ybound(), ny + 2)[1:-1]
-        plt.quiver(x, y, u, v, angles='xy', units='dots', scale=rs,
-                   width=2, headwidth=2, headlength=3.5, facecolor=color, edgecolor=color, zorder=-1, alpha=0.4)
+        if isinstance(solution.parameters.wind, pre.WindField):  # the arrows show the local wind
+            u, v = solution.parameters.wind.at(*np.meshgrid(x, y))
+        else:
+            u = np.ones((ny, nx)) * solution.parameters.wind.x
+            v = np.ones((ny, nx)) * solution.parameters.wind.y
+        ax.quiver(x, y, u, v, angles='xy', units='dots', scale=rs,
+                  width=2, headwidth=2, headlength=3.5, facecolor=color, edgecolor=color, zorder=-1, alpha=0.4)
     return ax
 
 
@@ -122,7 +193,7 @@ def plot_problem_solutions(problem, **kwargs):
     # You must use get_random_color to pick the random color.
     # Don't forget to pass kwargs to affected functions.
     colors_list = [np.array([1., 1., 1.])]  # [1., 1., 1.] = white (background color of the figure)
-    ax = kwargs.get('ax')
+    ax = kwargs.pop('ax', None)  # passed separately to plot_problem and plot_solution
     if ax is None:
         fig = plt.figure()
         ax = fig.add_subplot(111)
@@ -136,3 +207,27 @@ def plot_problem_solutions(problem, **kwargs):
     for solution in problem.solutions_list:
         ax = plot_solution(solution, ax, get_random_color(colors_list, **kwargs), **kwargs)
     return ax
+
+
+def export_solutions(problem, directory, solutions=None, formats=("png",), dpi=100, **kwargs):
+    """Draws the problem with each of its solutions (every solution of its solutions list by default) on a figure of
+    its own and saves the figures in directory (created if needed) in the given formats (eg: "png", "svg"). The
+    figures are drawn without pyplot, so this works without a display and doesn't keep figures in memory.
+    Other keyword arguments are valid (see valid kwargs of plot_problem and plot_solution, and figsize in inches).
+    :return: list of the names of the files written"""
+    os.makedirs(directory, exist_ok=True)
+    if solutions is None:
+        solutions = problem.solutions_list
+    file_names = []
+    for i, solution in enumerate(solutions):
+        fig = Figure(figsize=kwargs.get("figsize", (10, 7)))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        plot_problem(problem, ax, **kwargs)
+        plot_solution(solution, ax, get_random_color([np.array([1., 1., 1.])], **kwargs), **kwargs)
+        base_name = "{}_{}".format(i, re.sub(r"[^\w.-]+", "_", solution.name).strip("_"))
+        for extension in formats:
+            file_name = os.path.join(directory, "{}.{}".format(base_name, extension))
+            fig.savefig(file_name, dpi=dpi)
+            file_names.append(file_name)
+    return file_names
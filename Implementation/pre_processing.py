@@ -1,5 +1,7 @@
 """Implements all the necessary classes for this project."""
 import csv  # module from the standard library used for reading and writing files in CSV (Coma Separated Values) format.
+import importlib
+import itertools
 import numpy as np  # numpy is a very popular and powerful module. Use it every time you need to deal with numbers.
 
 
@@ -70,8 +72,103 @@ class Wind:
             self.x = target_speed
 
 
+def is_regular(grid):
+    """Returns True if the nodes of the axis of a grid (increasing numpy array) are evenly spaced."""
+    return bool(np.allclose(np.diff(grid), (grid[-1] - grid[0]) / (len(grid) - 1), rtol=1e-9, atol=0.))
+
+
+def grid_cells(values, grid, regular=None):
+    """Returns the tuple (indices, positions) of numpy arrays locating values (numpy array) on the axis of a grid
+    (increasing numpy array of at least 2 nodes): values[j] is in the interval [grid[indices[j]], grid[indices[j] + 1]]
+    at the relative position positions[j] (from 0 to 1). Values outside of the grid are moved to its closest end.
+    The intervals of a regular grid are found with a division instead of a binary search.
+    :param regular: boolean, result of is_regular(grid). Computed if None."""
+    last = len(grid) - 1
+    if regular is None:
+        regular = is_regular(grid)
+    if regular:
+        step = (grid[-1] - grid[0]) / last
+        positions = np.clip((values - grid[0]) * (1. / step), 0., last)
+        indices = np.minimum(positions.astype(np.intp), last - 1)
+        positions -= indices
+        return indices, positions
+    indices = np.clip(np.searchsorted(grid, values, side="right") - 1, 0, last - 1)
+    return indices, np.clip((values - grid[indices]) / (grid[indices + 1] - grid[indices]), 0., 1.)
+
+
+class WindField:
+    """This class models a wind that changes over the map. The wind is given at the nodes of a rectangular grid and
+    bilinearly interpolated in between (outside of the grid, the wind of the closest point of the grid is used).
+    It can be used instead of an instance of class Wind in DeliveryParameters: the costs are then integrated along the
+    segments (see processing.segment_costs). The arrays are read-only, create a new instance to change the wind."""
+
+    def __init__(self, x_grid, y_grid, u, v, samples=16):
+        self.x_grid = np.array(x_grid, dtype=float)  # numpy array of the increasing x coordinates of the nodes (m)
+        self.y_grid = np.array(y_grid, dtype=float)  # numpy array of the increasing y coordinates of the nodes (m)
+        # numpy arrays of shape (len(y_grid), len(x_grid)). Speed (m.s-1) on the x and y axes at each node.
+        self.u = np.array(u, dtype=float).reshape(len(self.y_grid), len(self.x_grid))
+        self.v = np.array(v, dtype=float).reshape(len(self.y_grid), len(self.x_grid))
+        self.samples = samples  # int. Number of points of a segment where the wind is evaluated.
+        if len(self.x_grid) < 2 or len(self.y_grid) < 2:
+            raise ValueError("The grid of a wind field needs at least 2 nodes on each axis")
+        for array in (self.x_grid, self.y_grid, self.u, self.v):
+            array.setflags(write=False)
+        self._regular = (is_regular(self.x_grid), is_regular(self.y_grid))  # see grid_cells
+        # Coefficients of the bilinear interpolation of u and v in every cell (flattened, cell = iy * (nx - 1) + ix):
+        # value = c0 + c1 * tx + (c2 + c3 * tx) * ty where tx and ty are the positions in the cell (from 0 to 1)
+        self._coefficients = tuple(tuple(coefficient.ravel() for coefficient in (
+            grid[:-1, :-1], grid[:-1, 1:] - grid[:-1, :-1], grid[1:, :-1] - grid[:-1, :-1],
+            grid[1:, 1:] - grid[1:, :-1] - grid[:-1, 1:] + grid[:-1, :-1])) for grid in (self.u, self.v))
+
+    @classmethod
+    def from_function(cls, function, x_grid, y_grid, samples=16):
+        """Creates a wind field from a function returning the tuple (u, v) of the wind at the points (x, y) given as
+        numpy arrays."""
+        x, y = np.meshgrid(np.asarray(x_grid, dtype=float), np.asarray(y_grid, dtype=float))
+        u, v = function(x, y)
+        return cls(x_grid, y_grid, np.broadcast_to(u, x.shape), np.broadcast_to(v, x.shape), samples)
+
+    def __repr__(self):
+        return "<WindField at {}. {}x{} nodes ; mean (x, y) = ({}, {}) ; max speed = {} m.s-1>".format(
+            hex(id(self)), len(self.x_grid), len(self.y_grid), self.x, self.y, self.speed)
+
+    def at(self, x, y):
+        """Returns the tuple (u, v) of numpy arrays of the wind (m.s-1) at the points (x, y) (numpy arrays or
+        floats). The cell of every point is found once and used for both components."""
+        ix, tx = grid_cells(np.asarray(x, dtype=float), self.x_grid, self._regular[0])
+        iy, ty = grid_cells(np.asarray(y, dtype=float), self.y_grid, self._regular[1])
+        cell = iy * (len(self.x_grid) - 1) + ix
+        result = []
+        for c0, c1, c2, c3 in self._coefficients:
+            result.append(c0.take(cell) + c1.take(cell) * tx + (c2.take(cell) + c3.take(cell) * tx) * ty)
+        return tuple(result)
+
+    @property
+    def x(self):
+        """Mean speed (m.s-1) on the x axis over the nodes of the grid."""
+        return float(self.u.mean())
+
+    @property
+    def y(self):
+        """Mean speed (m.s-1) on the y axis over the nodes of the grid."""
+        return float(self.v.mean())
+
+    @property
+    def vector(self):
+        """Returns the mean wind as a 1-dimensional numpy array."""
+        return np.array((self.x, self.y))
+
+    @property
+    def speed(self):
+        """Returns the maximum speed of the wind over the nodes of the grid (m.s-1)."""
+        return float(np.sqrt(self.u ** 2 + self.v ** 2).max())
+
+
 class Point:
     """This class represents a point on the map. 'x' and 'y' are the coordinates of the point."""
+    # points can be created by the million: the attributes are slots and the __dict__ (for the attributes that user code
+    # adds) is only created when it is used
+    __slots__ = ("identifier", "x", "y", "__dict__", "__weakref__")
 
     def __init__(self, identifier="", x=0., y=0.):
         self.identifier = identifier  # string
@@ -92,6 +189,7 @@ class Point:
 
 class Client(Point):  # <- (Point) means that this class inherits from the class Point.
     """This class inherits from class Point. It adds an attribute : 'demand' which represents the client's demand."""
+    __slots__ = ("demand",)
 
     def __init__(self, identifier="Client", x=0., y=0., demand=0):
         Point.__init__(self, identifier, x, y)  # <- defines 'x' and 'y' so there is no need to define them again.
@@ -107,6 +205,7 @@ class Client(Point):  # <- (Point) means that this class inherits from the class
 
 class Depot(Point):
     """This class inherits from Point. It actually doesn't change anything except the default value of the identifier"""
+    __slots__ = ()
 
     def __init__(self, identifier="Depot", x=0., y=0.):
         Point.__init__(self, identifier, x, y)
@@ -115,11 +214,53 @@ class Depot(Point):
         return "<Depot at {}. id = {}, (x,y) = ({}, {})>".format(hex(id(self)), self.identifier, self.x, self.y)
 
 
+class ClientsList(list):
+    """Python list of instances of class Client that counts the changes made to it in place (item assignments,
+    append, pop, sort, reverse...) so that the values computed from it (eg: the cost of a route) can be invalidated."""
+    revision = 0  # int. Increased by every change made in place.
+
+
+def _counting_changes(method):
+    def counted_method(self, *args, **kwargs):
+        self.revision += 1
+        return method(self, *args, **kwargs)
+    counted_method.__name__ = method.__name__
+    return counted_method
+
+
+for _method in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove",
+                "clear", "sort", "reverse"):
+    setattr(ClientsList, _method, _counting_changes(getattr(list, _method)))
+
+
+def list_revision(clients_list):
+    """Returns a value that changes whenever clients_list is modified in place: the revision of a ClientsList, or the
+    tuple of the clients of a plain list (clients are compared by identity), which costs a pass over the list."""
+    if isinstance(clients_list, ClientsList):
+        return clients_list.revision
+    return tuple(clients_list)
+
+
 class Route:
     def __init__(self, clients_list, depot):
-        self.clients_list = clients_list  # python list of instances of class Client
+        self._revision = 0  # int. Increased every time clients_list is set. Used to invalidate cached costs.
+        self.clients_list = clients_list  # python list of instances of class Client (the given list, not a copy)
         self.depot = depot  # instance of class Depot. A route always starts and ends at a depot.
 
+    @property
+    def clients_list(self):
+        return self._clients_list
+
+    @clients_list.setter
+    def clients_list(self, new_list):
+        self._clients_list = new_list
+        self._revision += 1
+
+    @property
+    def revision(self):
+        """Tuple that changes whenever clients_list is set or modified in place (see list_revision)."""
+        return self._revision, list_revision(self._clients_list)
+
     def __repr__(self):  # formal representation of an instance of this class
         return "<Route at {}. [".format(hex(id(self))) + ", ".join([repr(cl) for cl in self.clients_list]) + \
                "]. {}.>".format(repr(self.depot))
@@ -142,11 +283,8 @@ class Route:
         otherwise."""
         # Assume that self.depot is actually of type Depot.
         # Assume that all instances in self.clients_list are actually of type Client.
-        for i in range(0, len(self.clients_list) - 1):
-            for j in range(i + 1, len(self.clients_list)):
-                if self.clients_list[i] == self.clients_list[j]:
-                    return False
-        return True
+        # Clients are compared by identity: a client appearing twice shrinks the set of their ids.
+        return len({id(client) for client in self.clients_list}) == len(self.clients_list)
 
     def check_same_depot(self, other_route):
         """This method returns True if this route has the same depot as other_route and False otherwise."""
@@ -161,7 +299,7 @@ class DeliveryParameters:
     def __init__(self, drone, wind, cost_fct=None):
         """
         :param drone: instance of class Drone
-        :param wind: instance of class Wind
+        :param wind: instance of class Wind (or of class WindField)
         :param cost_fct: cost function that computes the cost to go from one point to another as a function of the
         drone and the wind"""
         # see cost_a and cost_b from processing.py
@@ -171,11 +309,67 @@ class DeliveryParameters:
         if cost_fct is not None:
             self.cost_fct = cost_fct
 
+    @property
+    def signature(self):
+        """Returns a tuple that changes whenever a value that the costs depend on changes."""
+        # the arrays of a wind field are read-only: the instance identifies the field
+        field = (id(self.wind), self.wind.samples) if isinstance(self.wind, WindField) else None
+        return self.cost_fct, self.drone.speed, self.drone.acd, self.wind.x, self.wind.y, field
+
+
+class CostTable:
+    """Precomputed cost matrix of a problem (see processing.cost_matrix): row/column 0 is the depot and row/column i+1
+    is the i-th client of clients_list. Deliveries holding a cost table look their costs up in it instead of calling
+    the cost function, as long as the parameters haven't changed since the matrix was computed."""
+
+    def __init__(self, matrix, depot, clients_list, parameters):
+        self.matrix = matrix  # 2-dimensional numpy array
+        self.depot = depot  # instance of class Depot
+        self.clients_list = clients_list  # python list of instances of class Client (kept alive for the index)
+        self.signature = parameters.signature  # signature of the parameters used to compute the matrix
+        self._index = {id(client): i + 1 for i, client in enumerate(clients_list)}
+
+    def __repr__(self):
+        return "<CostTable at {}. {} clients>".format(hex(id(self)), len(self.clients_list))
+
+    def rows(self, clients_list, depot):
+        """Returns the numpy array of the rows of the depot, of the clients and of the depot again. Returns None if
+        the depot or one of the clients is not in the table."""
+        if depot is not self.depot:
+            return None
+        rows = [0]
+        for client in clients_list:
+            row = self._index.get(id(client))
+            if row is None:
+                return None
+            rows.append(row)
+        rows.append(0)
+        return np.array(rows)
+
+    def cost_and_savings(self, clients_list, depot, parameters):
+        """Returns the tuple (cost, savings) of a route (see Delivery.cost_and_savings). Returns None if the route or
+        the parameters don't match the table."""
+        if parameters.signature != self.signature:
+            return None
+        rows = self.rows(clients_list, depot)
+        if rows is None:
+            return None
+        cost = float(self.matrix[rows[:-1], rows[1:]].sum())
+        if len(clients_list) <= 1:
+            return cost, 0
+        normal_cost = float(self.matrix[rows[1:-1], 0].sum() + self.matrix[0, rows[1:-1]].sum())
+        return cost, normal_cost - cost
+
 
 class Delivery:
-    def __init__(self, route, parameters):
+    def __init__(self, route, parameters, cost_table=None):
         self.route = route  # instance of class Route
         self.parameters = parameters  # instance of class DeliveryParameters.
+        self.cost_table = cost_table  # instance of class CostTable or None.
+        # route, parameters and state of both when _cost_and_savings was computed. The objects themselves are kept:
+        # python can give the id of a freed object to a new one.
+        self._cache_route = self._cache_parameters = self._cache_key = None
+        self._cost_and_savings = (None, None)
 
     @property
     def clients_list(self):
@@ -213,6 +407,11 @@ class Delivery:
     def cost(self):
         """Returns the cost of the delivery according to its cost function. Returns None if its cost function is None.
         """
+        return self.cost_and_savings()[0]
+
+    def compute_cost(self):
+        """Computes the cost of the delivery by calling its cost function on every arc (no cache, no cost table).
+        Returns None if its cost function is None."""
         # It is not necessary to program cost_a nor cost_b (in processing.py) to program this method and pass the
         # automatic evaluation.
         if self.parameters.cost_fct is None:
@@ -236,20 +435,48 @@ class Delivery:
 
     def cost_and_savings(self):
         """Returns a tuple (cost, savings) corresponding to the cost and the savings of the delivery according to its
-        cost function. Returns the tuple (None, None) if the cost function of the delivery is None."""
+        cost function. Returns the tuple (None, None) if the cost function of the delivery is None.
+        The result is cached. It is only computed again when the list of clients is set or modified in place (on the
+        delivery or on its route), when the route is replaced or when the parameters change. Costs are looked up in
+        the cost table if there is one that matches the route and the parameters."""
+        if self.route is not self._cache_route or self.parameters is not self._cache_parameters or \
+                self._current_cache_key() != self._cache_key:
+            self._cost_and_savings = self.compute_cost_and_savings()
+            self._store_cache_state()
+        return self._cost_and_savings
+
+    def _current_cache_key(self):
+        return self.route.revision, self.parameters.signature
+
+    def _store_cache_state(self):
+        self._cache_route, self._cache_parameters = self.route, self.parameters
+        self._cache_key = self._current_cache_key()
+
+    def set_cost_and_savings(self, cost, savings):
+        """Stores the tuple (cost, savings) of the delivery as if cost_and_savings had computed it (eg: when a solution
+        is loaded from a file). It is computed again as soon as the route or the parameters change."""
+        self._cost_and_savings = (cost, savings)
+        self._store_cache_state()
+
+    def compute_cost_and_savings(self):
+        """Computes the tuple (cost, savings) of the delivery without using the cache (see cost_and_savings)."""
         if self.parameters.cost_fct is None:
             return None, None
+        if self.cost_table is not None:
+            result = self.cost_table.cost_and_savings(self.clients_list, self.depot, self.parameters)
+            if result is not None:
+                return result
+        normalcost = 0
+        a = len(self.clients_list)
+        cost = self.compute_cost()
+        if a <= 1:
+            return cost, 0
         else:
-            normalcost = 0
-            a = len(self.clients_list)
-            if a <= 1:
-                return self.cost(), 0
-            else:
-                for i in range(0, len(self.clients_list)):
-                    normalcost += self.parameters.cost_fct(self.clients_list[i], self.depot, self.drone, self.wind)
-                    normalcost += self.parameters.cost_fct(self.depot, self.clients_list[i], self.drone, self.wind)
-                savings = normalcost - self.cost()
-                return self.cost(), savings
+            for i in range(0, len(self.clients_list)):
+                normalcost += self.parameters.cost_fct(self.clients_list[i], self.depot, self.drone, self.wind)
+                normalcost += self.parameters.cost_fct(self.depot, self.clients_list[i], self.drone, self.wind)
+            savings = normalcost - cost
+            return cost, savings
 
     # methods
     def print(self):
@@ -259,6 +486,57 @@ class Delivery:
               .format(self.total_demand, self.drone.capacity, self.wind.vector, *self.cost_and_savings()))
 
 
+class ValidationReport:
+    """Result of Solution.validate. Each attribute is a list of violations (empty lists mean no violation):
+    - duplicated_clients: tuples (client, number of times the client is delivered) for clients delivered more than once
+    - over_capacity: tuples (delivery index, total demand, drone capacity)
+    - missing_clients: clients of the problem that are not delivered
+    - unknown_clients: delivered clients that are not clients of the problem
+    - wrong_depot: indices of the deliveries whose depot is not a depot of the problem (or the depot of the first
+    delivery)
+    - incompatible_deliveries: indices of the deliveries whose drone or wind is not the one of the solution (or of the
+    first delivery)
+    The coverage checks (missing_clients and unknown_clients) are only made if a problem is given."""
+
+    def __init__(self):
+        self.duplicated_clients = list()
+        self.over_capacity = list()
+        self.missing_clients = list()
+        self.unknown_clients = list()
+        self.wrong_depot = list()
+        self.incompatible_deliveries = list()
+
+    def __repr__(self):
+        return "<ValidationReport at {}. {} violation(s)>".format(hex(id(self)), self.number_of_violations)
+
+    def __bool__(self):
+        return self.is_legal
+
+    @property
+    def number_of_violations(self):
+        return len(self.duplicated_clients) + len(self.over_capacity) + len(self.missing_clients) + \
+            len(self.unknown_clients) + len(self.wrong_depot) + len(self.incompatible_deliveries)
+
+    @property
+    def is_legal(self):
+        return self.number_of_violations == 0
+
+    def print(self):
+        print("Validation report : {} violation(s)".format(self.number_of_violations))
+        for client, count in self.duplicated_clients:
+            print("    client {} is delivered {} times".format(client, count))
+        for index, total_demand, capacity in self.over_capacity:
+            print("    delivery {} : total demand = {} > drone capacity = {}".format(index, total_demand, capacity))
+        for client in self.missing_clients:
+            print("    client {} is not delivered".format(client))
+        for client in self.unknown_clients:
+            print("    client {} is not a client of the problem".format(client))
+        for index in self.wrong_depot:
+            print("    delivery {} does not start from the right depot".format(index))
+        for index in self.incompatible_deliveries:
+            print("    delivery {} does not use the drone or the wind of the solution".format(index))
+
+
 class Solution:
     """A solution is basically a combination of deliveries (in the form of a list of deliveries)."""
 
@@ -273,24 +551,59 @@ class Solution:
     def is_legal(self):  # useful for debugging purposes
         """This method returns True if the solution does not break any rule of the delivery problem. It returns False
         otherwise."""
-        a = len(self.deliveries_list)
-        for i in range(0, a):
-            if self.deliveries_list[i].is_legal is False:
+        delivered = set()  # ids of the clients already seen
+        number_of_delivered_clients = 0
+        for delivery in self.deliveries_list:
+            if delivery.total_demand > delivery.drone.capacity:
+                return False
+            delivered.update(id(client) for client in delivery.clients_list)
+            number_of_delivered_clients += len(delivery.clients_list)
+            if len(delivered) != number_of_delivered_clients:  # a client has been seen twice
                 return False
-        ctot = []
-        for i in range(0, a):
-            for j in self.deliveries_list[i].clients_list:
-                ctot.append(j)
-        lctot = len(ctot)
-        for k in range(0, lctot - 1):
-            for l in range(k + 1, lctot):
-                if ctot[k] == ctot[l]:
-                    return False
         return True
 
+    def validate(self, problem=None):
+        """Checks every rule of the delivery problem in a single pass over the clients and returns an instance of class
+        ValidationReport listing the violations: duplicated clients, deliveries over capacity, depot and drone/wind
+        consistency and, if problem is given, coverage (every client of the problem delivered exactly once)."""
+        report = ValidationReport()
+        counts = dict()  # id(client) -> [client, number of times the client is delivered]
+        depots = {id(depot) for depot in problem.depots} if problem is not None else None
+        reference = self.parameters
+        for i, delivery in enumerate(self.deliveries_list):
+            total_demand = 0
+            for client in delivery.clients_list:
+                total_demand += client.demand
+                entry = counts.get(id(client))
+                if entry is None:
+                    counts[id(client)] = [client, 1]
+                else:
+                    entry[1] += 1
+            if total_demand > delivery.drone.capacity:
+                report.over_capacity.append((i, total_demand, delivery.drone.capacity))
+            if depots is None:
+                depots = {id(delivery.depot)}
+            if id(delivery.depot) not in depots:
+                report.wrong_depot.append(i)
+            if reference is None:
+                reference = delivery.parameters
+            if delivery.drone is not reference.drone or delivery.wind is not reference.wind:
+                report.incompatible_deliveries.append(i)
+        report.duplicated_clients = [(client, count) for client, count in counts.values() if count > 1]
+        if problem is not None:
+            problem_clients = set()
+            for client in problem.clients_list:
+                problem_clients.add(id(client))
+                if id(client) not in counts:
+                    report.missing_clients.append(client)
+            report.unknown_clients = [client for client, count in counts.values() if id(client) not in problem_clients]
+        return report
+
     def cost_and_savings(self):
         """Returns the total cost and total savings of the solution. Deliveries without cost function are ignored.
-        Returns (0, 0) if there is no delivery or if all the deliveries are without a cost function."""
+        Returns (0, 0) if there is no delivery or if all the deliveries are without a cost function.
+        Each delivery caches its own cost and savings (see Delivery.cost_and_savings), so the totals always reflect the
+        current deliveries but only the deliveries that changed are evaluated again."""
         if not self.deliveries_list:
             return 0, 0
         else:
@@ -313,39 +626,216 @@ class Solution:
 
 
 class Problem:
-    """A problem is a list of clients to deliver from a given depot.
-    This class can also store a list of solutions."""
-
-    def __init__(self, depot=None, clients_list=None):
-        self.depot = depot
-        self.clients_list = list()
+    """A problem is a list of clients to deliver from a given depot (or from several depots, see depots).
+    This class can also store a list of solutions.
+    The clients are stored as numpy arrays (identifiers, x, y and demand) that the solvers use directly. The instances
+    of class Client of clients_list are only created when clients_list is used for the first time.
+    The list given to the constructor or to clients_list is kept, not copied. Any change made in place to it (adding,
+    removing, replacing or reordering clients) is detected, but modifying the attributes of a client is not: set
+    clients_list again in that case. The changes to a ClientsList are counted by the list, the ones to a plain list are
+    found by comparing its clients with the ones the arrays were built from (see list_revision)."""
+
+    def __init__(self, depot=None, clients_list=None, depots=None):
+        self.depots = list()  # python list of instances of class Depot. The first one is 'depot'.
+        if depots is not None:
+            self.depots = list(depots)
+        elif depot is not None:
+            self.depots = [depot]
+        self._identifiers = np.zeros(0, dtype=object)  # numpy array of strings
+        self._x = np.zeros(0)  # numpy array of floats. x coordinates of the clients (m)
+        self._y = np.zeros(0)  # numpy array of floats. y coordinates of the clients (m)
+        self._demand = np.zeros(0, dtype=int)  # numpy array of ints. Demands of the clients
+        self._clients_list = None  # python list of instances of class Client. None until it is needed.
+        self._arrays_revision = 0  # list_revision of _clients_list when the arrays were last updated from it
+        self._client_index = None  # (list, revision, dictionary id(client) -> index) used by client_indices
         if clients_list is not None:
             self.clients_list = clients_list  # python list of instances of class Client
         self._number_of_generated_clients = 0  # int. Useful for random problem generation.
         self.solutions_list = list()  # python list of instances of class Solution.
 
+    @classmethod
+    def from_arrays(cls, depot, x, y, demand, identifiers=None):
+        """Creates a problem from the arrays of the coordinates and demands of its clients. Clients are named
+        "client X" (X = index of the client) if identifiers is None."""
+        problem = cls(depot)
+        problem.set_arrays(x, y, demand, identifiers)
+        return problem
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_client_index"] = None  # ids are meaningless in an other process
+        if not self.solutions_list and self._clients_list is not None:
+            self._check_arrays()
+            state["_clients_list"] = None  # the arrays are enough. Makes pickling (eg: to worker processes) cheap.
+        return state
+
+    @property
+    def depot(self):
+        """First depot of the problem (None if the problem has no depot)."""
+        return self.depots[0] if self.depots else None
+
+    @depot.setter
+    def depot(self, new_depot):
+        if self.depots:
+            self.depots[0] = new_depot
+        else:
+            self.depots.append(new_depot)
+
+    @property
+    def clients_list(self):
+        if self._clients_list is None:
+            self._clients_list = ClientsList(Client(identifier, x, y, demand) for identifier, x, y, demand in
+                                             zip(self._identifiers.tolist(), self._x.tolist(), self._y.tolist(),
+                                                 self._demand.tolist()))
+            self._arrays_revision = list_revision(self._clients_list)
+        else:
+            self._check_arrays()
+        return self._clients_list
+
+    @clients_list.setter
+    def clients_list(self, new_list):
+        self._clients_list = new_list
+        self._client_index = None
+        self._set_arrays_from_clients()
+
+    def set_arrays(self, x, y, demand, identifiers=None):
+        """Replaces the clients of the problem by the ones described by the arrays."""
+        self._x = np.array(x, dtype=float)
+        self._y = np.array(y, dtype=float)
+        self._demand = np.array(demand)
+        if identifiers is None:
+            identifiers = ["client {}".format(i) for i in range(len(self._x))]
+        self._identifiers = np.array(identifiers, dtype=object)
+        self._clients_list = None
+        self._client_index = None
+
+    def _set_arrays_from_clients(self):
+        clients = self._clients_list
+        self._identifiers = np.array([client.identifier for client in clients], dtype=object)
+        self._x = np.array([client.x for client in clients], dtype=float)
+        self._y = np.array([client.y for client in clients], dtype=float)
+        self._demand = np.array([client.demand for client in clients]) if clients else np.zeros(0, dtype=int)
+        self._arrays_revision = list_revision(clients)
+
+    def _check_arrays(self):
+        """Updates the arrays if clients_list has been modified in place."""
+        if self._clients_list is not None and list_revision(self._clients_list) != self._arrays_revision:
+            self._set_arrays_from_clients()
+
+    def _append_arrays(self, x, y, demand, identifiers):
+        """Adds clients at the end of the problem. Their instances of class Client are only created if clients_list
+        has already been created."""
+        self._check_arrays()
+        self._x = np.concatenate((self._x, np.asarray(x, dtype=float)))
+        self._y = np.concatenate((self._y, np.asarray(y, dtype=float)))
+        self._demand = np.concatenate((self._demand, np.asarray(demand)))
+        self._identifiers = np.concatenate((self._identifiers, np.array(identifiers, dtype=object)))
+        if self._clients_list is not None:
+            self._clients_list.extend(Client(identifier, x_i, y_i, demand_i) for identifier, x_i, y_i, demand_i in
+                                      zip(identifiers, np.asarray(x).tolist(), np.asarray(y).tolist(),
+                                          np.asarray(demand).tolist()))
+            self._arrays_revision = list_revision(self._clients_list)
+
+    @property
+    def x(self):
+        """numpy array of the x coordinates of the clients. Must not be modified."""
+        self._check_arrays()
+        return self._x
+
+    @property
+    def y(self):
+        """numpy array of the y coordinates of the clients. Must not be modified."""
+        self._check_arrays()
+        return self._y
+
+    @property
+    def demand(self):
+        """numpy array of the demands of the clients. Must not be modified."""
+        self._check_arrays()
+        return self._demand
+
+    @property
+    def identifiers(self):
+        """numpy array of the identifiers of the clients. Must not be modified."""
+        self._check_arrays()
+        return self._identifiers
+
+    def coordinates(self):
+        """Returns the tuple (x, y) of numpy arrays holding the coordinates of the depot (index 0) followed by the ones
+        of the clients (index i+1 for the i-th client)."""
+        return np.concatenate(([self.depot.x], self.x)), np.concatenate(([self.depot.y], self.y))
+
+    def client(self, index):
+        """Returns the instance of class Client of the client of index 'index'."""
+        return self.clients_list[index]
+
+    def client_indices(self, clients):
+        """Returns the numpy array of the indices of the given clients (instances of class Client of this problem).
+        The index of the clients is kept until clients_list is set or modified in place."""
+        clients_list = self.clients_list
+        revision = list_revision(clients_list)
+        if self._client_index is None or self._client_index[0] is not clients_list or \
+                self._client_index[1] != revision:
+            self._client_index = (clients_list, revision, {id(client): i for i, client in enumerate(clients_list)})
+        index = self._client_index[2]
+        return np.array([index[id(client)] for client in clients], dtype=int)
+
+    def subproblem(self, indices, depot=None):
+        """Returns a new problem with the same depot (or the given one) and the clients of the given indices. The new
+        problem shares the instances of class Client of this one if they have already been created."""
+        indices = np.asarray(indices, dtype=int)
+        if depot is None:
+            depot = self.depot
+        if self._clients_list is not None:
+            clients = self.clients_list
+            return Problem(depot, [clients[i] for i in indices.tolist()])
+        return Problem.from_arrays(depot, self._x[indices], self._y[indices], self._demand[indices],
+                                   self._identifiers[indices])
+
+    def add_client(self, client):
+        """Adds a client (instance of class Client) at the end of the problem without rebuilding the arrays from
+        clients_list."""
+        clients = self.clients_list
+        self._x = np.append(self._x, float(client.x))
+        self._y = np.append(self._y, float(client.y))
+        self._demand = np.append(self._demand, client.demand)
+        self._identifiers = np.append(self._identifiers, np.array([client.identifier], dtype=object))
+        clients.append(client)
+        self._arrays_revision = list_revision(clients)
+        self._client_index = None
+
+    def remove_client(self, index):
+        """Removes the client of index 'index' from the problem and returns it. The clients after it move down by one
+        index."""
+        clients = self.clients_list
+        client = clients.pop(index)
+        self._x = np.delete(self._x, index)
+        self._y = np.delete(self._y, index)
+        self._demand = np.delete(self._demand, index)
+        self._identifiers = np.delete(self._identifiers, index)
+        self._arrays_revision = list_revision(clients)
+        self._client_index = None
+        return client
+
     @property
     def number_of_generated_clients(self):
         return self._number_of_generated_clients
 
     @property
     def number_of_clients(self):
-        return len(self.clients_list)
+        return len(self.x)
 
     @property
     def total_demand(self):
-        total = 0
-        for client in self.clients_list:
-            if client:
-                total += client.demand
-        return total
+        return int(self.demand.sum())
 
     def print_clients(self):
         for client in self.clients_list:
             print(repr(client))
 
     def print_depot(self):
-        print(repr(self.depot))
+        for depot in self.depots:
+            print(repr(depot))
 
     def print_solutions(self, detailed=False):
         for solution in self.solutions_list:
@@ -364,25 +854,66 @@ class Problem:
     def clear_solutions(self):
         self.solutions_list.clear()
 
-    def generate_random_clients(self, amount=1, x=(-10000, 10000), y=(-10000, 10000), demand=(1, 100)):
+    def generate_random_clients(self, amount=1, x=(-10000, 10000), y=(-10000, 10000), demand=(1, 100), rng=None,
+                                layout="uniform", clusters=5, spread=None, radius=None):
         """This method adds random clients to the end of the current list of clients.
         Every time a new client is generated, _number_of_generated_clients is increased by 1.
         When a client is generated, its identifier is "random client X" with X=_number_of_generated_clients.
         The x and y coordinates of the client are randomly chosen between the limits given by the 'x' and 'y' parameters
         respectively (m).
         The client's demand is also chosen randomly according to the 'demand' parameter (borders are inclusive).
-        The demand is an integer, not a float."""
+        The demand is an integer, not a float.
+        If rng (instance of numpy.random.Generator or seed) is given, all the clients are drawn at once with it and
+        layout can be:
+        - "uniform": the coordinates are uniform in the rectangle given by 'x' and 'y'
+        - "clustered": the clients are spread around 'clusters' centers drawn uniformly in the rectangle (normal law of
+        standard deviation 'spread', 5% of the width of the rectangle by default) and kept inside the rectangle
+        - "ring": the clients are uniform in the ring centered on the depot (on the origin if the problem has no depot)
+        whose radii are given by 'radius' (tuple (min, max), by default (0.8 * r, r) with r the distance between the
+        center and the closest side of the rectangle)
+        Otherwise, the global random generator of numpy is used client by client and layout must be "uniform"."""
         # see np.random.rand and np.random.randint
         # Warning: the identifier must be EXACTLY int the form "random client X". eg: "random client 18".
         # Warning: the automatic evaluation is case sensitive ! "random client" is not the same as "Random Client".
         # place_holder(self, amount, x, y, demand)
-        for i in range(1, amount + 1):
-            self._number_of_generated_clients += 1
-            client_i = Client("random client {}".format(self._number_of_generated_clients),
-                              ((x[1] - x[0]) * (np.random.rand(1)) + x[0])[0],
-                              ((y[1] - y[0]) * (np.random.rand(1)) + y[0])[0],
-                              (np.random.randint(demand[0], demand[1] + 1, 1))[0])
-            self.clients_list.append(client_i)
+        if layout not in ("uniform", "clustered", "ring"):
+            raise ValueError("Unexpected layout : {}. Please use 'uniform', 'clustered' or 'ring'".format(layout))
+        first_number = self._number_of_generated_clients + 1
+        self._number_of_generated_clients += amount
+        identifiers = ["random client {}".format(i) for i in range(first_number, first_number + amount)]
+        if rng is None:
+            if layout != "uniform":
+                raise ValueError("The {} layout needs a random generator (rng)".format(layout))
+            x_list, y_list, demand_list = [], [], []
+            for i in range(1, amount + 1):
+                x_list.append(((x[1] - x[0]) * (np.random.rand(1)) + x[0])[0])
+                y_list.append(((y[1] - y[0]) * (np.random.rand(1)) + y[0])[0])
+                demand_list.append((np.random.randint(demand[0], demand[1] + 1, 1))[0])
+            self._append_arrays(x_list, y_list, np.array(demand_list, dtype=int), identifiers)
+            return
+        rng = np.random.default_rng(rng)
+        if layout == "uniform":
+            x_array = rng.uniform(x[0], x[1], amount)
+            y_array = rng.uniform(y[0], y[1], amount)
+        elif layout == "clustered":
+            if spread is None:
+                spread = 0.05 * (x[1] - x[0])
+            centers = rng.integers(0, clusters, amount)
+            centers_x = rng.uniform(x[0], x[1], clusters)
+            centers_y = rng.uniform(y[0], y[1], clusters)
+            x_array = np.clip(centers_x[centers] + rng.normal(0., spread, amount), x[0], x[1])
+            y_array = np.clip(centers_y[centers] + rng.normal(0., spread, amount), y[0], y[1])
+        else:
+            center_x, center_y = (self.depot.x, self.depot.y) if self.depot is not None else (0., 0.)
+            if radius is None:
+                r = min(center_x - x[0], x[1] - center_x, center_y - y[0], y[1] - center_y)
+                radius = (0.8 * r, r)
+            # the square root of a uniform variable gives a uniform density over the area of the ring
+            distances = np.sqrt(rng.uniform(radius[0] ** 2, radius[1] ** 2, amount))
+            angles = rng.uniform(0., 2 * np.pi, amount)
+            x_array = center_x + distances * np.cos(angles)
+            y_array = center_y + distances * np.sin(angles)
+        self._append_arrays(x_array, y_array, rng.integers(demand[0], demand[1] + 1, amount), identifiers)
 
     def export_csv(self, file_name, cell_separator=";"):
         """This method exports the problem to a file in csv format.
@@ -391,24 +922,178 @@ class Problem:
             writer = csv.writer(f, delimiter=cell_separator)
             writer.writerow(["Delivery optimization problem"])
             writer.writerow(["type", "identifier", "x", "y", "demand"])
-            writer.writerow(["depot", self.depot.identifier, self.depot.x, self.depot.y])
-            for client in self.clients_list:
-                writer.writerow(["client", client.identifier, client.x, client.y, client.demand])
+            for depot in self.depots:
+                writer.writerow(["depot", depot.identifier, depot.x, depot.y])
+            writer.writerows(zip(itertools.repeat("client"), self.identifiers.tolist(), self.x.tolist(),
+                                 self.y.tolist(), self.demand.tolist()))
 
     def import_csv(self, file_name, cell_separator=";"):
         """This method reads a problem from a file in csv format.
-        file_name is a string"""
+        file_name is a string
+        The numeric columns of the clients are parsed at once with numpy. Files with quoted fields (identifiers
+        containing the separator for instance) are read row by row with the csv module."""
         with open(file_name, newline='') as f:
-            reader = csv.reader(f, delimiter=cell_separator)
-            new_clients_list = list()
-            for i, row in enumerate(reader):
-                if i == 0 and row[0] != "Delivery optimization problem":
-                    raise (FileExistsError, "Incorrect file type.")
-                if i >= 2:
-                    if row[0] == "depot":
-                        self.depot = Depot(row[1], float(row[2]), float(row[3]))
-                    if row[0] == "client":
-                        new_clients_list.append(Client(row[1], float(row[2]), float(row[3]), int(row[4])))
-                        if "random client" in row[1]:
-                            self._number_of_generated_clients += 1
-            self.clients_list = new_clients_list
+            text = f.read()
+        if '"' in text:
+            self._import_csv_rows(text, cell_separator)
+            return
+        lines = text.splitlines()
+        if not lines or lines[0].split(cell_separator)[0] != "Delivery optimization problem":
+            raise FileExistsError("Incorrect file type.")
+        client_lines, depots = [], []
+        for line in lines[2:]:
+            if line.startswith("client" + cell_separator):
+                client_lines.append(line)
+            elif line.startswith("depot" + cell_separator):
+                row = line.split(cell_separator)
+                depots.append(Depot(row[1], float(row[2]), float(row[3])))
+        if depots:
+            self.depots = depots
+        identifiers = [line.split(cell_separator, 2)[1] for line in client_lines]
+        if client_lines:
+            columns = np.loadtxt(client_lines, delimiter=cell_separator, usecols=(2, 3, 4), ndmin=2, comments=None)
+        else:
+            columns = np.zeros((0, 3))
+        self._number_of_generated_clients += sum("random client" in identifier for identifier in identifiers)
+        self.set_arrays(columns[:, 0], columns[:, 1], columns[:, 2].astype(int), identifiers)
+
+    def _import_csv_rows(self, text, cell_separator):
+        reader = csv.reader(text.splitlines(), delimiter=cell_separator)
+        new_clients_list, depots = list(), list()
+        for i, row in enumerate(reader):
+            if i == 0 and row[0] != "Delivery optimization problem":
+                raise FileExistsError("Incorrect file type.")
+            if i >= 2:
+                if row[0] == "depot":
+                    depots.append(Depot(row[1], float(row[2]), float(row[3])))
+                if row[0] == "client":
+                    new_clients_list.append(Client(row[1], float(row[2]), float(row[3]), int(row[4])))
+                    if "random client" in row[1]:
+                        self._number_of_generated_clients += 1
+        if depots:
+            self.depots = depots
+        self.clients_list = new_clients_list
+
+    def export_npz(self, file_name, solutions=True):
+        """This method exports the problem (and its solutions if solutions is True) to a binary numpy file (.npz).
+        The clients are stored as arrays. The routes of a solution are stored as a flat array of client indices and an
+        array of offsets (the route j is routes[offsets[j]:offsets[j + 1]]), along with the cost and the savings of
+        every delivery so that a loaded solution doesn't need to be evaluated again. The different parameters of a
+        solution and of its deliveries are stored once each, with the index of the parameters of every delivery (and
+        of the solution, -1 if it has none). Cost functions are stored by name ("module:qualname"): they must be
+        defined at the top level of a module.
+        file_name is a string"""
+        arrays = {"depot": np.array([depot.identifier for depot in self.depots], dtype=str),
+                  "depot_coordinates": np.array([[depot.x, depot.y] for depot in self.depots],
+                                                dtype=float).reshape(-1, 2),
+                  "identifiers": np.array(self.identifiers.tolist(), dtype=str), "x": self.x, "y": self.y,
+                  "demand": self.demand,
+                  "number_of_generated_clients": np.array(self._number_of_generated_clients)}
+        solutions_list = self.solutions_list if solutions else []
+        arrays["solution_names"] = np.array([solution.name for solution in solutions_list], dtype=str)
+        for k, solution in enumerate(solutions_list):
+            routes = [self.client_indices(delivery.clients_list) for delivery in solution.deliveries_list]
+            arrays["solution_{}_routes".format(k)] = np.concatenate(routes) if routes else np.zeros(0, dtype=int)
+            depot_index = {id(depot): j for j, depot in enumerate(self.depots)}
+            arrays["solution_{}_depots".format(k)] = np.array(
+                [depot_index[id(delivery.depot)] for delivery in solution.deliveries_list], dtype=int)
+            arrays["solution_{}_offsets".format(k)] = np.cumsum([0] + [len(route) for route in routes])
+            arrays["solution_{}_cost_and_savings".format(k)] = np.array(
+                [delivery.cost_and_savings() for delivery in solution.deliveries_list], dtype=float).reshape(-1, 2)
+            parameters_list = []  # different instances of class DeliveryParameters of the solution
+            parameters_index = dict()  # id(parameters) -> index in parameters_list
+
+            def index_of(parameters):
+                if parameters is None:
+                    return -1
+                if id(parameters) not in parameters_index:
+                    parameters_index[id(parameters)] = len(parameters_list)
+                    parameters_list.append(parameters)
+                return parameters_index[id(parameters)]
+
+            arrays["solution_{}_parameters_index".format(k)] = np.array(index_of(solution.parameters))
+            arrays["solution_{}_delivery_parameters".format(k)] = np.array(
+                [index_of(delivery.parameters) for delivery in solution.deliveries_list], dtype=int)
+            arrays["solution_{}_parameters".format(k)] = np.array(
+                [[parameters.drone.capacity, parameters.drone.speed, parameters.drone.acd, parameters.wind.x,
+                  parameters.wind.y] for parameters in parameters_list], dtype=float).reshape(-1, 5)
+            arrays["solution_{}_cost_functions".format(k)] = np.array(
+                [cost_function_name(parameters.cost_fct) for parameters in parameters_list], dtype=str)
+            for j, parameters in enumerate(parameters_list):
+                if isinstance(parameters.wind, WindField):
+                    for attribute in ("x_grid", "y_grid", "u", "v", "samples"):
+                        arrays["solution_{}_parameters_{}_wind_{}".format(k, j, attribute)] = \
+                            np.asarray(getattr(parameters.wind, attribute))
+        np.savez(file_name, **arrays)
+
+    def import_npz(self, file_name):
+        """This method reads a problem (and its solutions) from a binary numpy file written by export_npz. The solutions
+        are appended to the solutions list. Their costs are not computed again.
+        file_name is a string"""
+        with np.load(file_name, allow_pickle=False) as data:
+            self.depots = [Depot(identifier, x, y) for identifier, (x, y) in
+                           zip(data["depot"].tolist(), data["depot_coordinates"].reshape(-1, 2).tolist())]
+            self.set_arrays(data["x"], data["y"], data["demand"], data["identifiers"].tolist())
+            self._number_of_generated_clients = int(data["number_of_generated_clients"])
+            clients = self.clients_list if len(data["solution_names"]) else None
+            for k, name in enumerate(data["solution_names"].tolist()):
+                parameters_list = read_npz_parameters(data, k)
+                routes = data["solution_{}_routes".format(k)].tolist()
+                offsets = data["solution_{}_offsets".format(k)].tolist()
+                costs_and_savings = data["solution_{}_cost_and_savings".format(k)].tolist()
+                depots = data["solution_{}_depots".format(k)].tolist()
+                if "solution_{}_delivery_parameters".format(k) in data:
+                    solution_parameters = int(data["solution_{}_parameters_index".format(k)])
+                    delivery_parameters = data["solution_{}_delivery_parameters".format(k)].tolist()
+                else:  # files written before the parameters of the deliveries were stored: one set for everything
+                    solution_parameters, delivery_parameters = 0, [0] * len(depots)
+                deliveries_list = []
+                for j in range(len(offsets) - 1):
+                    parameters = parameters_list[delivery_parameters[j]]
+                    delivery = Delivery(Route([clients[i] for i in routes[offsets[j]:offsets[j + 1]]],
+                                              self.depots[depots[j]]), parameters)
+                    if parameters.cost_fct is not None:
+                        delivery.set_cost_and_savings(*costs_and_savings[j])
+                    deliveries_list.append(delivery)
+                self.solutions_list.append(Solution(name, deliveries_list, parameters_list[solution_parameters]
+                                                    if solution_parameters >= 0 else None))
+
+
+def read_npz_parameters(data, k):
+    """Returns the list of the instances of class DeliveryParameters of the k-th solution of a file written by
+    Problem.export_npz (data is the opened file)."""
+    if "solution_{}_cost_functions".format(k) in data:
+        values = data["solution_{}_parameters".format(k)].reshape(-1, 5).tolist()
+        names = data["solution_{}_cost_functions".format(k)].tolist()
+        wind_prefixes = ["solution_{}_parameters_{}_wind_".format(k, j) for j in range(len(names))]
+    else:  # a single set of parameters, written before the parameters of the deliveries were stored
+        values = [data["solution_{}_parameters".format(k)].tolist()]
+        names = [str(data["solution_{}_cost_function".format(k)])]
+        wind_prefixes = ["solution_{}_wind_".format(k)]
+    parameters_list = []
+    for (capacity, speed, acd, wind_x, wind_y), name, prefix in zip(values, names, wind_prefixes):
+        drone = Drone(int(capacity) if capacity.is_integer() else capacity, speed, acd)
+        wind = Wind(wind_x, wind_y)
+        if prefix + "u" in data:
+            wind = WindField(*(data[prefix + attribute] for attribute in ("x_grid", "y_grid", "u", "v")),
+                             samples=int(data[prefix + "samples"]))
+        parameters_list.append(DeliveryParameters(drone, wind, cost_function_from_name(name)))
+    return parameters_list
+
+
+def cost_function_name(cost_fct):
+    """Returns the name "module:qualname" of a cost function defined at the top level of a module ("" for None)."""
+    if cost_fct is None:
+        return ""
+    return "{}:{}".format(cost_fct.__module__, cost_fct.__qualname__)
+
+
+def cost_function_from_name(name):
+    """Returns the cost function named "module:qualname" (see cost_function_name). Returns None for ""."""
+    if not name:
+        return None
+    module_name, qualname = name.split(":")
+    cost_fct = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        cost_fct = getattr(cost_fct, attribute)
+    return cost_fct
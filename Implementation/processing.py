@@ -1,5 +1,9 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import heapq
 import numpy as np
 import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.metrics as met
 
 
 def drone_power_consumption(drone, speed_rel_to_air, rho=1.3):
@@ -27,10 +31,12 @@ def cost_a(point_a, point_b, drone, wind):
     :param point_a: instance of class Point
     :param point_b: instance of class Point
     :param drone: instance of class Drone
-    :param wind: instance of class Wind
+    :param wind: instance of class Wind (or of class WindField: the cost is then integrated along the segment)
     :return: float. Cost from a to b (J).
     """
     # pre.place_holder(point_a, point_b, drone, wind)
+    if isinstance(wind, pre.WindField):  # the cost is integrated along the segment
+        return float(segment_costs(cost_a_array, point_a.x, point_a.y, point_b.x, point_b.y, drone, wind))
     assert drone.speed > 0.  # verifies that the drone can actually move. It raises an AssertError otherwise.
     vecteur_deplacement = np.array((point_b.x-point_a.x, point_b.y-point_a.y))
     distance = np.linalg.norm(vecteur_deplacement)
@@ -55,7 +61,7 @@ def cost_b(point_a, point_b, drone, wind, safety_factor=2):
     :param point_a: instance of class Point
     :param point_b: instance of class Point
     :param drone: instance of class Drone
-    :param wind: instance of class Wind
+    :param wind: instance of class Wind (or of class WindField: the cost is then integrated along the segment)
     :param safety_factor: float. must be strictly greater than 1. The drone must go safety_factor times faster than the
     wind.
     :return: float. Cost from a to b (J).
@@ -64,6 +70,9 @@ def cost_b(point_a, point_b, drone, wind, safety_factor=2):
     # rest of the DEV tasks.
     # pre.place_holder(point_a, point_b, drone, wind)
     assert safety_factor > 1  # verifies that the safety_factor is greater than 1.
+    if isinstance(wind, pre.WindField):  # the cost is integrated along the segment
+        return float(segment_costs(cost_b_array, point_a.x, point_a.y, point_b.x, point_b.y, drone, wind,
+                                   safety_factor=safety_factor))
     assert drone.speed > safety_factor*wind.speed
     vecteur_deplacement = np.array((point_b.x - point_a.x, point_b.y - point_a.y))
     distance = np.linalg.norm(vecteur_deplacement)
@@ -82,6 +91,99 @@ def cost_b(point_a, point_b, drone, wind, safety_factor=2):
         return 0
 
 
+def segments_geometry(x_from, y_from, x_to, y_to):
+    """Returns the tuple (distance, ux, uy) describing the straight segments going from the 'from' points to the 'to'
+    points. The arguments are numpy arrays (or floats) that are broadcast together, so passing column and row vectors
+    gives the geometry of every arc at once.
+    (ux, uy) is the unit vector of each segment. It is set to (0, 0) when the distance is null.
+    :return: tuple of 3 numpy arrays (distances in m, x and y components of the unit vectors)
+    """
+    dx = np.subtract(x_to, x_from)
+    dy = np.subtract(y_to, y_from)
+    distance = np.sqrt(dx ** 2 + dy ** 2)
+    safe_distance = np.where(distance > 0, distance, 1.)  # avoids dividing by zero for null segments
+    return distance, dx / safe_distance, dy / safe_distance
+
+
+def cost_a_array(distance, ux, uy, drone, wind_x, wind_y):
+    """Vectorized version of cost_a. It works on the geometry returned by segments_geometry instead of points.
+    wind_x and wind_y are floats or numpy arrays broadcastable with the geometry.
+    :return: numpy array. Cost of every segment (J)."""
+    assert drone.speed > 0.
+    air_x = drone.speed * ux - wind_x  # speed of the drone relative to the air
+    air_y = drone.speed * uy - wind_y
+    return drone_power_consumption(drone, np.sqrt(air_x ** 2 + air_y ** 2), rho=1.3) * distance / drone.speed
+
+
+def cost_b_array(distance, ux, uy, drone, wind_x, wind_y, safety_factor=2):
+    """Vectorized version of cost_b. It works on the geometry returned by segments_geometry instead of points.
+    wind_x and wind_y are floats or numpy arrays broadcastable with the geometry. The safety_factor assertion must hold
+    for every wind value.
+    :return: numpy array. Cost of every segment (J)."""
+    assert safety_factor > 1
+    wind_speed_2 = np.square(wind_x) + np.square(wind_y)
+    assert np.all(drone.speed > safety_factor * np.sqrt(wind_speed_2))
+    e = wind_x * ux + wind_y * uy
+    f = wind_speed_2 - drone.speed ** 2
+    v3 = e + (0.5 * np.sqrt(4 * e ** 2 - 4 * f))  # speed of the drone relative to the ground (same closed form)
+    return drone_power_consumption(drone, drone.speed, rho=1.3) * distance / v3
+
+
+def segment_costs(array_cost_fct, x_from, y_from, x_to, y_to, drone, wind, **kwargs):
+    """Returns the numpy array of the costs of the segments going from the 'from' points to the 'to' points (broadcast
+    together like in segments_geometry) computed with a vectorized cost function (eg: cost_b_array). kwargs are passed
+    to the cost function.
+    With a wind field (instance of class WindField), each segment is cut into wind.samples pieces of the same length
+    and each piece is flown with the wind of its middle point. The costs of the pieces of all the segments are computed
+    at once (array of shape (samples,) + shape of the segments) and summed along each segment."""
+    geometry = segments_geometry(x_from, y_from, x_to, y_to)
+    if not isinstance(wind, pre.WindField):
+        return array_cost_fct(*geometry, drone, wind.x, wind.y, **kwargs)
+    distance, ux, uy = geometry
+    t = ((np.arange(wind.samples) + 0.5) / wind.samples).reshape((-1,) + (1,) * np.ndim(distance))
+    wind_x, wind_y = wind.at(np.add(x_from, t * np.subtract(x_to, x_from)),
+                             np.add(y_from, t * np.subtract(y_to, y_from)))
+    return array_cost_fct(distance / wind.samples, ux, uy, drone, wind_x, wind_y, **kwargs).sum(axis=0)
+
+
+def wind_field_cost_matrix(array_cost_fct, x, y, drone, wind, block_size=None):
+    """Returns the matrix of the costs of the segments between the points (x[i], y[i]) under a wind field (instance of
+    class WindField), computed like segment_costs with a vectorized cost function (eg: cost_b_array).
+    The segment from point k to point i goes through the same samples as the one from i to k, in the reverse order, so
+    the wind is only evaluated once for both directions. The matrix is computed by square blocks of block_size points
+    (None bounds the (samples, block_size, block_size) arrays to about 2 ** 17 values, which stay in the processor
+    caches): the wind of a block above the diagonal also gives the costs of the block below it."""
+    size = len(x)
+    if block_size is None:
+        block_size = max(1, int(np.sqrt(2 ** 17 / wind.samples)))
+    t = ((np.arange(wind.samples) + 0.5) / wind.samples).reshape(-1, 1, 1)
+    c_matrix = np.empty((size, size))
+    for start in range(0, size, block_size):
+        rows = slice(start, min(start + block_size, size))
+        x_from, y_from = x[rows, np.newaxis], y[rows, np.newaxis]
+        for column_start in range(start, size, block_size):
+            columns = slice(column_start, min(column_start + block_size, size))
+            x_to, y_to = x[np.newaxis, columns], y[np.newaxis, columns]
+            distance, ux, uy = segments_geometry(x_from, y_from, x_to, y_to)
+            wind_x, wind_y = wind.at(x_from + t * (x_to - x_from), y_from + t * (y_to - y_from))
+            distance /= wind.samples
+            c_matrix[rows, columns] = array_cost_fct(distance, ux, uy, drone, wind_x, wind_y).sum(axis=0)
+            if column_start > start:  # same samples, flown the other way
+                c_matrix[columns, rows] = array_cost_fct(distance, -ux, -uy, drone, wind_x, wind_y).sum(axis=0).T
+    return c_matrix
+
+
+# Cost functions that have a closed form working on whole arrays of segments. Any other cost function (eg: a user
+# defined one or a functools.partial) goes through the point by point loop.
+VECTORIZED_COST_FUNCTIONS = {cost_a: cost_a_array, cost_b: cost_b_array}
+
+
+def points_coordinates(problem):
+    """Returns the tuple (x, y) of numpy arrays holding the coordinates of the depot (index 0) followed by the ones of
+    the clients of the problem (index i+1 for the i-th client). This is the indexing used by cost_matrix."""
+    return problem.coordinates()
+
+
 def check_route_compatibility(route_a, route_b):
     """Checks if two routes don't have inherent incompatibilities. Returns True if no incompatibility and False
     otherwise."""
@@ -162,20 +264,65 @@ def merge_deliveries(delivery_a, delivery_b, must_have_common_client=False):
     if check_delivery_compatibility(delivery_a, delivery_b):
         new_route = merge_routes(delivery_a.route, delivery_b.route, must_have_common_client)
         if new_route:
-            new_delivery = pre.Delivery(new_route, delivery_a.parameters)
+            new_delivery = pre.Delivery(new_route, delivery_a.parameters, delivery_a.cost_table)
             if new_delivery.is_legal:
                 return new_delivery
         else:
             return None
 
 
-def cost_matrix(problem, parameters):
+def cached_arrays(cache, kind, problem, parameters, names, compute, c_matrix=None):
+    """Returns the tuple of arrays returned by compute (a function without arguments). The arrays are loaded from the
+    cache if it holds an entry of this kind for the problem and the parameters, and stored in it otherwise.
+    :param cache: instance of class MatrixCache (see matrix_cache.py) or None (no cache)
+    :param kind: string. Kind of entry (eg: "cost").
+    :param names: tuple of strings. Names of the arrays returned by compute.
+    :param c_matrix: cost matrix given by the caller that compute uses, or None. It is part of the key of the entry."""
+    if cache is None or not parameters.cost_fct:
+        return compute()
+    key = cache.key(kind, problem, parameters, c_matrix)
+    arrays = cache.load(key, names)
+    if arrays is None:
+        arrays = compute()
+        cache.save(key, dict(zip(names, arrays)))
+    return arrays
+
+
+def cost_matrix(problem, parameters, vectorized=True, cache=None, metrics=None):
     """This function returns the cost matrix of a problem for a given parameter set.
+    Row/column 0 is the depot and row/column i+1 is the i-th client of the problem.
+    If the cost function has a closed form in VECTORIZED_COST_FUNCTIONS (cost_a and cost_b), the whole matrix is built
+    at once from the coordinates. Otherwise, the cost function is called for every pair of points.
     :param problem: Instance of class Problem
     :param parameters: Instance of class DeliveryParameters
+    :param vectorized: boolean, default True. Set it to False to force the point by point computation.
+    :param cache: instance of class MatrixCache (see matrix_cache.py). If given, the matrix is only computed if the
+    cache doesn't hold it yet.
+    :param metrics: instance of class SolverMetrics (see metrics.py) or None. Receives the "cost matrix" phase, the
+    "cost function evaluations" counter and the memory of the matrix.
     :return: 2-dimensional numpy array representing the cost matrix"""
     # pre.place_holder(problem, parameters)
+    with met.phase(metrics, "cost matrix"):
+        return cached_arrays(cache, "cost", problem, parameters, ("cost",),
+                             lambda: (compute_cost_matrix(problem, parameters, vectorized, metrics),))[0]
+
+
+def compute_cost_matrix(problem, parameters, vectorized=True, metrics=None):
+    """Computes the cost matrix of a problem without using any cache (see cost_matrix)."""
     mat_dim = problem.number_of_clients + 1
+    array_cost_fct = VECTORIZED_COST_FUNCTIONS.get(parameters.cost_fct) if vectorized else None
+    if array_cost_fct is not None:
+        x, y = points_coordinates(problem)
+        if isinstance(parameters.wind, pre.WindField):
+            c_matrix = wind_field_cost_matrix(array_cost_fct, x, y, parameters.drone, parameters.wind)
+        else:
+            c_matrix = segment_costs(array_cost_fct, x[:, np.newaxis], y[:, np.newaxis], x[np.newaxis, :],
+                                     y[np.newaxis, :], parameters.drone, parameters.wind)
+        c_matrix[0][0] = 0.  # the depot to depot cost is never evaluated
+        if metrics is not None:
+            metrics.count("cost function evaluations", mat_dim ** 2 - 1)
+            metrics.matrices("cost matrix", c_matrix)
+        return c_matrix
     c_matrix = np.zeros((mat_dim, mat_dim))  # creates a square matrix (2-dimensional numpy array) filled with zeros
     if parameters.cost_fct:
         for i in range(0, len(problem.clients_list)):
@@ -190,85 +337,582 @@ def cost_matrix(problem, parameters):
         for i in range(0, len(problem.clients_list)):
             for k in range(i+1, len(problem.clients_list)+1):
                 c_matrix[i][k] = c_matrix[k][i] = None
+    if metrics is not None:
+        if parameters.cost_fct:
+            metrics.count("cost function evaluations", mat_dim ** 2 - 1)
+        metrics.matrices("cost matrix", c_matrix)
     return c_matrix
 
 
-def savings_matrix(problem, parameters):
+def cost_table(problem, parameters, c_matrix=None):
+    """Returns an instance of class CostTable holding the cost matrix of the problem, so that the costs of the
+    deliveries of the problem are looked up instead of being computed again.
+    :param c_matrix: cost matrix of the problem (result of cost_matrix). Computed if None."""
+    if c_matrix is None:
+        c_matrix = cost_matrix(problem, parameters)
+    return pre.CostTable(c_matrix, problem.depot, problem.clients_list, parameters)
+
+
+def scenario_winds(winds):
+    """Returns the tuple (wind_x, wind_y) of 1-dimensional numpy arrays holding the wind of every scenario.
+    :param winds: list of instances of class Wind or array-like of shape (number of scenarios, 2) holding the speeds
+    (m.s-1) on the x and y axes"""
+    if len(winds) and hasattr(winds[0], "vector"):
+        if any(isinstance(wind, pre.WindField) for wind in winds):
+            raise ValueError("Unexpected wind : WindField. Please use instances of class Wind for the scenarios")
+        winds = [(wind.x, wind.y) for wind in winds]
+    winds = np.asarray(winds, dtype=float).reshape(-1, 2)
+    return winds[:, 0], winds[:, 1]
+
+
+def scenario_cost_tensor(problem, parameters, winds):
+    """Returns the cost matrices of the problem under several wind scenarios as a 3-dimensional numpy array of shape
+    (number of scenarios, n+1, n+1): c_tensor[s] is the cost matrix (see cost_matrix) for the wind of the s-th
+    scenario, the drone and the cost function of parameters (the wind of parameters is ignored).
+    With a cost function of VECTORIZED_COST_FUNCTIONS, the distances and unit vectors of the arcs are computed once and
+    the scenarios are broadcast against them (a few scenarios at a time to bound the size of the temporary arrays).
+    Any other cost function is called for every pair of points of every scenario.
+    :param winds: see scenario_winds"""
+    wind_x, wind_y = scenario_winds(winds)
+    mat_dim = problem.number_of_clients + 1
+    c_tensor = np.empty((len(wind_x), mat_dim, mat_dim))
+    array_cost_fct = VECTORIZED_COST_FUNCTIONS.get(parameters.cost_fct)
+    if array_cost_fct is None:
+        for s in range(len(wind_x)):
+            scenario = pre.DeliveryParameters(parameters.drone, pre.Wind(wind_x[s], wind_y[s]), parameters.cost_fct)
+            c_tensor[s] = compute_cost_matrix(problem, scenario)
+        return c_tensor
+    x, y = points_coordinates(problem)
+    distance, ux, uy = segments_geometry(x[:, np.newaxis], y[:, np.newaxis], x[np.newaxis, :], y[np.newaxis, :])
+    scenarios_per_chunk = max(1, 2 ** 22 // mat_dim ** 2)
+    for start in range(0, len(wind_x), scenarios_per_chunk):
+        stop = start + scenarios_per_chunk
+        c_tensor[start:stop] = array_cost_fct(distance, ux, uy, parameters.drone,
+                                              wind_x[start:stop, np.newaxis, np.newaxis],
+                                              wind_y[start:stop, np.newaxis, np.newaxis])
+    c_tensor[:, 0, 0] = 0.  # the depot to depot cost is never evaluated
+    return c_tensor
+
+
+def scenario_costs(solution, winds, weights=None, problem=None, c_tensor=None):
+    """Scores a solution under several wind scenarios at once. Only the arcs flown by the solution are evaluated: the
+    geometry of the arcs is computed once and the scenarios are broadcast against it. Deliveries without cost function
+    are ignored (like in Solution.cost_and_savings).
+    :param solution: instance of class Solution. The drone and the cost function are the ones of its parameters.
+    :param winds: see scenario_winds
+    :param weights: probabilities of the scenarios (normalised). None means equally likely scenarios.
+    :param problem: instance of class Problem. Only needed with c_tensor.
+    :param c_tensor: result of scenario_cost_tensor for the problem and the same winds. If given, the costs of the arcs
+    are looked up in it (the deliveries must leave from problem.depot).
+    :return: tuple (costs, expected_cost, worst_cost) where costs is the numpy array of the total cost of the solution
+    under every scenario (J)"""
+    wind_x, wind_y = scenario_winds(winds)
+    deliveries = [delivery for delivery in solution.deliveries_list
+                  if delivery.parameters.cost_fct and delivery.clients_list]
+    if c_tensor is not None:
+        rows = [np.concatenate(([0], problem.client_indices(delivery.clients_list) + 1, [0]))
+                for delivery in deliveries]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+        breaks = np.cumsum([len(delivery.clients_list) + 2 for delivery in deliveries], dtype=int)[:-1]
+        arcs = np.ones(len(rows), dtype=bool)
+        arcs[breaks - 1] = False  # last point of a delivery -> first point of the next one
+        origins, destinations = rows[:-1][arcs[:-1]], rows[1:][arcs[:-1]]
+        costs = c_tensor[:, origins, destinations].sum(axis=1)
+    else:
+        x_from, y_from, x_to, y_to = [], [], [], []
+        for delivery in deliveries:
+            points = [delivery.depot] + delivery.clients_list + [delivery.depot]
+            x_from += [point.x for point in points[:-1]]
+            y_from += [point.y for point in points[:-1]]
+            x_to += [point.x for point in points[1:]]
+            y_to += [point.y for point in points[1:]]
+        drone, cost_fct = solution.parameters.drone, solution.parameters.cost_fct
+        array_cost_fct = VECTORIZED_COST_FUNCTIONS.get(cost_fct)
+        if array_cost_fct is not None:
+            geometry = segments_geometry(np.array(x_from), np.array(y_from), np.array(x_to), np.array(y_to))
+            costs = array_cost_fct(*geometry, drone, wind_x[:, np.newaxis], wind_y[:, np.newaxis]).sum(axis=1)
+        else:
+            costs = np.zeros(len(wind_x))
+            for s in range(len(wind_x)):
+                wind = pre.Wind(wind_x[s], wind_y[s])
+                costs[s] = sum(cost_fct(pre.Point("", *a), pre.Point("", *b), drone, wind)
+                               for a, b in zip(zip(x_from, y_from), zip(x_to, y_to)))
+    costs = np.asarray(costs, dtype=float)
+    if len(costs) == 0:
+        return costs, 0., 0.
+    return costs, float(np.average(costs, weights=weights)), float(costs.max())
+
+
+def savings_from_cost_matrix(c_matrix):
+    """Returns the savings matrix corresponding to a cost matrix (see cost_matrix for the indexing).
+    s[i][k] = c[i+1][0] + c[0][k+1] - c[i+1][k+1] is the saving obtained by delivering client k right after client i
+    instead of going back to the depot in between. The diagonal is set to 0.
+    :param c_matrix: 2-dimensional numpy array of shape (n+1, n+1)
+    :return: 2-dimensional numpy array of shape (n, n)"""
+    s_matrix = c_matrix[1:, :1] + c_matrix[:1, 1:] - c_matrix[1:, 1:]
+    np.fill_diagonal(s_matrix, 0.)
+    return s_matrix
+
+
+# Number of savings (rows of the savings matrix times the number of clients) computed or checked at once by
+# positive_savings_blocks (when rows_per_block is not given) and sort_savings.
+SAVINGS_BLOCK_SIZE = 2 ** 20
+
+
+def savings_rows(c_matrix, start, stop):
+    """Returns the rows start to stop (excluded) of the savings matrix of a cost matrix (see savings_from_cost_matrix),
+    with the diagonal set to 0."""
+    block = c_matrix[start + 1:stop + 1, :1] + c_matrix[:1, 1:] - c_matrix[start + 1:stop + 1, 1:]
+    block[np.arange(stop - start), np.arange(start, stop)] = 0.
+    return block
+
+
+def positive_savings_blocks(c_matrix, rows_per_block=None):
+    """Generator yielding the positive off-diagonal savings of a cost matrix rows_per_block rows at a time (None means
+    about SAVINGS_BLOCK_SIZE savings per block). Every block is a tuple (first_indices, second_indices, savings) in the
+    sparse form returned by positive_savings, and the blocks come in row order."""
+    n = c_matrix.shape[0] - 1
+    if rows_per_block is None:
+        rows_per_block = max(1, SAVINGS_BLOCK_SIZE // max(1, n))
+    for start in range(0, n, rows_per_block):
+        stop = min(start + rows_per_block, n)
+        block = savings_rows(c_matrix, start, stop)
+        rows, cols = np.nonzero(block > 0)
+        yield (rows + start).astype(np.int32), cols.astype(np.int32), block[rows, cols]
+
+
+def positive_savings(c_matrix, rows_per_block=None):
+    """Returns the positive off-diagonal savings of a cost matrix in a sparse form: a tuple (first_indices,
+    second_indices, savings) where savings[j] is the saving of delivering client second_indices[j] right after client
+    first_indices[j]. Clients are indexed from 0 (ie row/column i+1 of the cost matrix) and the entries are in row-major
+    order.
+    The savings are computed rows_per_block rows at a time (see positive_savings_blocks) and copied in arrays of the
+    final size, so that only the positive entries are kept in memory.
+    :return: tuple of 3 one-dimensional numpy arrays (int32, int32, float)"""
+    n = c_matrix.shape[0] - 1
+    if rows_per_block is None:
+        rows_per_block = max(1, SAVINGS_BLOCK_SIZE // max(1, n))
+    size = sum(np.count_nonzero(savings_rows(c_matrix, start, min(start + rows_per_block, n)) > 0)
+               for start in range(0, n, rows_per_block))
+    first_indices, second_indices, savings = np.empty(size, dtype=np.int32), np.empty(size, dtype=np.int32), \
+        np.empty(size)
+    start = 0
+    for block in positive_savings_blocks(c_matrix, rows_per_block):
+        stop = start + len(block[0])
+        first_indices[start:stop], second_indices[start:stop], savings[start:stop] = block
+        start = stop
+    return first_indices, second_indices, savings
+
+
+def savings_matrix(problem, parameters, c_matrix=None, positive_only=False, cache=None):
     """This function returns the savings matrix of a problem for a given parameter set.
+    The savings are derived from the cost matrix (see savings_from_cost_matrix), the cost function is not called again.
     :param problem. Instance of class Problem
     :param parameters. Instance of class DeliveryParameters
-    :return 2-dimensional numpy array representing the savings matrix"""
+    :param c_matrix. Cost matrix of the problem (result of cost_matrix). Computed if None.
+    :param positive_only. boolean, default False. If True, only the positive savings are returned in the sparse form
+    described in positive_savings.
+    :param cache. Instance of class MatrixCache (see matrix_cache.py). If given, the savings (and the cost matrix) are
+    only computed if the cache doesn't hold them yet.
+    :return 2-dimensional numpy array representing the savings matrix (or the sparse form if positive_only is True)"""
     # pre.place_holder(problem, parameters)
     mat_dim = problem.number_of_clients
-    c_matrix = cost_matrix(problem, parameters)
-    s_matrix = np.zeros((mat_dim, mat_dim))  # creates a square matrix (2-dimensional numpy array) filled with zeros
-    if parameters.cost_fct:
-        for i in range(0, len(problem.clients_list)):
-            for k in range(0, len(problem.clients_list)):
-                if k != i:
-                    a = parameters.cost_fct(problem.clients_list[i], problem.depot, parameters.drone, parameters.wind)
-                    b = parameters.cost_fct(problem.depot, problem.clients_list[k], parameters.drone, parameters.wind)
-                    s_matrix[i][k] = a + b - c_matrix[i+1][k+1]
-    return s_matrix
+    if not parameters.cost_fct:
+        if positive_only:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        return np.zeros((mat_dim, mat_dim))
+
+    def compute():
+        matrix = c_matrix if c_matrix is not None else cost_matrix(problem, parameters, cache=cache)
+        return positive_savings(matrix) if positive_only else (savings_from_cost_matrix(matrix),)
+
+    if positive_only:
+        return cached_arrays(cache, "positive savings", problem, parameters, ("first", "second", "savings"), compute,
+                             c_matrix)
+    return cached_arrays(cache, "savings", problem, parameters, ("savings",), compute, c_matrix)[0]
+
+
+def arc_costs(problem, parameters, origins, destinations, metrics=None):
+    """Returns the numpy array of the costs of the arcs going from the points 'origins' to the points 'destinations'
+    (arrays of indices of points, indexed like in cost_matrix: 0 is the depot and i+1 is the i-th client). Only these
+    arcs are evaluated, with the vectorized cost function if there is one.
+    :param metrics: instance of class SolverMetrics or None. Receives the "cost function evaluations" counter."""
+    origins = np.asarray(origins, dtype=np.intp)
+    destinations = np.asarray(destinations, dtype=np.intp)
+    if metrics is not None:
+        metrics.count("cost function evaluations", len(origins))
+    array_cost_fct = VECTORIZED_COST_FUNCTIONS.get(parameters.cost_fct)
+    if array_cost_fct is not None:
+        x, y = points_coordinates(problem)
+        arcs_per_chunk = 2 ** 22 // getattr(parameters.wind, "samples", 1)  # wind fields: see segment_costs
+        costs = np.zeros(len(origins))
+        for start in range(0, len(origins), arcs_per_chunk):
+            chunk_origins = origins[start:start + arcs_per_chunk]
+            chunk_destinations = destinations[start:start + arcs_per_chunk]
+            costs[start:start + arcs_per_chunk] = segment_costs(array_cost_fct, x[chunk_origins], y[chunk_origins],
+                                                                x[chunk_destinations], y[chunk_destinations],
+                                                                parameters.drone, parameters.wind)
+        return costs
+    points = [problem.depot] + problem.clients_list
+    return np.array([parameters.cost_fct(points[i], points[k], parameters.drone, parameters.wind)
+                     for i, k in zip(origins.tolist(), destinations.tolist())], dtype=float)
+
+
+def grid_nearest_neighbours(x, y, k=10, points_per_cell=None):
+    """Returns the int array of shape (n, min(k, n - 1)) whose row i holds the indices of the k points the closest to
+    point i (euclidean distance), the closest first.
+    The points are put in a uniform grid (about points_per_cell points per cell, 2 * k by default). The neighbours of
+    the points of a cell are looked for in the square of cells around it, which is widened until it contains k
+    neighbours for every point and is large enough to be sure that no point outside of it is closer."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.zeros((n, max(k, 0)), dtype=int)
+    if points_per_cell is None:
+        points_per_cell = 2 * k
+    x_min, y_min = x.min(), y.min()
+    area = max(x.max() - x_min, 1e-9) * max(y.max() - y_min, 1e-9)
+    cell_size = np.sqrt(area * points_per_cell / n)
+    nx = int((x.max() - x_min) // cell_size) + 1
+    ny = int((y.max() - y_min) // cell_size) + 1
+    cells = (np.minimum(((y - y_min) // cell_size).astype(int), ny - 1) * nx +
+             np.minimum(((x - x_min) // cell_size).astype(int), nx - 1))
+    order = np.argsort(cells, kind="stable")
+    starts = np.searchsorted(cells[order], np.arange(nx * ny + 1))
+    neighbours = np.zeros((n, k), dtype=int)
+    for cell in np.unique(cells).tolist():
+        members = order[starts[cell]:starts[cell + 1]]
+        gx, gy = cell % nx, cell // nx
+        r = 1
+        while True:
+            x_range = (max(gx - r, 0), min(gx + r, nx - 1))
+            y_range = (max(gy - r, 0), min(gy + r, ny - 1))
+            candidates = np.concatenate([order[starts[row * nx + x_range[0]]:starts[row * nx + x_range[1] + 1]]
+                                         for row in range(y_range[0], y_range[1] + 1)])
+            whole_grid = x_range == (0, nx - 1) and y_range == (0, ny - 1)
+            if len(candidates) > k:
+                distances = np.square(x[members, np.newaxis] - x[candidates]) + \
+                    np.square(y[members, np.newaxis] - y[candidates])
+                distances[members[:, np.newaxis] == candidates] = np.inf  # a point is not its own neighbour
+                closest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                closest_distances = np.take_along_axis(distances, closest, axis=1)
+                # points outside of the square are at least r cells away from the points of the cell
+                if whole_grid or closest_distances.max() <= (r * cell_size) ** 2:
+                    closest = np.take_along_axis(closest, np.argsort(closest_distances, axis=1, kind="stable"), axis=1)
+                    neighbours[members] = candidates[closest]
+                    break
+            r += 1
+    return neighbours
+
+
+def granular_savings(problem, parameters, neighbours=10, metrics=None):
+    """Returns the positive savings of the pairs of clients that are neighbours (one of the two clients is one of the
+    'neighbours' nearest clients of the other one, see grid_nearest_neighbours), in the sparse form returned by
+    positive_savings (row-major order). Only the arcs between neighbours and the arcs to and from the depot are
+    evaluated, so no n*n array is ever built. With neighbours >= n - 1, the result is the same as positive_savings.
+    :param metrics: instance of class SolverMetrics or None (see arc_costs)
+    :return: tuple of 3 one-dimensional numpy arrays (int32, int32, float)"""
+    n = problem.number_of_clients
+    if not parameters.cost_fct or n < 2:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+    nearest = grid_nearest_neighbours(problem.x, problem.y, neighbours)
+    first = np.repeat(np.arange(n, dtype=np.int64), nearest.shape[1])
+    second = nearest.ravel().astype(np.int64)
+    # both directions of every pair, each one once
+    first, second = np.divmod(np.unique(np.concatenate((first * n + second, second * n + first))), n)
+    clients = np.arange(1, n + 1)
+    depot = np.zeros(n, dtype=int)
+    to_depot = arc_costs(problem, parameters, clients, depot, metrics)
+    from_depot = arc_costs(problem, parameters, depot, clients, metrics)
+    savings = to_depot[first] + from_depot[second] - arc_costs(problem, parameters, first + 1, second + 1, metrics)
+    positive = savings > 0
+    return first[positive].astype(np.int32), second[positive].astype(np.int32), savings[positive]
+
+
+def is_row_major(first_indices, second_indices):
+    """Returns True if the pairs (first_indices[j], second_indices[j]) are in row-major order. They are checked
+    SAVINGS_BLOCK_SIZE at a time."""
+    span = int(second_indices.max()) + 1 if len(second_indices) else 1
+    for start in range(0, len(first_indices) - 1, SAVINGS_BLOCK_SIZE):
+        stop = min(start + SAVINGS_BLOCK_SIZE + 1, len(first_indices))
+        pairs = first_indices[start:stop].astype(np.int64) * span + second_indices[start:stop]
+        if np.any(pairs[1:] < pairs[:-1]):
+            return False
+    return True
+
 
+def sort_savings(first_indices, second_indices, savings, copy=True):
+    """Sorts index-based savings in descending order. Equal savings are sorted by first index, then by second index,
+    so the order never depends on the sorting algorithm or on the order of the entries.
+    The savings are sorted with numpy's default (fast but unstable) argsort, then every run of equal savings is put
+    back in row-major order with a second sort on the keys run * len(savings) + position, which are all different.
+    :param copy: boolean, default True. If False, the given arrays are sorted in place, one at a time, which holds
+    fewer arrays in memory.
+    :return: tuple (sorted_savings, first_indices, second_indices) of one-dimensional numpy arrays"""
+    if not is_row_major(first_indices, second_indices):  # positive_savings and granular_savings are row-major
+        row_major = np.lexsort((second_indices, first_indices))
+        return sort_savings(first_indices[row_major], second_indices[row_major], savings[row_major], copy=False)
+    size = len(savings)
+    keys = -savings if copy else np.negative(savings, out=savings)
+    order = np.argsort(keys)
+    runs = np.zeros(size, dtype=np.int64)  # runs[j] = number of different savings before the j-th one
+    for start in range(0, size - 1, SAVINGS_BLOCK_SIZE):
+        stop = min(start + SAVINGS_BLOCK_SIZE + 1, size)
+        sorted_keys = keys[order[start:stop]]
+        runs[start + 1:stop] = sorted_keys[1:] != sorted_keys[:-1]
+    np.cumsum(runs, out=runs)
+    if size and runs[-1] < size - 1:  # some savings are equal
+        runs *= size
+        runs += order
+        runs.sort()
+        np.mod(runs, size, out=order)
+    del runs
+    if copy:
+        return savings[order], first_indices[order], second_indices[order]
+    np.negative(savings, out=savings)
+    for array in (savings, first_indices, second_indices):
+        array[:] = array[order]
+    return savings, first_indices, second_indices
 
-def clarke_and_wright_init(problem, parameters):
+
+def stream_sorted_savings(sorted_blocks, chunk_size=4096):
+    """Generator yielding the tuples (saving, i, k) in the same order as sort_savings, from blocks of savings that are
+    each sorted by sort_savings (eg: the sorted blocks of positive_savings_blocks). The blocks are merged with a heap
+    (heapq.merge) and only chunk_size entries of each block are turned into python objects at a time, so the whole
+    sorted array and the python list of all the pairs are never built."""
+    def block_keys(sorted_savings, first_indices, second_indices):
+        for start in range(0, len(sorted_savings), chunk_size):
+            stop = start + chunk_size
+            # the heap keeps the smallest key first: (-saving, i, k) is the key of sort_savings
+            yield from zip((-sorted_savings[start:stop]).tolist(), first_indices[start:stop].tolist(),
+                           second_indices[start:stop].tolist())
+
+    for key, i, k in heapq.merge(*(block_keys(*block) for block in sorted_blocks)):
+        yield -key, i, k
+
+
+def clarke_and_wright_init(problem, parameters, mode="clients", positive_only=True, c_matrix=None, cache=None,
+                           neighbours=None, metrics=None):
     """This function initializes the Clarke and Wright algorithm.
-    This function calculates the savings matrix and returns a tuple (sorted_savings, client_pairs) where:
+    With mode="clients", this function calculates the savings matrix and returns a tuple (sorted_savings,
+    client_pairs) where:
     sorted_savings = the sorted savings in a one-dimensional numpy array (sorted in descending order)
     client_pairs = list of tuples in the form (client_i, client_j) where client_i and client_j are clients of the
     problem. client_i and client_j of the k-th tuple represent the clients associated with the k-th value of
-    sorted_savings."""
+    sorted_savings.
+    With mode="indices", it returns a tuple (sorted_savings, first_indices, second_indices) where first_indices and
+    second_indices are int32 numpy arrays holding the indices of the clients in problem.clients_list. If positive_only
+    is True, only the positive off-diagonal savings are kept, otherwise all the n*n entries are (in the "clients"
+    order). Equal savings are sorted by client indices (see sort_savings).
+    With mode="stream", it returns a generator of the same savings as tuples (saving, i, k) in the same order. The
+    positive savings are then computed and sorted by blocks of rows, which are merged while they are consumed (see
+    stream_sorted_savings), so only the positive savings are held in memory.
+    :param c_matrix: cost matrix of the problem (result of cost_matrix). Computed if None.
+    :param cache: instance of class MatrixCache (see matrix_cache.py). If given, the cost matrix and the sorted savings
+    are only computed if the cache doesn't hold them yet.
+    :param neighbours: int or None. If given, only the positive savings of the pairs of neighbours are computed (see
+    granular_savings) and the cost matrix is not built. positive_only and c_matrix are then ignored.
+    :param metrics: instance of class SolverMetrics or None. Receives the "savings" and "sort savings" phases (only
+    when they are computed, not when they come from the cache) and the memory of the savings."""
     # look for the numpy methods 'flatten' and 'argsort'.
     # pre.place_holder(problem, parameters)
-    if parameters.cost_fct:
-        the_list = savings_matrix(problem, parameters).flatten()
-        indice_list = np.argsort(the_list)
-        sorted_savings = []
-        clients_pairs = []
-        for j in range(0, len(indice_list)):
-            k = indice_list[j]
-            sorted_savings.append(the_list[k])
-            a = k // len(problem.clients_list)
-            b = k % len(problem.clients_list)
-            # problem.clients_list[a].identifier = "client_{}".format(a)
-            # problem.clients_list[b].identifier = "client_{}".format(b)
-            clients_pairs.append((problem.clients_list[a], problem.clients_list[b]))
-            # clients_pairs.append(({client_{}}.format(problem.clients_list[a]),{}.format(problem.clients_list[b]))
-        sorted_savings.reverse()
-        clients_pairs.reverse()
-        np_sorted_savings = np.array(sorted_savings)
-        return np_sorted_savings, clients_pairs
-    else:
-        return [], []
+    if mode not in ("clients", "indices", "stream"):
+        raise ValueError("Unexpected mode : {}. Please use 'clients', 'indices' or 'stream'".format(mode))
+    if mode == "clients":
+        if not parameters.cost_fct:
+            return [], []
+        sorted_savings, first_indices, second_indices = clarke_and_wright_init(problem, parameters, "indices", False,
+                                                                               c_matrix, cache, neighbours, metrics)
+        clients = problem.clients_list
+        return sorted_savings, [(clients[i], clients[k]) for i, k in zip(first_indices.tolist(),
+                                                                          second_indices.tolist())]
+
+    def unsorted_savings():
+        with met.phase(metrics, "savings"):
+            savings = compute_unsorted_savings()
+        if metrics is not None:
+            metrics.matrices("savings", c_matrix, *savings)
+        return savings
+
+    def compute_unsorted_savings():
+        if neighbours is not None:
+            return granular_savings(problem, parameters, neighbours, metrics)
+        matrix = c_matrix if c_matrix is not None or not parameters.cost_fct else \
+            cost_matrix(problem, parameters, cache=cache, metrics=metrics)
+        if positive_only:
+            return savings_matrix(problem, parameters, matrix, positive_only=True)
+        s_matrix = savings_matrix(problem, parameters, matrix)
+        rows, cols = np.indices(s_matrix.shape, dtype=np.int32)
+        if not parameters.cost_fct:
+            return rows.ravel()[:0], cols.ravel()[:0], s_matrix.ravel()[:0]
+        return rows.ravel(), cols.ravel(), s_matrix.ravel()
+
+    def sorted_blocks():
+        if neighbours is not None or not positive_only or not parameters.cost_fct:
+            savings = unsorted_savings()
+            with met.phase(metrics, "sort savings"):
+                return [sort_savings(*savings, copy=False)]
+        matrix = c_matrix if c_matrix is not None else cost_matrix(problem, parameters, cache=cache, metrics=metrics)
+        blocks = []
+        iterator = positive_savings_blocks(matrix)
+        while True:
+            with met.phase(metrics, "savings"):
+                block = next(iterator, None)
+            if block is None:
+                break
+            with met.phase(metrics, "sort savings"):
+                blocks.append(sort_savings(*block, copy=False))
+        if metrics is not None:
+            metrics.matrices("savings", c_matrix, *(array for block in blocks for array in block))
+        return blocks
 
+    if mode == "stream":
+        return stream_sorted_savings(sorted_blocks())
+    kind = "sorted positive savings" if positive_only else "sorted savings"
+    if neighbours is not None:
+        kind = "sorted granular savings ({} neighbours)".format(neighbours)
 
-def add_single_client_deliveries(deliveries_list, problem, parameters):
+    def sorted_savings():
+        savings = unsorted_savings()
+        with met.phase(metrics, "sort savings"):
+            return sort_savings(*savings, copy=False)
+
+    return cached_arrays(cache, kind, problem, parameters, ("savings", "first", "second"), sorted_savings,
+                         c_matrix if neighbours is None else None)
+
+
+def add_single_client_deliveries(deliveries_list, problem, parameters, cost_table=None):
     """This function modifies the deliveries_list argument by adding deliveries containing a single client.
     Only clients that are present in the problem but not present in any delivery are added. It first checks that the
-    client can legally be delivered."""
+    client can legally be delivered. cost_table (instance of class CostTable) is given to the new deliveries."""
     # pre.place_holder(deliveries_list, problem, parameters)
-    list_of_clients = []
+    present_clients = set()  # ids of the clients already delivered. Clients are compared by identity.
     for delivery in deliveries_list:
-        for j in range(len(delivery.clients_list)):
-            list_of_clients.append(delivery.clients_list[j])
-    absent_clients = []
-    for client in problem.clients_list:
-        client_number_of_apparence = 0
-        for client_already_present in list_of_clients:
-            if client == client_already_present:
-                client_number_of_apparence += 1
-        if client_number_of_apparence == 0:
-            absent_clients.append(client)
+        present_clients.update(id(client) for client in delivery.clients_list)
+    absent_clients = [client for client in problem.clients_list if id(client) not in present_clients]
     # return absent_clients
     for absent_one in absent_clients:
         route_absent_one = pre.Route([absent_one], problem.depot)
-        delivery_absent_one = pre.Delivery(route_absent_one, parameters)
+        delivery_absent_one = pre.Delivery(route_absent_one, parameters, cost_table)
         if delivery_absent_one.is_legal:
             deliveries_list.append(delivery_absent_one)
     return deliveries_list
 
 
+def savings_triples(problem, sorted_savings, client_pairs=None, second_indices=None):
+    """Returns an iterable of tuples (saving, i, k) where i and k are indices in problem.clients_list. It accepts every
+    output format of clarke_and_wright_init:
+    - sorted_savings and client_pairs = list of (client_i, client_k) tuples ("clients" mode)
+    - sorted_savings, client_pairs = first_indices and second_indices ("indices" mode)
+    - sorted_savings = iterable of (saving, i, k) tuples and client_pairs = None ("stream" mode)"""
+    if client_pairs is None:
+        return sorted_savings
+    if second_indices is not None:
+        return zip(np.asarray(sorted_savings).tolist(), np.asarray(client_pairs).tolist(),
+                   np.asarray(second_indices).tolist())
+    index = {id(client): i for i, client in enumerate(problem.clients_list)}
+    return zip(list(sorted_savings), [index[id(pair[0])] for pair in client_pairs],
+               [index[id(pair[1])] for pair in client_pairs])
+
+
+def deliveries_from_routes(problem, parameters, routes, cost_table=None):
+    """Returns a list of instances of class Delivery from a list of routes given as lists of client indices (indices in
+    problem.clients_list). Single client deliveries are added at the end if necessary.
+    cost_table (instance of class CostTable) is given to the deliveries."""
+    clients = problem.clients_list
+    deliveries_list = [pre.Delivery(pre.Route([clients[i] for i in route], problem.depot), parameters, cost_table)
+                       for route in routes]
+    add_single_client_deliveries(deliveries_list, problem, parameters, cost_table)
+    return deliveries_list
+
+
+def parallel_build_routes(demands, capacity, savings, metrics=None):
+    """Index-based engine of the parallel version of Clarke and Wright.
+    Every client knows the route it starts (head_route) or ends (tail_route) and every route keeps its load, so each
+    saving is handled in constant time. The routes are stored as linked lists (successor) and only turned into lists
+    of indices at the end.
+    For a saving (i, k), the route ending with i and the route starting with k are merged, i is put in front of the
+    route starting with k, k is put at the end of the route ending with i or a new route [i, k] is created, as long as
+    the capacity allows it and i and k are not delivered elsewhere. Negative savings are ignored.
+    :param demands: sequence of the demands of the clients
+    :param capacity: capacity of the drone
+    :param savings: iterable of tuples (saving, i, k) sorted in descending order (see savings_triples)
+    :param metrics: instance of class SolverMetrics or None. Receives the "merge attempts" (savings examined),
+    "accepted merges" and "delivery lookups" (routes looked up by their first or last client) counters.
+    :return: list of routes (lists of client indices). A route goes to the end of the list every time it changes.
+    """
+    n = len(demands)
+    head_route = [-1] * n  # head_route[i] = route starting with client i (-1 if none)
+    tail_route = [-1] * n  # tail_route[i] = route ending with client i (-1 if none)
+    assigned = [False] * n
+    successor = [-1] * n  # next client on the route
+    heads, tails, loads, stamps = [], [], [], []  # stamp = when the route last changed (gives the order of the list)
+    stamp = 0
+    attempts = lookups = 0
+    for attempts, (saving, i, k) in enumerate(savings, 1):
+        if saving < 0 or i == k or demands[i] + demands[k] > capacity:
+            continue
+        lookups += 2
+        route_c = tail_route[i]
+        route_d = head_route[k]
+        if route_c >= 0 and route_d >= 0:
+            if route_c == route_d or loads[route_c] + loads[route_d] > capacity:
+                continue
+            successor[i] = k  # route_d is appended to route_c
+            tail_route[i] = head_route[k] = -1
+            tails[route_c] = tails[route_d]
+            tail_route[tails[route_d]] = route_c
+            loads[route_c] += loads[route_d]
+            stamps[route_c] = stamp
+            stamps[route_d] = -1  # route_d does not exist anymore
+        elif route_d >= 0:
+            if assigned[i] or loads[route_d] + demands[i] > capacity:
+                continue
+            successor[i] = k
+            head_route[k] = -1
+            head_route[i] = route_d
+            heads[route_d] = i
+            assigned[i] = True
+            loads[route_d] += demands[i]
+            stamps[route_d] = stamp
+        elif route_c >= 0:
+            if assigned[k] or loads[route_c] + demands[k] > capacity:
+                continue
+            successor[i] = k
+            tail_route[i] = -1
+            tail_route[k] = route_c
+            tails[route_c] = k
+            assigned[k] = True
+            loads[route_c] += demands[k]
+            stamps[route_c] = stamp
+        else:
+            if assigned[i] or assigned[k]:
+                continue
+            successor[i] = k
+            head_route[i] = tail_route[k] = len(heads)
+            assigned[i] = assigned[k] = True
+            heads.append(i)
+            tails.append(k)
+            loads.append(demands[i] + demands[k])
+            stamps.append(stamp)
+        stamp += 1
+    if metrics is not None:
+        metrics.count("merge attempts", attempts)
+        metrics.count("accepted merges", stamp)
+        metrics.count("delivery lookups", lookups)
+    routes = []
+    for route in sorted((r for r in range(len(heads)) if stamps[r] >= 0), key=stamps.__getitem__):
+        client = heads[route]
+        clients_list = [client]
+        while client != tails[route]:
+            client = successor[client]
+            clients_list.append(client)
+        routes.append(clients_list)
+    return routes
+
+
 def sequential_merge_if_possible(delivery_a, delivery_b):
     """This function tries to merge two deliveries if possible in the sequential version of Clarke and Wright
     (ie the two deliveries MUST have a common client at their borders except if at least one of the deliveries is empty)
@@ -300,134 +944,212 @@ def search_deliveries_for_client(client, deliveries_list, include_first=True, in
     return None
 
 
-def sequential_build_deliveries(problem, parameters, sorted_savings, client_pairs):
+def savings_arrays(problem, sorted_savings, client_pairs=None, second_indices=None):
+    """Same as savings_triples but returns the tuple of numpy arrays (sorted_savings, first_indices, second_indices)."""
+    if second_indices is not None:
+        return np.asarray(sorted_savings, dtype=float), np.asarray(client_pairs), np.asarray(second_indices)
+    triples = list(savings_triples(problem, sorted_savings, client_pairs))
+    if not triples:
+        return np.zeros(0), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    savings, first_indices, second_indices = zip(*triples)
+    return np.array(savings, dtype=float), np.array(first_indices), np.array(second_indices)
+
+
+def sequential_build_routes(demands, capacity, sorted_savings, first_indices, second_indices, metrics=None):
+    """Index-based engine of the sequential version of Clarke and Wright.
+    Routes are built one at a time. A route starts with the first legal pair of clients that are not delivered yet and
+    is then extended by its two ends only: the next pair is the first one (in the savings order) that starts with the
+    last client of the route or ends with its first client. Each client keeps a pointer on the pairs it starts or ends,
+    and pairs that can't be used anymore (client already delivered or not enough capacity left) are skipped for good,
+    so the savings list is never scanned again after a merge.
+    The pairs considered for a route are the same as in the original implementation: the pairs whose clients are both
+    undelivered when the route starts, limited to the number of non negative savings. The original stopping rule
+    (number of failed merge attempts equal to the number of pairs left) is reproduced by counting the attempts that a
+    full rescan after every merge would have made.
+    :param demands: sequence of the demands of the clients
+    :param capacity: capacity of the drone
+    :param sorted_savings: savings sorted in descending order (numpy array)
+    :param first_indices: indices of the first clients of the pairs (numpy array)
+    :param second_indices: indices of the second clients of the pairs (numpy array)
+    :param metrics: instance of class SolverMetrics or None. Receives the "merge attempts" (the attempts of the
+    original implementation, failed ones included), "accepted merges" and "delivery lookups" (searches of the next
+    pair by the first or last client of the route) counters.
+    :return: list of routes (lists of client indices)
+    """
+    n = len(demands)
+    demands = np.asarray(demands)
+    first_indices = np.asarray(first_indices, dtype=np.intp)
+    second_indices = np.asarray(second_indices, dtype=np.intp)
+    nb_non_negative = int(np.count_nonzero(np.asarray(sorted_savings) >= 0))
+    # pairs that can start a route on their own
+    legal_pairs = (first_indices != second_indices) & (demands[first_indices] + demands[second_indices] <= capacity)
+    # positions of the pairs starting (resp. ending) with each client, in the savings order
+    starting_with = np.argsort(first_indices, kind="stable")
+    ending_with = np.argsort(second_indices, kind="stable")
+    starting_bounds = np.searchsorted(first_indices[starting_with], np.arange(n + 1))
+    ending_bounds = np.searchsorted(second_indices[ending_with], np.arange(n + 1))
+    starting_pointer = starting_bounds[:-1].copy()
+    ending_pointer = ending_bounds[:-1].copy()
+    assigned = np.zeros(n, dtype=bool)
+    routes = []
+    attempts = lookups = 0
+
+    def first_usable(client, positions, bounds, pointer, other_clients, spare_capacity, last_position):
+        """Returns the position of the first usable pair starting (or ending) with client. -1 if there is none."""
+        candidates = positions[pointer[client]:bounds[client + 1]]
+        others = other_clients[candidates]
+        usable = ~assigned[others] & (demands[others] <= spare_capacity)
+        if not usable.any():
+            pointer[client] = bounds[client + 1]
+            return -1
+        j = int(np.argmax(usable))
+        pointer[client] += j  # the pairs before can never be used again
+        return int(candidates[j]) if candidates[j] <= last_position else -1
+
+    # "left" pairs = pairs whose two clients were undelivered when the current route started. Their positions in the
+    # list rescanned by the original implementation are obtained from counts kept by blocks of the savings list.
+    block_size = 4096
+    nb_blocks = len(first_indices) // block_size + 1
+    left = np.ones(len(first_indices), dtype=bool)
+    left_per_block = np.bincount(np.arange(len(first_indices)) // block_size, minlength=nb_blocks)
+    startable_per_block = np.bincount(np.flatnonzero(legal_pairs) // block_size, minlength=nb_blocks)
+
+    def nth_left(nth, cumulative):
+        """Returns the position of the nth (starting from 0) left pair."""
+        block = int(np.searchsorted(cumulative, nth, side="right"))
+        within = nth - (cumulative[block] - left_per_block[block])
+        return block * block_size + int(np.flatnonzero(left[block * block_size:(block + 1) * block_size])[within])
+
+    def remove_pairs_of(client):
+        """Removes the pairs starting or ending with client from the left pairs."""
+        for positions in (starting_with[starting_bounds[client]:starting_bounds[client + 1]],
+                          ending_with[ending_bounds[client]:ending_bounds[client + 1]]):
+            positions = positions[left[positions]]
+            left[positions] = False
+            left_per_block[:] -= np.bincount(positions // block_size, minlength=nb_blocks)
+            startable_per_block[:] -= np.bincount(positions[legal_pairs[positions]] // block_size, minlength=nb_blocks)
+
+    while True:
+        cumulative = np.cumsum(left_per_block)
+        nb_left = int(cumulative[-1])
+        nb_considered = min(nb_left, nb_non_negative)  # the original only tries the first nb_non_negative pairs
+        startable_blocks = np.flatnonzero(startable_per_block)
+        if nb_considered == 0 or len(startable_blocks) == 0:
+            break
+        last_position = nth_left(nb_considered - 1, cumulative)
+        block = int(startable_blocks[0])
+        in_block = slice(block * block_size, (block + 1) * block_size)
+        k = block * block_size + int(np.flatnonzero(left[in_block] & legal_pairs[in_block])[0])
+        if k > last_position:
+            break
+        route = deque((int(first_indices[k]), int(second_indices[k])))
+        assigned[list(route)] = True
+        load = demands[route[0]] + demands[route[1]]
+        left_before_block = cumulative - left_per_block
+        failed_attempts = nb_considered - 1
+        while True:
+            lookups += 2
+            position_out = first_usable(route[-1], starting_with, starting_bounds, starting_pointer, second_indices,
+                                        capacity - load, last_position)
+            position_in = first_usable(route[0], ending_with, ending_bounds, ending_pointer, first_indices,
+                                       capacity - load, last_position)
+            if position_out < 0 and position_in < 0:
+                break
+            if position_in < 0 or 0 <= position_out < position_in:
+                route.append(int(second_indices[position_out]))
+                position = position_out
+                client = route[-1]
+            else:
+                route.appendleft(int(first_indices[position_in]))
+                position = position_in
+                client = route[0]
+            assigned[client] = True
+            load += demands[client]
+            # a rescan from the top would have failed on every left pair before this one (except the first one)
+            block = position // block_size
+            rank = left_before_block[block] + np.count_nonzero(left[block * block_size:position])
+            failed_attempts += int(rank) - 1
+        routes.append(list(route))
+        attempts += failed_attempts + len(route) - 1
+        for client in route:
+            remove_pairs_of(client)
+        if failed_attempts == nb_left:
+            break
+    if metrics is not None:
+        metrics.count("merge attempts", attempts)
+        metrics.count("accepted merges", sum(len(route) - 1 for route in routes))
+        metrics.count("delivery lookups", lookups)
+    return routes
+
+
+def sequential_build_deliveries(problem, parameters, sorted_savings, client_pairs=None, second_indices=None,
+                                cost_table=None, metrics=None):
     """This function returns a list of instances of class Delivery calculated with the use of the sequential Clarke
-    and Wright algorithm. Single client deliveries are added at the end if necessary."""
+    and Wright algorithm. Single client deliveries are added at the end if necessary.
+    The savings can be given in any of the formats returned by clarke_and_wright_init (see savings_triples). The routes
+    are built by sequential_build_routes. cost_table (instance of class CostTable) is given to the deliveries.
+    metrics (instance of class SolverMetrics or None) receives the "build routes" and "create deliveries" phases and
+    the counters of sequential_build_routes."""
     # pre.place_holder(problem, parameters, sorted_savings, client_pairs)
-    deliveries_list = []
-    j = 0
-    # clients_restants = problem.clients_list
-    client_pairs_modifie = client_pairs
-    while j < len(client_pairs)+1:
-        i = -1
-        a = 0
-        k = 0
-        while k < len(client_pairs_modifie):
-            pair = client_pairs_modifie[k]
-            if sorted_savings[k] >= 0:
-                if i < 0:   # indicateur pour voir si on vient de commencer le nouvel itinéraire ou pas
-                    route_a = pre.Route([], problem.depot)
-                    delivery_a = pre.Delivery(route_a, parameters)
-                else:
-                    delivery_a = deliveries_list[-1]
-                route_b = pre.Route([pair[0], pair[1]], problem.depot)
-                delivery_b = pre.Delivery(route_b, parameters)
-                delivery_c = sequential_merge_if_possible(delivery_a, delivery_b)
-                # if k == 3 and j == 1:
-                #     print (4, delivery_a.clients_list, delivery_b.clients_list, delivery_c)
-                if delivery_c:
-                    if i < 0:
-                        deliveries_list.append(delivery_c)
-                        i += 1
-                    else:
-                        deliveries_list[-1] = delivery_c
-                        k = 0
-                    # a = 0
-                if not delivery_c:
-                    a += 1
-            k += 1
-        if a == len(client_pairs_modifie):
-            add_single_client_deliveries(deliveries_list, problem, parameters)
-            # for delivery in deliveries_list:
-            #     delivery.print()
-            return deliveries_list
-        client_pairs_modifie = []
-        for k, pair in enumerate(client_pairs):
-            if (search_deliveries_for_client(pair[0], deliveries_list) is None) and \
-                    (search_deliveries_for_client(pair[1], deliveries_list) is None):
-                client_pairs_modifie.append(pair)
-        # if j == 0:
-        #     print(client_pairs_modifie)
-        #     # c'est la qu'on voit l'ordre des couples adapté après la 1ère boucle
-        # clients_restants = []
-        # for client in problem.clients_list:
-        #     if search_deliveries_for_client(client, deliveries_list) is None:
-        #         clients_restants.append(client)
-        j += 1
-
-
-def parallel_build_deliveries(problem, parameters, sorted_savings, client_pairs):
+    demands = problem.demand
+    with met.phase(metrics, "build routes"):
+        routes = sequential_build_routes(demands, parameters.drone.capacity,
+                                         *savings_arrays(problem, sorted_savings, client_pairs, second_indices),
+                                         metrics=metrics)
+    with met.phase(metrics, "create deliveries"):
+        return deliveries_from_routes(problem, parameters, routes, cost_table)
+
+
+def parallel_build_deliveries(problem, parameters, sorted_savings, client_pairs=None, second_indices=None,
+                             cost_table=None, metrics=None):
     """This function returns a list of instances of class Delivery calculated with the use of the parallel Clarke
-    and Wright algorithm. Single client deliveries are added at the end if necessary."""
+    and Wright algorithm. Single client deliveries are added at the end if necessary.
+    The savings can be given in any of the formats returned by clarke_and_wright_init (see savings_triples). The routes
+    are built by parallel_build_routes. cost_table (instance of class CostTable) is given to the deliveries.
+    metrics (instance of class SolverMetrics or None) receives the "build routes" and "create deliveries" phases and
+    the counters of parallel_build_routes."""
     # pre.place_holder(problem, parameters, sorted_savings, client_pairs)
-    deliveries_list = []
-    for k, pair in enumerate(client_pairs):
-        # print(k)
-        if sorted_savings[k] >= 0:
-            route_b = pre.Route([pair[0], pair[1]], problem.depot)
-            delivery_b = pre.Delivery(route_b, parameters)
-            if delivery_b.is_legal:
-                if len(deliveries_list) == 0:
-                    deliveries_list.append(delivery_b)
-                else:
-                    route_b = pre.Route([pair[0], pair[1]], problem.depot)
-                    delivery_b = pre.Delivery(route_b, parameters)
-                    if search_deliveries_for_client(pair[0], deliveries_list, False, False, True) and \
-                            search_deliveries_for_client(pair[1], deliveries_list, True, False, False):
-                        delivery_c = search_deliveries_for_client(pair[0], deliveries_list, False, False, True)
-                        delivery_d = search_deliveries_for_client(pair[1], deliveries_list, True, False, False)
-                        delivery_e = sequential_merge_if_possible(delivery_b, delivery_c)
-                        # delivery_f = sequential_merge_if_possible(delivery_b, delivery_d)
-                        if delivery_e and delivery_d:
-                            delivery_z = sequential_merge_if_possible(delivery_e, delivery_d)
-                            if delivery_z:
-                                deliveries_list.append(delivery_z)
-                                deliveries_list.remove(delivery_c)
-                                deliveries_list.remove(delivery_d)
-                    elif not search_deliveries_for_client(pair[0], deliveries_list, False, False, True) and \
-                            search_deliveries_for_client(pair[1], deliveries_list, True, False, False):
-                        delivery_d = search_deliveries_for_client(pair[1], deliveries_list, True, False, False)
-                        delivery_z = sequential_merge_if_possible(delivery_b, delivery_d)
-                        if delivery_z and not search_deliveries_for_client(pair[0], deliveries_list):
-                            deliveries_list.append(delivery_z)
-                            deliveries_list.remove(delivery_d)
-                    elif search_deliveries_for_client(pair[0], deliveries_list, False, False, True) and not \
-                            search_deliveries_for_client(pair[1], deliveries_list, True, False, False):
-                        delivery_c = search_deliveries_for_client(pair[0], deliveries_list, False, False, True)
-                        delivery_z = sequential_merge_if_possible(delivery_c, delivery_b)
-                        if delivery_z and not search_deliveries_for_client(pair[1], deliveries_list):
-                            deliveries_list.append(delivery_z)
-                            deliveries_list.remove(delivery_c)
-                    elif not search_deliveries_for_client(pair[0], deliveries_list, False, False, True) and not \
-                            search_deliveries_for_client(pair[1], deliveries_list, True, False, False):
-                        if not search_deliveries_for_client(pair[0], deliveries_list) and not \
-                                search_deliveries_for_client(pair[1], deliveries_list) and delivery_b:
-                            deliveries_list.append(delivery_b)
-    add_single_client_deliveries(deliveries_list, problem, parameters)
-    # for delivery in deliveries_list:
-    #     delivery.print()
-    return deliveries_list
+    demands = problem.demand.tolist()
+    with met.phase(metrics, "build routes"):
+        routes = parallel_build_routes(demands, parameters.drone.capacity,
+                                       savings_triples(problem, sorted_savings, client_pairs, second_indices), metrics)
+    with met.phase(metrics, "create deliveries"):
+        return deliveries_from_routes(problem, parameters, routes, cost_table)
 
 
-def build_deliveries(problem, parameters, version, sorted_savings, client_pairs):
+def build_deliveries(problem, parameters, version, sorted_savings, client_pairs, second_indices=None,
+                     cost_table=None, metrics=None):
     """Returns a list of deliveries resulting from the use of the Clarke and Wright algorithm.
     :param problem: problem to solve
     :param parameters: parameters of the deliveries
     :param version: version of the Clarke and Wright algorithm. Must be "Sequential" or "Parallel".
     :param sorted_savings: list of the savings sorted in descending order. Result of clarke_and_wright_init.
     :param client_pairs: list of pairs of clients relative to sorted_savings. Result of clarke_and_wright_init.
+    In "indices" mode, array of the indices of the first clients of the pairs.
+    :param second_indices: array of the indices of the second clients of the pairs ("indices" mode only).
+    :param cost_table: instance of class CostTable given to the deliveries (see cost_table). Can be None.
+    :param metrics: instance of class SolverMetrics (see metrics.py) or None.
     :return list: list of instances of class Delivery.
     """
     if version == "sequential":
-        return sequential_build_deliveries(problem, parameters, sorted_savings, client_pairs)
+        return sequential_build_deliveries(problem, parameters, sorted_savings, client_pairs, second_indices,
+                                           cost_table, metrics)
     if version == "parallel":
-        return parallel_build_deliveries(problem, parameters, sorted_savings, client_pairs)
+        return parallel_build_deliveries(problem, parameters, sorted_savings, client_pairs, second_indices,
+                                         cost_table, metrics)
     return []
 
 
-def clarke_and_wright(problem, parameters, version="sequential", name=None, verbose=True):
+def clarke_and_wright(problem, parameters, version="sequential", name=None, verbose=True, cache=None, neighbours=None,
+                      metrics=None):
     """Solves a problem using the clarke and Wright algorithm. Creates a solution and appends it to the end of the
-    solutions list of the problem."""
+    solutions list of the problem.
+    cache (instance of class MatrixCache, see matrix_cache.py) can be given to reuse the matrices of a previous run.
+    If neighbours (int) is given, only the savings between each client and its nearest neighbours are computed (see
+    granular_savings) and no cost matrix is built, which is how large problems (100k+ clients) can be solved.
+    metrics (instance of class SolverMetrics, see metrics.py) receives the timings of the phases of the solve ("clarke
+    and wright" for the whole solve), its counters and the peak memory of the matrices. Nothing is measured if it is
+    None."""
     if version != "sequential" and version != "parallel":
         print("Unexpected version : {}".format(version))
         print("Please use 'sequential' or 'parallel'")
@@ -435,16 +1157,359 @@ def clarke_and_wright(problem, parameters, version="sequential", name=None, verb
     if name is None:
         name = version + " Clarke and Wright. Drone capacity = {}".format(parameters.drone.capacity)
 
-    if verbose:
-        print("Initialising Clarke & Wright {} version...".format(version), end=' ', flush=True)
-    init = clarke_and_wright_init(problem, parameters)
+    with met.phase(metrics, "clarke and wright"):
+        if verbose:
+            print("Initialising Clarke & Wright {} version...".format(version), end=' ', flush=True)
+        c_matrix = cost_matrix(problem, parameters, cache=cache, metrics=metrics) \
+            if parameters.cost_fct and neighbours is None else None
+        # The sequential version looks at every pair (even with a negative saving) once some clients are delivered
+        init = clarke_and_wright_init(problem, parameters, mode="indices", positive_only=(version == "parallel"),
+                                      c_matrix=c_matrix, cache=cache, neighbours=neighbours, metrics=metrics)
+        if metrics is not None:
+            metrics.matrices("clarke and wright", c_matrix, *init)
+        if verbose:
+            print("done !")
+
+            print("Building deliveries...".format(version), end=' ', flush=True)
+        table = cost_table(problem, parameters, c_matrix) if c_matrix is not None else None
+        deliveries_list = build_deliveries(problem, parameters, version, *init, cost_table=table, metrics=metrics)
+        problem.solutions_list.append(pre.Solution(name, deliveries_list, parameters))
     if verbose:
         print("done !")
+        problem.solutions_list[-1].print(False)
+
+
+def solve_subset(problem, parameters, indices, version="parallel", c_matrix=None):
+    """Solves with Clarke and Wright the subproblem made of the clients of the given indices. The cost matrix of the
+    subproblem is sliced from the cost matrix of the whole problem (c_matrix, computed if None), so the cost function is
+    never called again.
+    :return: tuple (routes, cost) where routes is the list of the routes of the deliveries (single client deliveries
+    included) given as lists of indices in problem.clients_list and cost is the total cost of these deliveries."""
+    indices = np.asarray(indices, dtype=int)
+    if len(indices) == 0:
+        return [], 0.
+    if c_matrix is None:
+        c_matrix = cost_matrix(problem, parameters)
+    rows = np.concatenate(([0], indices + 1))
+    routes, costs_and_savings = solve_routes(problem.subproblem(indices), parameters, version,
+                                             c_matrix[np.ix_(rows, rows)])
+    return [indices[route].tolist() for route in routes], sum(cost for cost, _ in costs_and_savings)
+
+
+def solve_routes(problem, parameters, version="parallel", c_matrix=None, neighbours=None):
+    """Solves a problem with Clarke and Wright (like clarke_and_wright) without creating a solution.
+    :param c_matrix: cost matrix of the problem. Computed if None (unless neighbours is given, see granular_savings).
+    :return: tuple (routes, costs_and_savings) where routes is the list of the routes of the deliveries (single client
+    deliveries included) given as lists of indices in problem.clients_list and costs_and_savings is the list of the
+    tuples (cost, savings) of the deliveries."""
+    if problem.number_of_clients == 0:
+        return [], []
+    if c_matrix is None and neighbours is None and parameters.cost_fct:
+        c_matrix = cost_matrix(problem, parameters)
+    init = clarke_and_wright_init(problem, parameters, mode="indices", positive_only=(version == "parallel"),
+                                  c_matrix=c_matrix, neighbours=neighbours)
+    table = cost_table(problem, parameters, c_matrix) if c_matrix is not None else None
+    deliveries_list = build_deliveries(problem, parameters, version, *init, cost_table=table)
+    routes = [problem.client_indices(delivery.clients_list).tolist() for delivery in deliveries_list]
+    return routes, [delivery.cost_and_savings() for delivery in deliveries_list]
+
+
+_partition_sweep_data = None  # (problem, parameters_list, matrices) in the worker processes of partition_sweep
+
+
+def _init_partition_sweep_worker(problem, parameters_list, matrices):
+    global _partition_sweep_data
+    _partition_sweep_data = (problem, parameters_list, matrices)
+
+
+def _solve_partition_subset(fleet_index, indices, version):
+    problem, parameters_list, matrices = _partition_sweep_data
+    return solve_subset(problem, parameters_list[fleet_index], indices, version, matrices[fleet_index])
+
+
+def partition_sweep(problem, parameters_1, parameters_2, thresholds, version="parallel", workers=None):
+    """Splits the clients of a problem between two drones according to their demand and looks for the best threshold.
+    For a threshold t, the clients with a demand lower or equal to t are delivered with parameters_1 and the others with
+    parameters_2. Each part is solved with Clarke and Wright (see solve_subset).
+    One cost matrix per drone is computed for the whole problem and sliced for every part. Thresholds giving the same
+    partition as a previous one are not solved again. The parts are solved in a pool of processes (workers processes,
+    os.cpu_count() if None). workers=0 solves them in the current process.
+    Scripts using a pool of processes must protect their entry point with 'if __name__ == "__main__":'.
+    :param thresholds: iterable of demand thresholds. It must not be empty.
+    :return: tuple (costs, best_threshold, best_solutions) where costs is the numpy array of the total costs (one per
+    threshold), best_threshold is the first threshold with the lowest cost and best_solutions is the tuple of the two
+    instances of class Solution of the best split."""
+    thresholds = np.asarray(list(thresholds))
+    if len(thresholds) == 0:
+        raise ValueError("Unexpected thresholds : {}. Please use at least one threshold".format(thresholds.tolist()))
+    demand = problem.demand
+    # partitions only depend on the number of clients with a demand lower or equal to the threshold
+    counts = np.searchsorted(np.sort(demand), thresholds, side="right")
+    unique_counts, first_thresholds, inverse = np.unique(counts, return_index=True, return_inverse=True)
+    tasks = []
+    for j in first_thresholds.tolist():
+        low = demand <= thresholds[j]
+        tasks.append((0, np.flatnonzero(low)))
+        tasks.append((1, np.flatnonzero(~low)))
+
+    parameters_list = (parameters_1, parameters_2)
+    matrices = tuple(cost_matrix(problem, parameters) for parameters in parameters_list)
+    if workers == 0:
+        _init_partition_sweep_worker(problem, parameters_list, matrices)
+        results = [_solve_partition_subset(fleet_index, indices, version) for fleet_index, indices in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_partition_sweep_worker,
+                                 initargs=(problem, parameters_list, matrices)) as executor:
+            results = list(executor.map(_solve_partition_subset, *zip(*tasks), [version] * len(tasks)))
+
+    partition_costs = np.array([results[2 * j][1] + results[2 * j + 1][1] for j in range(len(unique_counts))])
+    costs = partition_costs[inverse.ravel()]
+    best = int(np.argmin(costs))
+    j = int(inverse.ravel()[best])
+    clients = problem.clients_list
+    best_solutions = []
+    for fleet_index, (routes, _) in enumerate(results[2 * j:2 * j + 2]):
+        parameters = parameters_list[fleet_index]
+        table = cost_table(problem, parameters, matrices[fleet_index])
+        deliveries_list = [pre.Delivery(pre.Route([clients[i] for i in route], problem.depot), parameters, table)
+                           for route in routes]
+        name = "{} Clarke and Wright. Demand {} {}".format(version, "<=" if fleet_index == 0 else ">",
+                                                           thresholds[best])
+        best_solutions.append(pre.Solution(name, deliveries_list, parameters))
+    return costs, thresholds[best], tuple(best_solutions)
+
+
+class P2Quantile:
+    """Streaming estimate of the p-quantile of a series of values with the P-square algorithm (Jain and Chlamtac,
+    1985). Only 5 markers are kept: the minimum, the maximum, the estimated quantile and two intermediate ones. Their
+    heights are adjusted with a parabolic (or linear) interpolation as the values arrive. The estimate is exact while
+    there are at most 5 values."""
 
-        print("Building deliveries...".format(version), end=' ', flush=True)
-    deliveries_list = build_deliveries(problem, parameters, version, *init)
+    def __init__(self, p):
+        self.p = p  # float in [0, 1]
+        self._heights = []  # heights of the markers (the first values, sorted, until there are 5 of them)
+        self._positions = np.arange(1., 6.)  # actual positions of the markers
+        self._desired = np.array([1., 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.])  # desired positions of the markers
+        self._increments = np.array([0., p / 2, p, (1 + p) / 2, 1.])
+
+    def update(self, value):
+        heights = self._heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+        positions = self._positions
+        positions[k + 1:] += 1
+        self._desired += self._increments
+        for i in range(1, 4):
+            offset = self._desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if offset > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:  # the parabola isn't monotonic there
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                                                   (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    @property
+    def value(self):
+        """Estimated quantile (nan if there is no value yet)."""
+        if len(self._heights) < 5:
+            return float(np.quantile(self._heights, self.p)) if self._heights else np.nan
+        return float(self._heights[2])
+
+
+class RunningStatistics:
+    """Streaming mean and variance of a series of values (Welford's algorithm) and estimates of the quantiles given at
+    creation (see P2Quantile). The memory used doesn't depend on the number of values."""
+
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.  # sum of the squared differences to the mean
+        self._quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        for estimator in self._quantiles.values():
+            estimator.update(value)
+
+    @property
+    def variance(self):
+        """Sample variance (0 if less than 2 values)."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.
+
+    def quantiles(self, q):
+        """Returns the numpy array of the estimates of the quantiles q (sequence of floats given at creation)."""
+        for p in q:
+            if p not in self._quantiles:
+                raise ValueError("Unexpected quantile : {}. Please use one of the quantiles given at creation : {}"
+                                 .format(p, tuple(self._quantiles)))
+        return np.array([self._quantiles[p].value for p in q])
+
+    def summary(self, q):
+        return {"mean": self.mean, "variance": self.variance, "quantiles": dict(zip(q, self.quantiles(q).tolist()))}
+
+
+def random_trial(seed_sequence, depot, amount, x, y, demand, wind_x, wind_y):
+    """Returns a tuple (problem, wind) drawn with the random stream of seed_sequence (instance of
+    numpy.random.SeedSequence). The number of clients is drawn in [amount[0], amount[1][ and the clients are drawn with
+    Problem.generate_random_clients. The components of the wind are drawn uniformly in the ranges wind_x and wind_y."""
+    rng = np.random.default_rng(seed_sequence)
+    problem = pre.Problem(depot)
+    problem.generate_random_clients(int(rng.integers(amount[0], amount[1])), x, y, demand, rng=rng)
+    wind = pre.Wind(rng.uniform(*wind_x), rng.uniform(*wind_y))
+    return problem, wind
+
+
+def _fleet_trial(seed_sequence, drones, cost_fct, version, generator_spec):
+    """Solves one random problem with every drone and returns the array of the (cost, savings) of the solutions."""
+    problem, wind = random_trial(seed_sequence, **generator_spec)
+    results = np.zeros((len(drones), 2))
+    for j, drone in enumerate(drones):
+        parameters = pre.DeliveryParameters(drone, wind, cost_fct)
+        c_matrix = cost_matrix(problem, parameters)
+        init = clarke_and_wright_init(problem, parameters, mode="indices", positive_only=(version == "parallel"),
+                                      c_matrix=c_matrix)
+        deliveries_list = build_deliveries(problem, parameters, version, *init,
+                                           cost_table=cost_table(problem, parameters, c_matrix))
+        results[j] = pre.Solution(deliveries_list=deliveries_list, parameters=parameters).cost_and_savings()
+    return results
+
+
+def fleet_monte_carlo(drones, trials, seed=0, wind_x=(0., 0.), wind_y=(0., 0.), depot=None, amount=(50, 60),
+                      x=(-10000, 10000), y=(-10000, 10000), demand=(1, 100), cost_fct=cost_b, version="sequential",
+                      workers=None, quantiles=(0.05, 0.5, 0.95)):
+    """Evaluates drones on random problems (Monte Carlo). Every trial draws a problem and a wind (see random_trial) and
+    solves it with Clarke and Wright for every drone, so the drones are compared on the same problems.
+    Trial i uses the i-th stream spawned from numpy.random.SeedSequence(seed): the result only depends on seed, not on
+    the number of workers. The trials are solved in a pool of processes (workers processes, os.cpu_count() if None).
+    workers=0 solves them in the current process. Only the cost and the savings of the solutions are sent back, and they
+    are aggregated in the order of the trials.
+    Scripts using a pool of processes must protect their entry point with 'if __name__ == "__main__":'.
+    :param drones: list of instances of class Drone
+    :param wind_x: range (min, max) of the x component of the wind (m/s). Use (v, v) for a constant wind.
+    :return: list of dictionaries (one per drone) with the keys "drone", "trials", "cost" and "savings rate" (each one a
+    dictionary with the keys "mean", "variance" and "quantiles") and "total savings rate" (total savings / (total
+    savings + total cost))."""
+    if depot is None:
+        depot = pre.Depot()
+    generator_spec = {"depot": depot, "amount": amount, "x": x, "y": y, "demand": demand, "wind_x": wind_x,
+                      "wind_y": wind_y}
+    seeds = np.random.SeedSequence(seed).spawn(trials)
+    arguments = (seeds, [drones] * trials, [cost_fct] * trials, [version] * trials, [generator_spec] * trials)
+    cost_statistics = [RunningStatistics(quantiles) for _ in drones]
+    rate_statistics = [RunningStatistics(quantiles) for _ in drones]
+    totals = np.zeros((len(drones), 2))
+
+    def aggregate(results):
+        for trial_results in results:  # in the order of the trials
+            for j, (cost, savings) in enumerate(trial_results.tolist()):
+                cost_statistics[j].update(cost)
+                rate_statistics[j].update(savings / (savings + cost) if savings + cost else 0.)
+            totals[:] += trial_results
+
+    if workers == 0:
+        aggregate(map(_fleet_trial, *arguments))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            aggregate(executor.map(_fleet_trial, *arguments, chunksize=max(1, trials // (8 * (workers or 8)))))
+
+    report = []
+    for j, drone in enumerate(drones):
+        total_cost, total_savings = totals[j].tolist()
+        report.append({"drone": drone, "trials": trials, "cost": cost_statistics[j].summary(quantiles),
+                       "savings rate": rate_statistics[j].summary(quantiles),
+                       "total savings rate": total_savings / (total_savings + total_cost) if trials else 0.})
+    return report
+
+
+def depot_assignment(problem, parameters=None, criterion="distance"):
+    """Returns the int numpy array of the index (in problem.depots) of the depot assigned to each client:
+    - criterion="distance": the nearest depot
+    - criterion="energy": the depot with the lowest round trip cost (depot -> client -> depot) for the given parameters,
+    which takes the wind into account
+    Ties go to the first depot."""
+    depots_x = np.array([depot.x for depot in problem.depots], dtype=float)[:, np.newaxis]
+    depots_y = np.array([depot.y for depot in problem.depots], dtype=float)[:, np.newaxis]
+    if criterion == "distance":
+        scores = np.square(problem.x - depots_x) + np.square(problem.y - depots_y)
+    elif criterion == "energy":
+        array_cost_fct = VECTORIZED_COST_FUNCTIONS.get(parameters.cost_fct)
+        if array_cost_fct is not None:
+            drone, wind = parameters.drone, parameters.wind
+            scores = (segment_costs(array_cost_fct, depots_x, depots_y, problem.x, problem.y, drone, wind) +
+                      segment_costs(array_cost_fct, problem.x, problem.y, depots_x, depots_y, drone, wind))
+        else:
+            scores = np.array([[parameters.cost_fct(depot, client, parameters.drone, parameters.wind) +
+                                parameters.cost_fct(client, depot, parameters.drone, parameters.wind)
+                                for client in problem.clients_list] for depot in problem.depots]).reshape(
+                len(problem.depots), problem.number_of_clients)
+    else:
+        raise ValueError("Unexpected criterion : {}. Please use 'distance' or 'energy'".format(criterion))
+    return np.argmin(scores, axis=0)
+
+
+def multi_depot_clarke_and_wright(problem, parameters, version="parallel", criterion="distance", assignment=None,
+                                  name=None, verbose=True, workers=None, neighbours=None):
+    """Solves a problem with several depots (problem.depots) using the Clarke and Wright algorithm. Creates a solution
+    and appends it to the end of the solutions list of the problem.
+    Every client is assigned to a depot (see depot_assignment, or assignment = array of the depot indices of the
+    clients). The subproblem of each depot is solved on its own cost matrix (see solve_routes) in a pool of processes
+    (workers processes, os.cpu_count() if None). workers=0 solves them in the current process. Only the routes and the
+    costs of the deliveries are sent back, the deliveries of all the depots are then combined in a single solution.
+    Scripts using a pool of processes must protect their entry point with 'if __name__ == "__main__":'.
+    :return: the array of the depot indices of the clients"""
+    if version != "sequential" and version != "parallel":
+        print("Unexpected version : {}".format(version))
+        print("Please use 'sequential' or 'parallel'")
+        return
+    if name is None:
+        name = version + " Clarke and Wright. {} depots. Drone capacity = {}".format(len(problem.depots),
+                                                                                     parameters.drone.capacity)
+    if assignment is None:
+        assignment = depot_assignment(problem, parameters, criterion)
+    assignment = np.asarray(assignment)
+    groups = [np.flatnonzero(assignment == j) for j in range(len(problem.depots))]
+    subproblems = [problem.subproblem(indices, depot) for indices, depot in zip(groups, problem.depots)]
+
+    if verbose:
+        print("Solving the subproblems of {} depots...".format(len(problem.depots)), end=' ', flush=True)
+    arguments = (subproblems, [parameters] * len(subproblems), [version] * len(subproblems),
+                 [None] * len(subproblems), [neighbours] * len(subproblems))
+    if workers == 0:
+        results = list(map(solve_routes, *arguments))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(solve_routes, *arguments))
+
+    clients = problem.clients_list
+    deliveries_list = []
+    for indices, depot, (routes, costs_and_savings) in zip(groups, problem.depots, results):
+        for route, (cost, savings) in zip(routes, costs_and_savings):
+            delivery = pre.Delivery(pre.Route([clients[i] for i in indices[route].tolist()], depot), parameters)
+            if parameters.cost_fct:
+                delivery.set_cost_and_savings(cost, savings)
+            deliveries_list.append(delivery)
     problem.solutions_list.append(pre.Solution(name, deliveries_list, parameters))
     if verbose:
         print("done !")
         problem.solutions_list[-1].print(False)
-
+    return assignment
@@ -0,0 +1,334 @@
+"""Implements a long-running planning service: orders (clients with coordinates and demand) are received over a local
+TCP socket, batched into time windows and planned with Clarke and Wright followed by local search in a pool of
+processes, while the service keeps accepting orders. The latest plan is published to the subscribers as soon as it is
+ready. simulate_orders sends random orders to a service so that everything can be run locally (see run_simulation and
+main).
+Protocol: one JSON object per line, in both directions.
+- {"type": "order", "x": float, "y": float, "demand": int, "id": string (optional)} -> {"type": "accepted", "id": ...}
+- {"type": "cancel", "id": string} -> {"type": "cancelled", "id": ...}: the order is removed from the next plans
+- {"type": "complete", "id": string} -> {"type": "completed", "id": ...}: an order of the latest plan was delivered, it
+  is removed from the next plans
+- {"type": "plan"} -> the latest plan ({"type": "plan", "version": int, "routes": lists of order ids, ...})
+- {"type": "subscribe"} -> the latest plan, then every new plan as soon as it is published
+- {"type": "stats"} -> the statistics of the service (see PlanningService.stats)
+Command line usage: python -m pyDroneDeliv.service --port 8765 --window 1 --simulate 30 --rate 20"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+import pyDroneDeliv.local_search as ls
+
+STATS_QUANTILES = (0.5, 0.9, 0.99)  # quantiles of the solve time and of the queue latency given by stats
+logger = logging.getLogger(__name__)
+
+
+def solve_plan(depot, x, y, demand, parameters, version="parallel", improve=True, neighbours=None):
+    """Solves the problem made of the depot and of the clients described by the arrays with Clarke and Wright (see
+    processing.solve_routes) and, if improve is True, improves the routes with the inter-route and intra-route moves of
+    local_search (not with neighbours, since no cost matrix is built then). Runs in the worker processes.
+    :return: tuple (routes, cost, solve_time) where routes is the list of the routes (lists of client indices), cost
+    is their total cost (J) and solve_time the time spent (s)"""
+    start = time.perf_counter()
+    problem = pre.Problem.from_arrays(depot, x, y, demand)
+    c_matrix = pro.cost_matrix(problem, parameters) if neighbours is None and parameters.cost_fct else None
+    routes, costs_and_savings = pro.solve_routes(problem, parameters, version, c_matrix, neighbours)
+    if improve and c_matrix is not None and routes:
+        routes = ls.improve_routes(c_matrix, routes, problem.demand, parameters.drone.capacity,
+                                   ls.nearest_neighbours(c_matrix))
+        routes = [ls.improve_route(c_matrix, route) for route in routes]
+    if c_matrix is not None:
+        cost = sum(ls.route_cost(c_matrix, route) for route in routes)
+    else:
+        cost = sum(cost for cost, _ in costs_and_savings if cost is not None)
+    return routes, float(cost), time.perf_counter() - start
+
+
+class PlanningService:
+    """This class is an asyncio service planning the deliveries of the orders it receives (see the protocol at the
+    top of the module). Every 'window' seconds, if orders arrived or were removed (cancelled or completed) and no solve
+    is running, all the open orders are planned again in a pool of processes (workers processes, os.cpu_count() if
+    None, workers=0 solves in a thread of the current process). Orders keep being accepted while a solve runs: they go
+    to the next window.
+    Scripts using a pool of processes must protect their entry point with 'if __name__ == "__main__":'."""
+
+    def __init__(self, depot, parameters, window=1., version="parallel", improve=True, neighbours=None, workers=None,
+                 host="127.0.0.1", port=0):
+        self.depot = depot  # instance of class Depot
+        self.parameters = parameters  # instance of class DeliveryParameters
+        self.window = window  # float. Duration of a batching window (s).
+        self.version = version  # version of Clarke and Wright ("sequential" or "parallel")
+        self.improve = improve  # boolean. If True, the routes are improved by local search (see solve_plan).
+        self.neighbours = neighbours  # int or None. See processing.granular_savings.
+        self.workers = workers
+        self.host = host
+        self.port = port  # int. 0 lets the system choose a free port (the chosen one is stored by start).
+        self.plan = None  # latest plan (dictionary) or None
+        self._orders = dict()  # identifier -> (x, y, demand) of the open orders (pending or planned)
+        self._pending = []  # tuples (identifier, reception time) of the orders waiting for the next window
+        self._planned = set()  # identifiers of the orders of the latest plan
+        self._changed = False  # True if orders were removed since the last solve started
+        self._subscribers = set()  # asyncio.StreamWriter of the subscribed connections
+        self._connections = dict()  # asyncio.StreamWriter -> task handling the connection
+        self._solving = None  # task of the running solve or None
+        self._server = self._executor = self._batcher = None
+        self._started = None
+        self.orders = 0  # int. Number of orders accepted.
+        self.solves = 0  # int. Number of plans published.
+        self.failures = 0  # int. Number of solves that raised an exception.
+        self.removed = 0  # int. Number of orders cancelled or completed.
+        # time from the reception of an order to its first plan (s) and time spent by the workers on a solve (s)
+        self.queue_latency = pro.RunningStatistics(STATS_QUANTILES)
+        self.solve_time = pro.RunningStatistics(STATS_QUANTILES)
+
+    async def start(self):
+        """Starts the server and the batching loop."""
+        if self.version not in ("sequential", "parallel"):
+            raise ValueError("Unexpected version : {}. Please use 'sequential' or 'parallel'".format(self.version))
+        self._executor = ProcessPoolExecutor(self.workers) if self.workers != 0 else None
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.monotonic()
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+
+    async def stop(self):
+        """Stops the server, waits for the running solve and shuts the pool of processes down."""
+        self._batcher.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+        if self._solving is not None:
+            await asyncio.gather(self._solving, return_exceptions=True)
+        for writer in list(self._connections):
+            writer.close()  # the handlers read the end of the stream and return
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def submit(self, x, y, demand, identifier=None):
+        """Accepts an order and returns its identifier ("order X" with X = number of orders if identifier is None).
+        A ValueError is raised (and the order is not counted) if a coordinate is not a finite number, if the demand
+        is not an integer between 1 and the capacity of the drone or if an open order already has this identifier."""
+        x, y, demand_value = float(x), float(y), float(demand)
+        if not (math.isfinite(x) and math.isfinite(y)):
+            raise ValueError("Unexpected coordinates : ({}, {}). Please use finite numbers".format(x, y))
+        if isinstance(demand, bool) or not demand_value.is_integer() or \
+                not 0 < demand_value <= self.parameters.drone.capacity:
+            raise ValueError("Unexpected demand : {}. Please use an integer between 1 and the capacity of the drone "
+                             "({})".format(demand, self.parameters.drone.capacity))
+        if identifier is None:
+            identifier = "order {}".format(self.orders + 1)
+        identifier = str(identifier)
+        if identifier in self._orders:
+            raise ValueError("Unexpected id : {}. Please use an id that no open order has".format(identifier))
+        self.orders += 1
+        self._orders[identifier] = (x, y, int(demand_value))
+        self._pending.append((identifier, time.monotonic()))
+        return identifier
+
+    def remove(self, identifier, completed=False):
+        """Removes an open order: it was cancelled or, if completed is True, delivered (it must then be in the latest
+        plan). The open orders are planned again in the next window. Raises a ValueError if there is no such order."""
+        identifier = str(identifier)
+        if identifier not in self._orders or (completed and identifier not in self._planned):
+            raise ValueError("Unexpected id : {}. Please use the id of an open order{}".format(
+                identifier, " of the latest plan" if completed else ""))
+        del self._orders[identifier]
+        self._pending = [order for order in self._pending if order[0] != identifier]
+        self._planned.discard(identifier)
+        self._changed = True
+        self.removed += 1
+        return identifier
+
+    def stats(self):
+        """Returns the statistics of the service as a dictionary: orders accepted, open, pending, planned and removed,
+        plans published, failed solves, solves per second (since the start), solve time and queue latency (mean and
+        quantiles in s)."""
+        uptime = time.monotonic() - self._started if self._started is not None else 0.
+        q = STATS_QUANTILES
+        return {"type": "stats", "uptime": uptime, "orders": self.orders, "open": len(self._orders),
+                "pending": len(self._pending), "planned": len(self._planned), "removed": self.removed,
+                "solves": self.solves, "failures": self.failures,
+                "solves per second": self.solves / uptime if uptime > 0 else 0.,
+                "solve time": self.solve_time.summary(q), "queue latency": self.queue_latency.summary(q)}
+
+    async def _batch_loop(self):
+        while True:
+            await asyncio.sleep(self.window)
+            if (self._pending or self._changed) and self._solving is None:
+                batch, self._pending, self._changed = self._pending, [], False
+                self._solving = asyncio.ensure_future(self._solve(batch))
+
+    async def _solve(self, batch):
+        """Plans the open orders (the ones of the previous plans and the ones of the batch). If the solve raises an
+        exception, it is logged and the batch goes back to the pending orders, so that it is planned again in the next
+        window. The orders removed while the solve runs are left out of the plan, and planned again without them in
+        the next window."""
+        try:
+            identifiers = list(self._orders)
+            routes, cost, solve_time = [], 0., 0.
+            if identifiers:
+                x, y, demand = (np.array(values) for values in zip(*self._orders.values()))
+                loop = asyncio.get_running_loop()
+                try:
+                    routes, cost, solve_time = await loop.run_in_executor(
+                        self._executor, solve_plan, self.depot, x, y, demand, self.parameters, self.version,
+                        self.improve, self.neighbours)
+                except Exception:
+                    self.failures += 1
+                    logger.exception("The solve of %d orders failed. Its %d new orders are planned again in the next "
+                                     "window.", len(identifiers), len(batch))
+                    self._pending[:0] = [order for order in batch if order[0] in self._orders]
+                    self._changed = True
+                    return
+            self.solves += 1
+            self.solve_time.update(solve_time)
+            now = time.monotonic()
+            for identifier, received in batch:
+                if identifier in self._orders:
+                    self.queue_latency.update(now - received)
+            routes = [[identifiers[i] for i in route if identifiers[i] in self._orders] for route in routes]
+            routes = [route for route in routes if route]
+            self._planned = {identifier for route in routes for identifier in route}
+            self.plan = {"type": "plan", "version": self.solves, "clients": len(self._planned), "cost": cost,
+                         "solve time": solve_time, "routes": routes}
+            await self._publish()
+        finally:
+            self._solving = None
+
+    async def _publish(self):
+        message = (json.dumps(self.plan) + "\n").encode()
+        for writer in list(self._subscribers):
+            try:
+                writer.write(message)
+                await writer.drain()
+            except (ConnectionError, RuntimeError):
+                self._subscribers.discard(writer)
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((json.dumps(self._answer(line, writer)) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def _answer(self, line, writer):
+        """Returns the answer (dictionary) to a request (line of JSON)."""
+        try:
+            request = json.loads(line)
+            kind = request.get("type")
+            if kind == "order":
+                return {"type": "accepted", "id": self.submit(request["x"], request["y"], request["demand"],
+                                                              request.get("id"))}
+            if kind == "cancel" or kind == "complete":
+                answer = "cancelled" if kind == "cancel" else "completed"
+                return {"type": answer, "id": self.remove(request["id"], kind == "complete")}
+            if kind == "plan" or kind == "subscribe":
+                if kind == "subscribe":
+                    self._subscribers.add(writer)
+                return self.plan if self.plan is not None else {"type": "plan", "version": 0, "routes": []}
+            if kind == "stats":
+                return self.stats()
+            raise ValueError("Unexpected type : {}. Please use 'order', 'cancel', 'complete', 'plan', 'subscribe' or "
+                             "'stats'".format(kind))
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return {"type": "error", "message": "{}: {}".format(type(error).__name__, error)}
+
+
+async def simulate_orders(host, port, rate=10., duration=10., x=(-6000, 6000), y=(-3500, 3500), demand=(5, 60),
+                          rng=0):
+    """Sends random orders to a service for duration seconds. The orders arrive like a Poisson process of 'rate'
+    orders per second, their coordinates are uniform in the rectangle given by x and y and their demands are integers
+    between the bounds of demand (inclusive). rng is a numpy random generator or a seed.
+    :return: the number of orders accepted by the service"""
+    rng = np.random.default_rng(rng)
+    reader, writer = await asyncio.open_connection(host, port)
+    accepted = 0
+    end = time.monotonic() + duration
+    try:
+        while True:
+            await asyncio.sleep(rng.exponential(1 / rate))
+            if time.monotonic() > end:
+                break
+            order = {"type": "order", "x": float(rng.uniform(*x)), "y": float(rng.uniform(*y)),
+                     "demand": int(rng.integers(demand[0], demand[1] + 1))}
+            writer.write((json.dumps(order) + "\n").encode())
+            await writer.drain()
+            if json.loads(await reader.readline()).get("type") == "accepted":
+                accepted += 1
+    finally:
+        writer.close()
+    return accepted
+
+
+async def run_simulation(service, duration=10., rate=10., rng=0, verbose=True):
+    """Starts a service, sends it simulated orders for duration seconds (see simulate_orders), waits for the plan of
+    the last orders and stops the service.
+    :return: tuple (plan, stats) of the last plan and of the statistics of the service"""
+    await service.start()
+    try:
+        accepted = await simulate_orders(service.host, service.port, rate, duration, rng=rng)
+        while service._pending or service._changed or service._solving is not None:  # the last orders are planned
+            await asyncio.sleep(service.window / 10)
+        if verbose:
+            print("{} orders accepted, {} plans published".format(accepted, service.solves))
+        return service.plan, service.stats()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    """Command line entry point. Runs a service on a local port. With --simulate, random orders are sent to it for the
+    given number of seconds, the statistics are printed and the service stops."""
+    parser = argparse.ArgumentParser(description="Order intake and planning service of pyDroneDeliv.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--window", type=float, default=1., help="batching window (s)")
+    parser.add_argument("--version", default="parallel", choices=("sequential", "parallel"))
+    parser.add_argument("--workers", type=int, default=None, help="processes of the pool (0 = no pool)")
+    parser.add_argument("--no-improve", action="store_true", help="don't improve the routes with local search")
+    parser.add_argument("--neighbours", type=int, default=None, help="granular savings (see granular_savings)")
+    parser.add_argument("--wind", type=float, nargs=2, default=(0., 0.), help="x and y speeds of the wind (m.s-1)")
+    parser.add_argument("--simulate", type=float, default=None, help="duration of a simulation (s)")
+    parser.add_argument("--rate", type=float, default=10., help="orders per second of the simulation")
+    arguments = parser.parse_args(argv)
+
+    parameters = pre.DeliveryParameters(pre.Drone(450, 13.2, 0.018), pre.Wind(*arguments.wind), pro.cost_b)
+    service = PlanningService(pre.Depot("depot", 0, 0), parameters, arguments.window, arguments.version,
+                              not arguments.no_improve, arguments.neighbours, arguments.workers, arguments.host,
+                              arguments.port)
+    if arguments.simulate is not None:
+        plan, stats = asyncio.run(run_simulation(service, arguments.simulate, arguments.rate))
+        print(json.dumps(stats, indent=2))
+        return 0
+
+    async def serve():
+        await service.start()
+        print("Listening on {}:{}".format(service.host, service.port))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await service.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -14,31 +14,16 @@ wind1 = pre.Wind(0, 0)
 param1 = pre.DeliveryParameters(drone1, wind1, pro.cost_b)
 param2 = pre.DeliveryParameters(drone2, wind1, pro.cost_b)
 
-problem_g = pre.Problem()
-problem_g.import_csv('pb250_b.csv')
-
-best_cost = float('inf')
-limit = 0
-for i in range(5, 151):
-    clients_list_1 = []
-    clients_list_2 = []
-    for client in problem_g.clients_list:
-        if client.demand > i:
-            clients_list_2.append(client)
-        else:
-            clients_list_1.append(client)
-    problem1 = pre.Problem(problem_g.depot, clients_list_1)
-    problem2 = pre.Problem(problem_g.depot, clients_list_2)
-    init_1 = pro.clarke_and_wright_init(problem1, param1)
-    init_2 = pro.clarke_and_wright_init(problem2, param2)
-    deliveries_1 = pro.parallel_build_deliveries(problem1, param1, *init_1)
-    deliveries_2 = pro.parallel_build_deliveries(problem2, param2, *init_2)
-    solution1 = pre.Solution("drone1", deliveries_1, param1)
-    solution2 = pre.Solution("drone2", deliveries_2, param2)
-    if solution1.cost_and_savings()[0] + solution2.cost_and_savings()[0] < best_cost:
-        best_cost = solution1.cost_and_savings()[0] + solution2.cost_and_savings()[0]
-        limit = i
-    print(limit, best_cost)
+if __name__ == "__main__":  # partition_sweep solves the partitions in a pool of processes
+    problem_g = pre.Problem()
+    problem_g.import_csv('pb250_b.csv')
+
+    # clients with a demand lower or equal to the threshold are delivered by drone1, the others by drone2
+    thresholds = range(5, 151)
+    costs, limit, solutions = pro.partition_sweep(problem_g, param1, param2, thresholds)
+    for threshold, cost in zip(thresholds, costs):
+        print(threshold, cost)
+    print(limit, costs.min())
 
 # min = float('inf')
 # max = 0
@@ -0,0 +1,9 @@
+"""The modules of Implementation are imported as the package pyDroneDeliv, like in the use cases."""
+import os
+import sys
+import types
+
+if "pyDroneDeliv" not in sys.modules:
+    package = types.ModuleType("pyDroneDeliv")
+    package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Implementation")]
+    sys.modules["pyDroneDeliv"] = package
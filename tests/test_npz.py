@@ -0,0 +1,64 @@
+"""Round trips of problems and solutions through Problem.export_npz and Problem.import_npz."""
+import numpy as np
+import pytest
+
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+
+
+def make_problem():
+    clients = [pre.Client("Client {}".format(i), x, y, 1) for i, (x, y) in
+               enumerate([(1000, 0), (0, 1500), (-800, -300), (2000, 2000), (-1500, 1200)])]
+    return pre.Problem(pre.Depot("Depot", 0, 0), clients)
+
+
+def round_trip(problem, tmp_path):
+    file_name = str(tmp_path / "problem.npz")
+    problem.export_npz(file_name)
+    loaded = pre.Problem()
+    loaded.import_npz(file_name)
+    return loaded
+
+
+def describe(problem, solution):
+    """Returns the routes (lists of client indices), the parameters and the costs of the deliveries of a solution."""
+    def parameters_values(parameters):
+        return (parameters.drone.capacity, parameters.drone.speed, parameters.drone.acd, parameters.wind.x,
+                parameters.wind.y, parameters.cost_fct)
+    return [(problem.client_indices(delivery.clients_list).tolist(), parameters_values(delivery.parameters),
+             delivery.cost_and_savings()) for delivery in solution.deliveries_list]
+
+
+def test_solution_without_parameters(tmp_path):
+    problem = make_problem()
+    parameters = pre.DeliveryParameters(pre.Drone(3, 10, 0.5), pre.Wind(2, -1), pro.cost_b)
+    clients = problem.clients_list
+    problem.solutions_list.append(pre.Solution("No parameters", [
+        pre.Delivery(pre.Route(clients[:3], problem.depots[0]), parameters),
+        pre.Delivery(pre.Route(clients[3:], problem.depots[0]), parameters)]))
+    loaded = round_trip(problem, tmp_path)
+    solution = loaded.solutions_list[0]
+    assert solution.name == "No parameters" and solution.parameters is None
+    assert describe(loaded, solution) == describe(problem, problem.solutions_list[0])
+
+
+def test_deliveries_with_their_own_parameters(tmp_path):
+    problem = make_problem()
+    wind_field = pre.WindField.from_function(lambda x, y: (1 + x / 1000., -y / 2000.),
+                                             np.linspace(-3000, 3000, 4), np.linspace(-3000, 3000, 3), samples=8)
+    solution_parameters = pre.DeliveryParameters(pre.Drone(3, 10, 0.5), pre.Wind(2, -1), pro.cost_b)
+    other_parameters = pre.DeliveryParameters(pre.Drone(2, 12, 0.3), wind_field, pro.cost_a)
+    clients = problem.clients_list
+    problem.solutions_list.append(pre.Solution("Mixed parameters", [
+        pre.Delivery(pre.Route(clients[:3], problem.depots[0]), solution_parameters),
+        pre.Delivery(pre.Route(clients[3:], problem.depots[0]), other_parameters)], solution_parameters))
+    loaded = round_trip(problem, tmp_path)
+    solution = loaded.solutions_list[0]
+    first, second = solution.deliveries_list
+    assert solution.parameters is first.parameters and second.parameters is not first.parameters
+    assert isinstance(second.parameters.wind, pre.WindField)
+    assert second.parameters.wind.samples == 8
+    assert describe(loaded, solution) == describe(problem, problem.solutions_list[0])
+    expected = pro.cost_a(pre.Point("", 0, 0), clients[3], other_parameters.drone, wind_field)
+    assert pro.cost_a(pre.Point("", 0, 0), loaded.clients_list[3], second.parameters.drone,
+                      second.parameters.wind) == pytest.approx(expected)
@@ -0,0 +1,82 @@
+"""Regression tests against the routes of the original Clarke and Wright implementation.
+data/baseline_routes.json holds random problems drawn like in the use cases (the drones of Choosing_the_best_drone with
+a wind from the west and the drones of the Partitioning use cases without wind) and the routes that the original
+implementation found for them.
+Equal savings are frequent (cost_b is symmetric). The original implementation processed them in the order given by
+numpy's default argsort, while they are now processed by client indices (see sort_savings), so the routes are only
+compared up to that order: the sequential version finds the same routes, possibly reversed and in another order, and
+the parallel version, whose merges depend on the order of the ties, finds solutions of about the same cost.
+The cost matrix is computed point by point, like the original implementation did."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+import pyDroneDeliv.pre_processing as pre
+import pyDroneDeliv.processing as pro
+
+with open(os.path.join(os.path.dirname(__file__), "data", "baseline_routes.json")) as file:
+    CASES = json.load(file)
+CASE_IDS = ["{}-{}".format(case["cost_fct"], i) for i, case in enumerate(CASES)]
+
+
+def make_problem(case):
+    clients = [pre.Client("Client {}".format(i), x, y, demand)
+               for i, (x, y, demand) in enumerate(zip(case["x"], case["y"], case["demand"]))]
+    parameters = pre.DeliveryParameters(pre.Drone(*case["drone"]), pre.Wind(*case["wind"]),
+                                        getattr(pro, case["cost_fct"]))
+    return pre.Problem(pre.Depot("Depot", 0, 0), clients), parameters
+
+
+def solve(case, version, mode="indices"):
+    """Returns the routes (lists of client indices) and the cost of the solution found by Clarke and Wright."""
+    problem, parameters = make_problem(case)
+    c_matrix = pro.cost_matrix(problem, parameters, vectorized=False)
+    init = pro.clarke_and_wright_init(problem, parameters, mode, version == "parallel", c_matrix)
+    if mode == "stream":
+        init = (init, None)
+    deliveries_list = pro.build_deliveries(problem, parameters, version, *init,
+                                           cost_table=pro.cost_table(problem, parameters, c_matrix))
+    index = {id(client): i for i, client in enumerate(problem.clients_list)}
+    routes = [[index[id(client)] for client in delivery.route.clients_list] for delivery in deliveries_list]
+    return routes, pre.Solution("", deliveries_list, parameters).cost_and_savings()[0]
+
+
+def route_set(routes):
+    """Returns the routes as a sorted list, each route being taken in the direction that starts with its lowest end."""
+    return sorted(min(route, route[::-1]) for route in routes)
+
+
+@pytest.mark.parametrize("case", CASES, ids=CASE_IDS)
+def test_sequential_routes(case):
+    routes, cost = solve(case, "sequential")
+    assert route_set(routes) == route_set(case["sequential"]["routes"])
+    assert cost == pytest.approx(case["sequential"]["cost"], rel=1e-9)
+
+
+@pytest.mark.parametrize("case", CASES, ids=CASE_IDS)
+def test_parallel_routes(case):
+    routes, cost = solve(case, "parallel")
+    assert sorted(client for route in routes for client in route) == list(range(len(case["x"])))
+    assert all(sum(case["demand"][client] for client in route) <= case["drone"][0] for route in routes)
+    assert cost == pytest.approx(case["parallel"]["cost"], rel=0.05)
+
+
+@pytest.mark.parametrize("version", ["sequential", "parallel"])
+@pytest.mark.parametrize("case", CASES[:3] + CASES[-3:], ids=CASE_IDS[:3] + CASE_IDS[-3:])
+def test_modes_find_the_same_routes(case, version):
+    assert solve(case, version, "stream") == solve(case, version, "indices") == solve(case, version, "clients")
+
+
+def test_sort_savings_breaks_ties_by_indices():
+    rng = np.random.default_rng(0)
+    first, second = rng.integers(0, 20, 500).astype(np.int32), rng.integers(0, 20, 500).astype(np.int32)
+    savings = rng.integers(0, 5, 500).astype(float)
+    expected = sorted(zip(savings.tolist(), first.tolist(), second.tolist()), key=lambda t: (-t[0], t[1], t[2]))
+    shuffled = rng.permutation(500)
+    for arrays in [(first, second, savings), (first[shuffled], second[shuffled], savings[shuffled])]:
+        assert list(zip(*(array.tolist() for array in pro.sort_savings(*arrays)))) == expected
+    assert list(pro.stream_sorted_savings([pro.sort_savings(first[:200], second[:200], savings[:200]),
+                                           pro.sort_savings(first[200:], second[200:], savings[200:])],
+                                          chunk_size=16)) == expected